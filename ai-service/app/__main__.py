@@ -0,0 +1,53 @@
+"""
+生产启动入口
+
+    python -m app [--host 0.0.0.0] [--port 8000] [--workers N]
+
+- 已安装 uvloop / httptools（uvicorn[standard]）时使用它们，否则退回 asyncio / h11
+- 多个 worker 时每个进程独立运行 lifespan 预热，会话状态（WebSocket 帧队列、进行中的视频任务）
+  按进程隔离；同一会话的请求需要落在同一个进程上（WebSocket 本身是单连接，不受影响）
+- 日志交给 app.log_config（log_config=None，uvicorn 的 access/error 日志也经后台线程输出）
+"""
+import argparse
+import importlib.util
+from pathlib import Path
+
+import uvicorn
+from dotenv import load_dotenv
+
+# 与 app.main 一致：先加载项目根目录的 .env，再读取配置
+load_dotenv(dotenv_path=Path(__file__).parent.parent.parent / ".env")
+
+from app.config import settings
+from app.log_config import setup_logging
+
+
+def _available(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app", description="Run the StreamMind AI service")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=settings.service_port)
+    parser.add_argument("--workers", type=int, default=settings.service_workers)
+    parser.add_argument("--no-access-log", action="store_true")
+    args = parser.parse_args(argv)
+
+    setup_logging()
+    log_level = settings.log_level.lower()
+    uvicorn.run(
+        "app.main:app",
+        host=args.host,
+        port=args.port,
+        workers=max(1, args.workers),
+        loop="uvloop" if _available("uvloop") else "asyncio",
+        http="httptools" if _available("httptools") else "h11",
+        log_config=None,
+        log_level="warning" if log_level == "warn" else log_level,
+        access_log=not args.no_access_log,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -11,19 +11,136 @@ class Settings(BaseSettings):
         "QWEN_API_URL",
         "https://dashscope.aliyuncs.com/api/v1/services/aigc/multimodal-generation/generation"
     )
+    # API Key 池：逗号分隔，每项为 key[|endpoint[|weight]]，为空时只使用 QWEN_API_KEY
+    qwen_api_keys: str = os.getenv("QWEN_API_KEYS", "")
+    qwen_key_strategy: str = os.getenv("QWEN_KEY_STRATEGY", "least_loaded")  # least_loaded / weighted
+    qwen_key_cooldown_seconds: float = float(os.getenv("QWEN_KEY_COOLDOWN_SECONDS", "30"))
+    qwen_key_rpm_limit: int = int(os.getenv("QWEN_KEY_RPM_LIMIT", "0"))  # 每个 key 每分钟请求上限，0 表示不限制
+    # 限流后所有 key 都在冷却中时，重试前最多等待的秒数；冷却更久则不重试，直接返回限流错误
+    qwen_throttle_max_wait_seconds: float = float(os.getenv("QWEN_THROTTLE_MAX_WAIT_SECONDS", "10"))
+    # 录制/回放 Qwen SSE 流量（离线压测用），回放优先于录制
+    qwen_record_dir: str = os.getenv("QWEN_RECORD_DIR", "")
+    qwen_replay_dir: str = os.getenv("QWEN_REPLAY_DIR", "")
+    qwen_replay_speed: float = float(os.getenv("QWEN_REPLAY_SPEED", "1.0"))  # 0 表示不等待
+    qwen_replay_strict: bool = os.getenv("QWEN_REPLAY_STRICT", "false").lower() == "true"
 
     # Spring Boot gRPC Configuration
     spring_boot_grpc_host: str = os.getenv("SPRING_BOOT_GRPC_HOST", "localhost")
     spring_boot_grpc_port: int = int(os.getenv("SPRING_BOOT_GRPC_PORT", "9090"))
+    # gRPC channel 池：channel 数（独立连接、轮询）、keepalive 间隔（0 关闭）、调用超时、
+    # 达到该字节数的内容使用 gzip 压缩（0 关闭）、最大消息大小
+    grpc_channels: int = int(os.getenv("GRPC_CHANNELS", "4"))
+    grpc_keepalive_seconds: float = float(os.getenv("GRPC_KEEPALIVE_SECONDS", "30"))
+    grpc_timeout_seconds: float = float(os.getenv("GRPC_TIMEOUT_SECONDS", "10"))
+    grpc_compression_min_bytes: int = int(os.getenv("GRPC_COMPRESSION_MIN_BYTES", "1024"))
+    grpc_max_message_mb: int = int(os.getenv("GRPC_MAX_MESSAGE_MB", "4"))
 
     # Service Configuration
     service_port: int = int(os.getenv("PYTHON_SERVICE_PORT", "8000"))
+    service_workers: int = int(os.getenv("SERVICE_WORKERS", "1"))  # python -m app 启动的 worker 进程数
+    # 启动时预热外部依赖（gRPC、DashScope、Minio、ffmpeg），每项最多等待的秒数
+    startup_warm_up: bool = os.getenv("STARTUP_WARM_UP", "true").lower() == "true"
+    startup_warm_up_timeout_seconds: float = float(os.getenv("STARTUP_WARM_UP_TIMEOUT_SECONDS", "5"))
+    # WebSocket 会话最多排队的帧数，0 表示不限制（每一帧都分析）；
+    # 大于 0 时发送比分析快会丢弃最旧的帧，只分析最新画面，并通知客户端跳过了哪些帧
+    ws_frame_queue_size: int = int(os.getenv("WS_FRAME_QUEUE_SIZE", "0"))
+    # /ready 就绪阈值（超过任一项返回 503），0 表示不检查该项
+    ready_max_sessions: int = int(os.getenv("READY_MAX_SESSIONS", "0"))
+    ready_max_pending_windows: int = int(os.getenv("READY_MAX_PENDING_WINDOWS", "0"))
+    ready_max_queue_wait_seconds: float = float(os.getenv("READY_MAX_QUEUE_WAIT_SECONDS", "10"))
+    ready_max_qwen_in_flight: int = int(os.getenv("READY_MAX_QWEN_IN_FLIGHT", "0"))
+    ready_max_grpc_in_flight: int = int(os.getenv("READY_MAX_GRPC_IN_FLIGHT", "256"))
+    ready_max_ffmpeg_processes: int = int(os.getenv("READY_MAX_FFMPEG_PROCESSES") or os.cpu_count() or 4)
+    ready_min_free_disk_mb: float = float(os.getenv("READY_MIN_FREE_DISK_MB", "1024"))
     log_level: str = os.getenv("LOG_LEVEL", "INFO")
+    # 日志输出：text / json；经后台线程输出（不阻塞事件循环）；热路径日志每个类别每秒上限，0 表示不限
+    log_format: str = os.getenv("LOG_FORMAT", "text")
+    log_queue: bool = os.getenv("LOG_QUEUE", "true").lower() == "true"
+    log_sample_per_second: float = float(os.getenv("LOG_SAMPLE_PER_SECOND", "5"))
+    # 管理端点（/admin/*，例如性能分析）的访问令牌，为空时管理端点关闭
+    admin_token: str = os.getenv("ADMIN_TOKEN", "")
 
     # AI Model Configuration
     ai_model_name: str = "qwen-vl-max"  # 重命名避免与 pydantic 的 model_ 命名空间冲突
     max_retries: int = 3
     timeout_seconds: int = 120
+    # 模型分级路由：画面变化小的请求先用快速模型，回答太短或低置信度时升级到 ai_model_name；为空时不路由
+    qwen_fast_model: str = os.getenv("QWEN_FAST_MODEL", "")
+    router_fast_max_change: float = float(os.getenv("ROUTER_FAST_MAX_CHANGE", "0.5"))  # 平均像素差（0-255）
+    router_min_chars: int = int(os.getenv("ROUTER_MIN_CHARS", "20"))
+
+    # 媒体元数据缓存：内存 LRU 条数；是否在视频旁写入 .probe.json 以便重启后复用
+    media_probe_cache_size: int = int(os.getenv("MEDIA_PROBE_CACHE_SIZE", "256"))
+    media_probe_sidecar: bool = os.getenv("MEDIA_PROBE_SIDECAR", "false").lower() == "true"
+
+    # 窗口转码配置：source / analysis / analysis-low / auto（按时长选择）
+    # 默认 source 与原来的输出一致；降低分辨率/帧率会影响分析质量，需要时显式选择
+    video_transcode_profile: str = os.getenv("VIDEO_TRANSCODE_PROFILE", "source")
+    video_profile_low_after_seconds: float = float(os.getenv("VIDEO_PROFILE_LOW_AFTER_SECONDS", "600"))
+
+    # 窗口发送方式：video（切片 MP4 上传 Minio 后按 URL 分析）/ frames（抽取代表帧内联发送，不经过 Minio）
+    video_window_mode: str = os.getenv("VIDEO_WINDOW_MODE", "video")
+    video_frames_per_window: int = int(os.getenv("VIDEO_FRAMES_PER_WINDOW", "8"))
+    video_frame_sampling: str = os.getenv("VIDEO_FRAME_SAMPLING", "uniform")  # uniform / scene
+    video_frame_max_edge: int = int(os.getenv("VIDEO_FRAME_MAX_EDGE", "1280"))
+    video_frame_quality: int = int(os.getenv("VIDEO_FRAME_QUALITY", "5"))  # ffmpeg -q:v，2=最好，31=最差
+
+    # 静止窗口跳过：相邻采样帧最大像素差（0-255）低于阈值的窗口不调用模型
+    video_skip_static_windows: bool = os.getenv("VIDEO_SKIP_STATIC_WINDOWS", "true").lower() == "true"
+    video_static_threshold: float = float(os.getenv("VIDEO_STATIC_THRESHOLD", "16"))
+    video_activity_fps: float = float(os.getenv("VIDEO_ACTIVITY_FPS", "2"))
+
+    # 窗口规划：fixed（固定 15 秒窗口、10 秒步长）/ adaptive（在场景切换处切分，时长在最小/最大值之间）
+    video_window_planner: str = os.getenv("VIDEO_WINDOW_PLANNER", "fixed")
+    video_window_min_seconds: float = float(os.getenv("VIDEO_WINDOW_MIN_SECONDS", "8"))
+    video_window_max_seconds: float = float(os.getenv("VIDEO_WINDOW_MAX_SECONDS", "30"))
+    video_scene_cut_threshold: float = float(os.getenv("VIDEO_SCENE_CUT_THRESHOLD", "20"))  # 相邻帧平均像素差（0-255）
+
+    # 差量窗口：每个窗口只发送上一个窗口之后的新片段，附带上一段结束时的画面（锚点帧）和摘要衔接；
+    # 新片段短于最小时长时向前补齐
+    video_differential_windows: bool = os.getenv("VIDEO_DIFFERENTIAL_WINDOWS", "false").lower() == "true"
+    video_differential_min_seconds: float = float(os.getenv("VIDEO_DIFFERENTIAL_MIN_SECONDS", "2"))
+
+    # 增量录制分析：分块上传的录制文件目录、等待新数据的轮询间隔、多久没有新数据视为录制结束
+    ingest_dir: str = os.getenv("INGEST_DIR", "./temp_recordings")
+    ingest_poll_seconds: float = float(os.getenv("INGEST_POLL_SECONDS", "2"))
+    ingest_idle_timeout_seconds: float = float(os.getenv("INGEST_IDLE_TIMEOUT_SECONDS", "300"))
+    # 分析结束后结果保留多久（录制因超时结束时，之后的 complete 仍能取回结果）
+    ingest_result_ttl_seconds: float = float(os.getenv("INGEST_RESULT_TTL_SECONDS", "600"))
+
+    # 延后分析（deferred=true）：持久化队列目录、默认截止时间、低峰时段（本地时间，如 "0-7,22-24"）、
+    # 非低峰时段允许启动的负载上限（/ready 的 load_score）、同时运行的任务数、距截止多久时不论负载立即执行
+    deferred_queue_dir: str = os.getenv("DEFERRED_QUEUE_DIR", "./deferred_jobs")
+    deferred_default_deadline_hours: float = float(os.getenv("DEFERRED_DEFAULT_DEADLINE_HOURS", "24"))
+    deferred_off_peak_hours: str = os.getenv("DEFERRED_OFF_PEAK_HOURS", "")
+    deferred_max_load: float = float(os.getenv("DEFERRED_MAX_LOAD", "0.5"))
+    deferred_concurrency: int = int(os.getenv("DEFERRED_CONCURRENCY", "2"))
+    deferred_deadline_margin_seconds: float = float(os.getenv("DEFERRED_DEADLINE_MARGIN_SECONDS", "1800"))
+    deferred_poll_seconds: float = float(os.getenv("DEFERRED_POLL_SECONDS", "5"))
+    deferred_max_attempts: int = int(os.getenv("DEFERRED_MAX_ATTEMPTS", "3"))
+    # 失败后重新排队的等待时间（秒），每多失败一次翻倍
+    deferred_retry_backoff_seconds: float = float(os.getenv("DEFERRED_RETRY_BACKOFF_SECONDS", "60"))
+
+    # 窗口上传方式：file（切片写入 temp_windows 后上传）/ stream（FFmpeg 输出分片 MP4 经管道直接分片上传，不落盘）
+    video_upload_mode: str = os.getenv("VIDEO_UPLOAD_MODE", "file")
+
+    # 分析结果缓存：内存 LRU + 可选磁盘目录；上下文深度为负数时全部上下文参与缓存键
+    result_cache_enabled: bool = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+    result_cache_size: int = int(os.getenv("RESULT_CACHE_SIZE", "1024"))
+    result_cache_ttl_seconds: float = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "86400"))
+    result_cache_dir: str = os.getenv("RESULT_CACHE_DIR", "")
+    result_cache_context_depth: int = int(os.getenv("RESULT_CACHE_CONTEXT_DEPTH", "-1"))
+    # 实时帧的上下文条数，默认与 RESULT_CACHE_CONTEXT_DEPTH 相同。提示词要求只描述相对历史的变化，
+    # 上下文不同时正确回答也不同；调小（例如 2）或设为 0 是以准确性换命中率的显式选择
+    result_cache_frame_context_depth: int = int(
+        os.getenv("RESULT_CACHE_FRAME_CONTEXT_DEPTH") or os.getenv("RESULT_CACHE_CONTEXT_DEPTH") or "-1"
+    )
+
+    # Tracing：导出器逗号分隔（memory / jsonl / otlp），为空关闭追踪
+    trace_exporters: str = os.getenv("TRACE_EXPORTERS", "memory")
+    trace_buffer_size: int = int(os.getenv("TRACE_BUFFER_SIZE", "10000"))
+    trace_file: str = os.getenv("TRACE_FILE", "./traces/spans.jsonl")
+    trace_otlp_endpoint: str = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
 
     # Minio Configuration (S3 Compatible)
     minio_endpoint: str = os.getenv("MINIO_ENDPOINT", "https://minio-api.supanx.net")
@@ -31,6 +148,7 @@ class Settings(BaseSettings):
     minio_access_key: str = os.getenv("MINIO_ACCESS_KEY", "")
     minio_secret_key: str = os.getenv("MINIO_SECRET_KEY", "")
     minio_public_url: str = os.getenv("MINIO_PUBLIC_URL", "https://minio-api.supanx.net/test/")
+    minio_part_size_mb: int = int(os.getenv("MINIO_PART_SIZE_MB", "8"))  # 流式上传分片大小（不小于 5）
 
     class Config:
         env_file = "../.env"  # 指向项目根目录的 .env 文件
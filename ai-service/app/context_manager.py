@@ -2,6 +2,8 @@ import logging
 from typing import Dict, List, Optional
 from collections import deque
 
+from app.log_config import sampled
+
 logger = logging.getLogger(__name__)
 
 class ContextManager:
@@ -58,7 +60,10 @@ class ContextManager:
         }
 
         self.contexts[session_id].append(message)
-        logger.debug(f"Added to context for session {session_id}, total messages: {len(self.contexts[session_id])}")
+        logger.debug(
+            "Added to context for session %s, total messages: %d", session_id, len(self.contexts[session_id]),
+            extra=sampled("context.add")
+        )
 
     def clear_context(self, session_id: str):
         """
@@ -0,0 +1,439 @@
+"""
+Deferred Queue - 不需要立即出结果的视频分析：持久化排队，错峰执行
+
+/analyze-video 带 deferred=true 时任务写入本地队列（DEFERRED_QUEUE_DIR，每个任务一个 JSON 文件，
+服务重启后继续，多个 worker 进程共享同一个队列、每个任务只由一个进程执行），立即返回。调度器按截止时间从早到晚取任务，满足以下任一条件时开始执行：
+- 当前处于低峰时段（DEFERRED_OFF_PEAK_HOURS，服务器本地时间）：最多同时运行 DEFERRED_CONCURRENCY 个
+- 实时负载低：/ready 的 load_score 低于 DEFERRED_MAX_LOAD，每次轮询最多启动一个，启动后重新评估负载
+- 距截止时间不足 DEFERRED_DEADLINE_MARGIN_SECONDS：不论负载立即执行
+
+多个视频同时运行，一个视频在切片、上传时另一个视频的窗口在等模型，模型请求保持连续。
+失败的任务重新排队，等待 DEFERRED_RETRY_BACKOFF_SECONDS（每次失败翻倍）后才能再次认领，
+最多尝试 DEFERRED_MAX_ATTEMPTS 次。
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.metrics import DEFERRED_JOBS_FINISHED, DEFERRED_JOBS_STARTED
+
+logger = logging.getLogger(__name__)
+
+_SESSION_ID = re.compile(r"^[\w-]+$")
+
+
+@dataclass
+class DeferredJob:
+    """排队中的视频分析任务"""
+    session_id: str
+    video_path: str
+    deadline: float  # 截止时间（Unix 时间戳）
+    enqueued_at: float = field(default_factory=time.time)
+    options: dict = field(default_factory=dict)  # 传给 VideoAnalysisPipeline.run() 的参数
+    attempts: int = 0
+    started_at: Optional[float] = None  # 正在运行；服务重启时视为未开始
+    not_before: float = 0.0  # 失败后重试的最早时间（Unix 时间戳）
+
+
+def parse_off_peak_hours(spec: str) -> List[Tuple[float, float]]:
+    """
+    解析低峰时段，例如 "0-7,22-24"；可以跨越午夜（"23-6"），小时可以带小数
+
+    Raises:
+        ValueError: 格式错误
+    """
+    ranges = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        start, end = (float(x) for x in part.split("-", 1))
+        if not (0 <= start <= 24 and 0 <= end <= 24):
+            raise ValueError(f"Invalid off-peak hours: {part}")
+        ranges.append((start, end))
+    return ranges
+
+
+def in_off_peak(ranges: List[Tuple[float, float]], now: Optional[datetime] = None) -> bool:
+    now = now or datetime.now()
+    hour = now.hour + now.minute / 60 + now.second / 3600
+    for start, end in ranges:
+        if start <= end:
+            if start <= hour < end:
+                return True
+        elif hour >= start or hour < end:
+            return True
+    return False
+
+
+class DeferredQueue:
+    """
+    持久化任务队列，磁盘是唯一的状态来源，多个 worker 进程（SERVICE_WORKERS > 1）共享同一个目录：
+    - 排队中的任务：<directory>/<session_id>.json
+    - 运行中的任务：<directory>/running/<pid>/<session_id>.json，由 os.rename 认领，只有一个进程能认领成功
+
+    文件先写临时文件再替换，写入过程中崩溃不会留下损坏的任务。进程退出后遗留的运行中任务
+    在下一次创建队列时放回排队目录（按 PID 判断进程是否还在，目录应位于本机磁盘）。
+
+    Args:
+        directory: 队列目录
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.running_root = os.path.join(directory, "running")
+        self.running_dir = os.path.join(self.running_root, str(os.getpid()))
+        os.makedirs(self.running_dir, exist_ok=True)
+        self._recover()
+
+    @staticmethod
+    def valid_session_id(session_id: str) -> bool:
+        """session_id 直接用作文件名，只允许字母、数字、下划线和连字符"""
+        return bool(_SESSION_ID.match(session_id))
+
+    def _path(self, session_id: str) -> str:
+        if not self.valid_session_id(session_id):
+            raise ValueError(f"Invalid session id for deferred queue: {session_id!r}")
+        return os.path.join(self.directory, f"{session_id}.json")
+
+    def _running_path(self, session_id: str) -> str:
+        return os.path.join(self.running_dir, f"{session_id}.json")
+
+    def _recover(self):
+        """把已退出进程（包括上一个同 PID 的进程）遗留的运行中任务放回队列"""
+        recovered = 0
+        for name in os.listdir(self.running_root):
+            path = os.path.join(self.running_root, name)
+            if not name.isdigit() or not os.path.isdir(path):
+                continue
+            if int(name) != os.getpid() and _process_alive(int(name)):
+                continue
+            try:
+                files = os.listdir(path)
+            except FileNotFoundError:
+                continue  # 其他 worker 已经处理
+            for file in files:
+                source = os.path.join(path, file)
+                if file.endswith(".json"):
+                    try:
+                        os.rename(source, os.path.join(self.directory, file))
+                        recovered += 1
+                    except FileNotFoundError:
+                        pass
+                    except OSError as e:
+                        logger.warning(f"Failed to requeue deferred job {source}: {e}")
+                else:
+                    _unlink(source)
+            if int(name) != os.getpid():
+                try:
+                    os.rmdir(path)
+                except OSError:
+                    pass
+        if recovered:
+            logger.info(f"Requeued {recovered} deferred video jobs interrupted by a previous process")
+
+    @staticmethod
+    def _read(path: str) -> Optional[DeferredJob]:
+        try:
+            with open(path, encoding="utf-8") as f:
+                return DeferredJob(**json.load(f))
+        except FileNotFoundError:
+            return None  # 刚被其他进程认领或删除
+        except (OSError, ValueError, TypeError) as e:
+            logger.warning(f"Skipping unreadable deferred job {path}: {e}")
+            return None
+
+    @staticmethod
+    def _write(directory: str, path: str, job: DeferredJob):
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(asdict(job), f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except BaseException:
+            _unlink(tmp)
+            raise
+
+    def _scan(self, directory: str) -> List[DeferredJob]:
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return []
+        jobs = (self._read(os.path.join(directory, n)) for n in names if n.endswith(".json"))
+        return [job for job in jobs if job]
+
+    def _running_dirs(self) -> List[str]:
+        return [os.path.join(self.running_root, name) for name in os.listdir(self.running_root)]
+
+    def jobs(self) -> List[DeferredJob]:
+        """排队中（未被任何进程认领）的任务，按截止时间排序"""
+        return sorted(self._scan(self.directory), key=lambda j: (j.deadline, j.enqueued_at))
+
+    def running_jobs(self) -> List[DeferredJob]:
+        """所有进程正在运行的任务"""
+        return [job for d in self._running_dirs() for job in self._scan(d)]
+
+    def __len__(self) -> int:
+        return len(self.jobs()) + len(self.running_jobs())
+
+    def __contains__(self, session_id: str) -> bool:
+        if not self.valid_session_id(session_id):
+            return False
+        name = f"{session_id}.json"
+        return os.path.exists(self._path(session_id)) or any(
+            os.path.exists(os.path.join(d, name)) for d in self._running_dirs()
+        )
+
+    def save(self, job: DeferredJob):
+        """
+        添加任务或放回队列
+
+        Raises:
+            ValueError: session_id 不能用作文件名
+        """
+        self._write(self.directory, self._path(job.session_id), job)
+
+    def claim(self, job: DeferredJob) -> bool:
+        """认领任务（移入本进程的运行目录），已被其他进程认领或删除时返回 False"""
+        try:
+            os.rename(self._path(job.session_id), self._running_path(job.session_id))
+        except FileNotFoundError:
+            return False
+        self._write(self.running_dir, self._running_path(job.session_id), job)
+        return True
+
+    def is_claimed(self, session_id: str) -> bool:
+        """本进程认领的任务仍在（未被 cancel 删除）"""
+        return os.path.exists(self._running_path(session_id))
+
+    def release(self, job: DeferredJob):
+        """把本进程认领的任务放回队列"""
+        self.save(job)
+        _unlink(self._running_path(job.session_id))
+
+    def finish(self, session_id: str):
+        """删除本进程认领的任务"""
+        _unlink(self._running_path(session_id))
+
+    def remove(self, session_id: str) -> bool:
+        """删除任务（排队中或任一进程运行中），返回是否存在"""
+        if not self.valid_session_id(session_id):
+            return False
+        name = f"{session_id}.json"
+        paths = [self._path(session_id)] + [os.path.join(d, name) for d in self._running_dirs()]
+        return any([_unlink(path) for path in paths])
+
+
+def _unlink(path: str) -> bool:
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+    except OSError as e:
+        logger.warning(f"Failed to delete {path}: {e}")
+        return False
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class DeferredScheduler:
+    """
+    错峰调度器
+
+    Args:
+        queue: 任务队列
+        run: 执行一个任务（分析视频），抛出异常表示失败
+        load_score: 当前实时负载（/ready 的 load_score，0 空闲，>= 1 饱和）
+        concurrency: 本进程同时运行的任务数上限
+        max_load: 非低峰时段负载低于此值才启动任务
+        off_peak: 低峰时段（parse_off_peak_hours 的结果）
+        deadline_margin: 距截止时间不足此秒数时不论负载立即执行
+        poll_seconds: 检查间隔
+        max_attempts: 失败后最多尝试次数
+        retry_backoff: 第一次失败后重新认领前的等待秒数，之后每次失败翻倍
+    """
+
+    def __init__(
+        self,
+        queue: DeferredQueue,
+        run: Callable[[DeferredJob], Awaitable],
+        load_score: Callable[[], float],
+        concurrency: int = 2,
+        max_load: float = 0.5,
+        off_peak: Optional[List[Tuple[float, float]]] = None,
+        deadline_margin: float = 1800.0,
+        poll_seconds: float = 5.0,
+        max_attempts: int = 3,
+        retry_backoff: float = 60.0
+    ):
+        self.queue = queue
+        self.run = run
+        self.load_score = load_score
+        self.concurrency = max(1, concurrency)
+        self.max_load = max_load
+        self.off_peak = off_peak or []
+        self.deadline_margin = deadline_margin
+        self.poll_seconds = poll_seconds
+        self.max_attempts = max(1, max_attempts)
+        self.retry_backoff = max(0.0, retry_backoff)
+        self.running: Dict[str, asyncio.Task] = {}
+        self._wake = asyncio.Event()
+        self._loop_task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    @classmethod
+    def from_settings(
+        cls,
+        run: Callable[[DeferredJob], Awaitable],
+        load_score: Callable[[], float]
+    ) -> "DeferredScheduler":
+        return cls(
+            DeferredQueue(settings.deferred_queue_dir),
+            run,
+            load_score,
+            concurrency=settings.deferred_concurrency,
+            max_load=settings.deferred_max_load,
+            off_peak=parse_off_peak_hours(settings.deferred_off_peak_hours),
+            deadline_margin=settings.deferred_deadline_margin_seconds,
+            poll_seconds=settings.deferred_poll_seconds,
+            max_attempts=settings.deferred_max_attempts,
+            retry_backoff=settings.deferred_retry_backoff_seconds
+        )
+
+    def submit(self, job: DeferredJob):
+        """持久化任务并唤醒调度循环"""
+        self.queue.save(job)
+        self._wake.set()
+
+    def cancel(self, session_id: str) -> bool:
+        """
+        删除排队中的任务，或取消正在运行的任务
+
+        在其他 worker 进程中运行的任务由该进程在下一次轮询时发现任务文件被删除后取消。
+        """
+        removed = self.queue.remove(session_id)
+        task = self.running.get(session_id)
+        if task and not task.done():
+            task.cancel()
+        return removed
+
+    def start(self):
+        self._stopping = False
+        self._loop_task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        """停止调度；正在运行的任务被取消，保留在队列中，下次启动时重新执行"""
+        self._stopping = True
+        tasks = [t for t in (self._loop_task, *self.running.values()) if t]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _loop(self):
+        while True:
+            try:
+                self.dispatch()
+            except Exception as e:
+                logger.error(f"Deferred scheduler error: {e}", exc_info=True)
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def dispatch(self, now: Optional[float] = None) -> int:
+        """按当前时段和负载启动任务，返回本次启动的数量"""
+        now = now or time.time()
+        for session_id, task in list(self.running.items()):
+            if not task.done() and not self.queue.is_claimed(session_id):
+                # 任务文件已被删除（另一个 worker 收到了 cancel 请求）
+                logger.info(f"Deferred job {session_id} was cancelled, stopping it")
+                task.cancel()
+        off_peak = in_off_peak(self.off_peak)
+        load: Optional[float] = None
+        started = 0
+        for job in self.queue.jobs():
+            if len(self.running) >= self.concurrency:
+                break
+            if job.session_id in self.running or now < job.not_before:
+                continue  # 失败后的退避期内，截止时间临近也不立即重试
+            if now >= job.deadline - self.deadline_margin:
+                reason = "deadline"
+            elif off_peak:
+                reason = "off_peak"
+            else:
+                if started:
+                    break  # 负载触发时每轮只启动一个，下一轮按新的负载再判断
+                load = self.load_score() if load is None else load
+                if load >= self.max_load:
+                    break
+                reason = "low_load"
+            if self._start(job, reason):
+                started += 1
+        return started
+
+    def _start(self, job: DeferredJob, reason: str) -> bool:
+        job.attempts += 1
+        job.started_at = time.time()
+        if not self.queue.claim(job):
+            return False  # 已被其他 worker 认领
+        DEFERRED_JOBS_STARTED.labels(reason).inc()
+        logger.info(
+            f"Starting deferred video analysis for session {job.session_id} ({reason}, attempt {job.attempts}, "
+            f"deadline in {(job.deadline - job.started_at) / 60:.0f} min)"
+        )
+        self.running[job.session_id] = asyncio.create_task(self._run_job(job))
+        return True
+
+    async def _run_job(self, job: DeferredJob):
+        session_id = job.session_id
+        try:
+            await self.run(job)
+        except asyncio.CancelledError:
+            if self._stopping and self.queue.is_claimed(session_id):
+                job.started_at = None
+                self.queue.release(job)
+                logger.info(f"Deferred job {session_id} interrupted by shutdown, kept in queue")
+            else:
+                self.queue.finish(session_id)
+                DEFERRED_JOBS_FINISHED.labels("cancelled").inc()
+            raise
+        except Exception as e:
+            if job.attempts >= self.max_attempts:
+                logger.error(f"Deferred job {session_id} failed after {job.attempts} attempts: {e}")
+                self.queue.finish(session_id)
+                DEFERRED_JOBS_FINISHED.labels("failed").inc()
+            else:
+                delay = self.retry_backoff * 2 ** (job.attempts - 1)
+                logger.warning(
+                    f"Deferred job {session_id} failed (attempt {job.attempts}), retrying in {delay:.0f}s: {e}"
+                )
+                job.started_at = None
+                job.not_before = time.time() + delay
+                self.queue.release(job)
+        else:
+            late = time.time() - job.deadline
+            if late > 0:
+                logger.warning(f"Deferred job {session_id} finished {late / 60:.0f} min after its deadline")
+            self.queue.finish(session_id)
+            DEFERRED_JOBS_FINISHED.labels("late" if late > 0 else "completed").inc()
+        finally:
+            self.running.pop(session_id, None)
+            self._wake.set()
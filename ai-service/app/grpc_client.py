@@ -1,8 +1,14 @@
+import asyncio
 import grpc
+import itertools
+import json
 import logging
-from typing import Optional
+import time
+from typing import List, Optional, Tuple
 
 from .config import settings
+from .log_config import sampled
+from .metrics import GRPC_SAVE_SECONDS
 
 # Import generated protobuf code
 # Note: This will be generated after running protoc
@@ -22,16 +28,72 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# SaveAnalysis 不是幂等的（服务端按 token 逐条插入，不按 session_id + token_index 去重），
+# 因此不配置 retryPolicy：UNAVAILABLE 也可能发生在服务端已经保存之后（响应返回前连接断开），
+# 重试会重复保存 token。只保留 gRPC 内置的透明重试，它只重发从未发出到服务端的请求。
+_SERVICE_NAME = "analysis.AnalysisService"
+
+
+def _service_config() -> str:
+    return json.dumps({
+        "methodConfig": [{
+            "name": [{"service": _SERVICE_NAME}],
+            "timeout": f"{settings.grpc_timeout_seconds:g}s"
+        }]
+    })
+
+
+def _channel_options() -> List[Tuple[str, object]]:
+    max_message = settings.grpc_max_message_mb * 1024 * 1024
+    options = [
+        ("grpc.max_send_message_length", max_message),
+        ("grpc.max_receive_message_length", max_message),
+        ("grpc.enable_retries", 1),
+        ("grpc.service_config", _service_config()),
+        # 每个 channel 使用独立的子通道（独立的 HTTP/2 连接），否则相同参数的 channel 会共享连接
+        ("grpc.use_local_subchannel_pool", 1),
+    ]
+    if settings.grpc_keepalive_seconds > 0:
+        options += [
+            ("grpc.keepalive_time_ms", int(settings.grpc_keepalive_seconds * 1000)),
+            ("grpc.keepalive_timeout_ms", 10000),
+            ("grpc.keepalive_permit_without_calls", 1),
+            ("grpc.http2.max_pings_without_data", 0),
+        ]
+    return options
+
+
 class SpringBootGrpcClient:
-    def __init__(self):
+    """
+    SaveAnalysis 客户端
+
+    维护 GRPC_CHANNELS 个 channel（各自独立的 HTTP/2 连接），按轮询分配请求，
+    并发会话的 token 不会全部挤在一条连接上。channel 配置了 keepalive 和默认超时；
+    内容达到 GRPC_COMPRESSION_MIN_BYTES 的请求使用 gzip 压缩（单个 token 太小，压缩不划算）。
+
+    启动时调用 connect() 预先建立连接，第一个 token 不需要等待握手；
+    未调用时在第一次发送时创建。
+    """
+
+    def __init__(self, pool_size: Optional[int] = None):
         self.host = settings.spring_boot_grpc_host
         self.port = settings.spring_boot_grpc_port
-        self.channel: Optional[grpc.aio.Channel] = None
-        self.stub = None
+        self.pool_size = max(1, pool_size or settings.grpc_channels)
+        self.channels: List[grpc.aio.Channel] = []
+        self.stubs: list = []
+        self._next = itertools.count()
         self._initialized = False
+        self.in_flight = 0  # 尚未完成的 SaveAnalysis 调用（就绪检查）
+
+    @property
+    def stub(self):
+        """下一个 stub（轮询），未连接时为 None"""
+        if not self.stubs:
+            return None
+        return self.stubs[next(self._next) % len(self.stubs)]
 
     async def _ensure_connected(self):
-        """Ensure gRPC connection is established (lazy initialization)"""
+        """Ensure gRPC channels are created (lazy initialization)"""
         if self._initialized:
             return
 
@@ -40,10 +102,34 @@ class SpringBootGrpcClient:
             return
 
         address = f"{self.host}:{self.port}"
-        self.channel = grpc.aio.insecure_channel(address)
-        self.stub = analysis_pb2_grpc.AnalysisServiceStub(self.channel)
+        options = _channel_options()
+        self.channels = [grpc.aio.insecure_channel(address, options=options) for _ in range(self.pool_size)]
+        self.stubs = [analysis_pb2_grpc.AnalysisServiceStub(channel) for channel in self.channels]
         self._initialized = True
-        logger.info(f"gRPC client connected to {address}")
+        logger.info(f"gRPC client connected to {address} ({self.pool_size} channels)")
+
+    async def connect(self, timeout: float = 5.0) -> int:
+        """
+        创建 channel 并等待连接建立（服务启动时预热）
+
+        连接失败不会抛出异常，channel 会在后台继续重连。
+
+        Returns:
+            已就绪的 channel 数量
+        """
+        await self._ensure_connected()
+        if not self.channels:
+            return 0
+        results = await asyncio.gather(
+            *(asyncio.wait_for(channel.channel_ready(), timeout) for channel in self.channels),
+            return_exceptions=True
+        )
+        ready = sum(1 for result in results if not isinstance(result, BaseException))
+        if ready < len(self.channels):
+            logger.warning(f"gRPC warm-up: {ready}/{len(self.channels)} channels ready to {self.host}:{self.port}")
+        else:
+            logger.info(f"gRPC warm-up: {ready} channels ready")
+        return ready
 
     async def save_analysis(
         self,
@@ -61,10 +147,14 @@ class SpringBootGrpcClient:
         # Ensure connection is established in current event loop
         await self._ensure_connected()
 
-        if not self.stub:
+        stub = self.stub
+        if not stub:
             logger.error("gRPC stub not initialized (protobuf files missing?)")
             return False
 
+        start = time.perf_counter()
+        outcome = "error"
+        self.in_flight += 1
         try:
             request = analysis_pb2.AnalysisRequest(
                 session_id=session_id,
@@ -73,10 +163,17 @@ class SpringBootGrpcClient:
                 timestamp=timestamp
             )
 
-            response = await self.stub.SaveAnalysis(request)
+            compress = len(content) >= settings.grpc_compression_min_bytes > 0
+            response = await stub.SaveAnalysis(
+                request, compression=grpc.Compression.Gzip if compress else None
+            )
 
             if response.success:
-                logger.debug(f"Saved token {token_index} for session {session_id}, ID: {response.saved_id}")
+                outcome = "success"
+                logger.debug(
+                    "Saved token %d for session %s, ID: %s", token_index, session_id, response.saved_id,
+                    extra=sampled("grpc.token")
+                )
                 return True
             else:
                 logger.error(f"Failed to save token: {response.message}")
@@ -88,9 +185,14 @@ class SpringBootGrpcClient:
         except Exception as e:
             logger.error(f"Unexpected error in save_analysis: {e}", exc_info=True)
             return False
+        finally:
+            self.in_flight -= 1
+            GRPC_SAVE_SECONDS.labels(outcome).observe(time.perf_counter() - start)
 
     async def close(self):
-        """Close gRPC connection"""
-        if self.channel:
-            await self.channel.close()
-            logger.info("gRPC channel closed")
+        """Close gRPC channels"""
+        if self.channels:
+            await asyncio.gather(*(channel.close() for channel in self.channels))
+            self.channels, self.stubs = [], []
+            self._initialized = False
+            logger.info("gRPC channels closed")
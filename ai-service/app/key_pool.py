@@ -0,0 +1,245 @@
+"""
+API Key Pool - 多个 DashScope API Key 的负载均衡与限流冷却
+
+每个 key 独立记录：进行中的请求数、最近 60 秒请求数、token 用量、限流次数。
+选择策略：
+- least_loaded: 选择 (进行中请求 + 最近请求占配额比例) / 权重 最小的 key
+- weighted: 按权重随机选择（跳过冷却中或已达 RPM 上限的 key）
+
+收到限流错误（HTTP 429 / Throttling.*）的 key 会进入冷却期，冷却期内不会被选中。
+"""
+import logging
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Deque, Iterator, List, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+RATE_WINDOW_SECONDS = 60.0
+
+
+@dataclass
+class ApiKeyState:
+    """单个 API Key 的状态与用量统计"""
+    key: str
+    endpoint: str
+    weight: float = 1.0
+    rpm_limit: int = 0  # 0 表示不限制
+    in_flight: int = 0
+    total_requests: int = 0
+    total_errors: int = 0
+    throttled_count: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cooldown_until: float = 0.0
+    recent_requests: Deque[float] = field(default_factory=deque)
+
+    @property
+    def name(self) -> str:
+        """脱敏后的 key 名称（用于日志和统计）"""
+        if len(self.key) <= 10:
+            return "***"
+        return f"{self.key[:5]}...{self.key[-4:]}"
+
+    def _trim(self, now: float):
+        while self.recent_requests and now - self.recent_requests[0] > RATE_WINDOW_SECONDS:
+            self.recent_requests.popleft()
+
+    def requests_last_minute(self, now: Optional[float] = None) -> int:
+        self._trim(now or time.monotonic())
+        return len(self.recent_requests)
+
+    def is_available(self, now: float) -> bool:
+        if now < self.cooldown_until:
+            return False
+        if self.rpm_limit and self.requests_last_minute(now) >= self.rpm_limit:
+            return False
+        return True
+
+    def load_score(self, now: float) -> float:
+        """负载分数，越小越空闲"""
+        rate_load = 0.0
+        if self.rpm_limit:
+            rate_load = self.requests_last_minute(now) / self.rpm_limit
+        return (self.in_flight + rate_load) / max(self.weight, 1e-6)
+
+
+class ApiKeyPool:
+    """
+    API Key 池
+
+    用法：
+        with pool.lease() as key_state:
+            ... 使用 key_state.key / key_state.endpoint 发起请求 ...
+            pool.mark_throttled(key_state)  # 如遇到限流
+    """
+
+    STRATEGIES = ("least_loaded", "weighted")
+
+    def __init__(
+        self,
+        keys: List[ApiKeyState],
+        strategy: str = "least_loaded",
+        cooldown_seconds: float = 30.0
+    ):
+        """
+        Args:
+            keys: key 列表
+            strategy: 选择策略，least_loaded 或 weighted
+            cooldown_seconds: 限流后的冷却时间（秒）
+        """
+        if strategy not in self.STRATEGIES:
+            logger.warning(f"Unknown key selection strategy '{strategy}', falling back to least_loaded")
+            strategy = "least_loaded"
+        self.keys = keys
+        self.strategy = strategy
+        self.cooldown_seconds = cooldown_seconds
+
+    @classmethod
+    def from_settings(cls) -> "ApiKeyPool":
+        """
+        从配置构造 key 池
+
+        QWEN_API_KEYS 格式：逗号分隔，每项为 key[|endpoint[|weight]]
+        例如：sk-aaa,sk-bbb|https://other-endpoint/generation|2
+        未配置 QWEN_API_KEYS 时退回到单个 QWEN_API_KEY。
+        """
+        keys: List[ApiKeyState] = []
+        for entry in settings.qwen_api_keys.split(","):
+            entry = entry.strip()
+            if not entry:
+                continue
+            parts = [p.strip() for p in entry.split("|")]
+            endpoint = parts[1] if len(parts) > 1 and parts[1] else settings.qwen_api_url
+            try:
+                weight = float(parts[2]) if len(parts) > 2 and parts[2] else 1.0
+            except ValueError:
+                logger.warning("Invalid weight in QWEN_API_KEYS entry, using 1.0")
+                weight = 1.0
+            keys.append(ApiKeyState(
+                key=parts[0],
+                endpoint=endpoint,
+                weight=weight,
+                rpm_limit=settings.qwen_key_rpm_limit
+            ))
+
+        if not keys and settings.qwen_api_key:
+            keys.append(ApiKeyState(
+                key=settings.qwen_api_key,
+                endpoint=settings.qwen_api_url,
+                rpm_limit=settings.qwen_key_rpm_limit
+            ))
+
+        logger.info(f"API key pool initialized with {len(keys)} key(s), strategy={settings.qwen_key_strategy}")
+        return cls(
+            keys,
+            strategy=settings.qwen_key_strategy,
+            cooldown_seconds=settings.qwen_key_cooldown_seconds
+        )
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def acquire(self, exclude: Optional[set] = None) -> ApiKeyState:
+        """
+        选择一个 key 并计入进行中请求
+
+        Args:
+            exclude: 本次请求已经尝试过的 key（重试时跳过）
+
+        Returns:
+            选中的 key 状态
+
+        Raises:
+            RuntimeError: key 池为空
+        """
+        if not self.keys:
+            raise RuntimeError("No Qwen API key configured")
+
+        now = time.monotonic()
+        candidates = [
+            k for k in self.keys
+            if k.is_available(now) and (not exclude or k.key not in exclude)
+        ]
+
+        if not candidates:
+            # 全部冷却中：选择最早结束冷却的 key，而不是直接失败
+            pool = [k for k in self.keys if not exclude or k.key not in exclude] or self.keys
+            chosen = min(pool, key=lambda k: k.cooldown_until)
+            logger.warning(f"All API keys cooling down or rate-limited, using {chosen.name}")
+        elif self.strategy == "weighted":
+            chosen = random.choices(candidates, weights=[k.weight for k in candidates])[0]
+        else:
+            chosen = min(candidates, key=lambda k: k.load_score(now))
+
+        chosen.in_flight += 1
+        chosen.total_requests += 1
+        chosen.recent_requests.append(now)
+        return chosen
+
+    def available_in(self, exclude: Optional[set] = None) -> float:
+        """
+        下一次 acquire(exclude) 多少秒后能拿到不在冷却中的 key（0 表示现在就有）
+
+        与 acquire 的选择范围一致：优先不在 exclude 中的 key，全部被排除时看全部 key。
+        """
+        now = time.monotonic()
+        pool = [k for k in self.keys if not exclude or k.key not in exclude] or self.keys
+        if not pool or any(k.is_available(now) for k in pool):
+            return 0.0
+        return max(0.0, min(k.cooldown_until for k in pool) - now)
+
+    def release(self, key_state: ApiKeyState, error: bool = False):
+        """请求结束，释放进行中计数"""
+        key_state.in_flight = max(0, key_state.in_flight - 1)
+        if error:
+            key_state.total_errors += 1
+
+    @contextmanager
+    def lease(self, exclude: Optional[set] = None) -> Iterator[ApiKeyState]:
+        """acquire/release 的上下文管理器形式"""
+        key_state = self.acquire(exclude)
+        try:
+            yield key_state
+        except BaseException:
+            self.release(key_state, error=True)
+            raise
+        else:
+            self.release(key_state)
+
+    def mark_throttled(self, key_state: ApiKeyState, retry_after: Optional[float] = None):
+        """标记 key 被限流，进入冷却期"""
+        cooldown = retry_after if retry_after else self.cooldown_seconds
+        key_state.cooldown_until = time.monotonic() + cooldown
+        key_state.throttled_count += 1
+        logger.warning(f"API key {key_state.name} throttled, cooling down for {cooldown:.1f}s")
+
+    def record_usage(self, key_state: ApiKeyState, input_tokens: int = 0, output_tokens: int = 0):
+        """记录 token 用量（来自 DashScope 响应中的 usage 字段）"""
+        key_state.input_tokens += input_tokens
+        key_state.output_tokens += output_tokens
+
+    def stats(self) -> List[dict]:
+        """各 key 的用量统计（key 已脱敏）"""
+        now = time.monotonic()
+        return [
+            {
+                "key": k.name,
+                "endpoint": k.endpoint,
+                "weight": k.weight,
+                "in_flight": k.in_flight,
+                "requests_last_minute": k.requests_last_minute(now),
+                "total_requests": k.total_requests,
+                "total_errors": k.total_errors,
+                "throttled_count": k.throttled_count,
+                "input_tokens": k.input_tokens,
+                "output_tokens": k.output_tokens,
+                "cooling_down": now < k.cooldown_until,
+            }
+            for k in self.keys
+        ]
@@ -0,0 +1,122 @@
+"""
+Live recording - 边录制边上传的视频
+
+录制文件有两种来源：
+- 分块上传：调用方按顺序追加数据块（浏览器 MediaRecorder 的 WebM 分片直接拼接即可），
+  文件写在 INGEST_DIR 下，分析结束后删除
+- 监视文件：video_path 指向一个正在被写入的文件（例如共享存储上的上传中文件），只读取不删除
+
+调用 finish() 或超过 INGEST_IDLE_TIMEOUT_SECONDS 没有新数据时视为录制结束。
+流水线据此切出已经完整的窗口，结束时再补齐剩余窗口（见 VideoAnalysisPipeline）。
+
+只有边写边可解码的容器适用：WebM / MKV / MPEG-TS / 分片 MP4。普通 MP4 在写完 moov 之前
+无法解析，这种文件会等到录制结束后一次性分析。
+"""
+import asyncio
+import logging
+import os
+import time
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class LiveRecording:
+    """
+    一个正在增长的录制文件
+
+    Args:
+        session_id: 会话 ID
+        path: 监视的文件路径；为空时在 INGEST_DIR 下创建文件接收分块上传
+    """
+
+    def __init__(self, session_id: str, path: Optional[str] = None):
+        self.session_id = session_id
+        self.owned = path is None
+        if self.owned:
+            ingest_dir = Path(settings.ingest_dir)
+            ingest_dir.mkdir(parents=True, exist_ok=True)
+            path = str(ingest_dir / f"{session_id}.webm")
+            Path(path).write_bytes(b"")
+        self.path = path
+        self.complete = False
+        self.size = self._file_size()
+        self.last_growth = time.monotonic()
+        self.task: Optional[asyncio.Task] = None  # 分析任务（由调用方设置）
+        self.error: Optional[Exception] = None  # 分析失败的原因（由调用方设置）
+        self._changed = asyncio.Event()
+        self._write_lock = asyncio.Lock()
+
+    def _file_size(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    @property
+    def idle_seconds(self) -> float:
+        return time.monotonic() - self.last_growth
+
+    async def append(self, chunks: AsyncIterator[bytes], offset: Optional[int] = None) -> int:
+        """
+        追加数据块（同一录制的追加按顺序执行）
+
+        Args:
+            chunks: 数据
+            offset: 调用方认为的当前文件长度；给出时与实际不一致则拒绝，便于重试时去重
+
+        Returns:
+            追加后的文件长度
+
+        Raises:
+            ValueError: offset 与已接收的字节数不一致（重复或缺失的数据块）
+            RuntimeError: 录制已结束或不是分块上传的录制
+        """
+        if not self.owned:
+            raise RuntimeError("Recording is a watched file, chunks cannot be appended")
+        async with self._write_lock:
+            if self.complete:
+                raise RuntimeError("Recording already completed")
+            if offset is not None and offset != self.size:
+                raise ValueError(f"Offset {offset} does not match received size {self.size}")
+            with open(self.path, "ab") as f:
+                async for chunk in chunks:
+                    if chunk:
+                        await asyncio.to_thread(f.write, chunk)
+                        self.size += len(chunk)
+            self.last_growth = time.monotonic()
+            self._changed.set()
+            return self.size
+
+    def refresh(self) -> bool:
+        """重新读取监视文件的长度，文件变大时返回 True"""
+        size = self._file_size()
+        if size == self.size:
+            return False
+        self.size = size
+        self.last_growth = time.monotonic()
+        return True
+
+    def finish(self):
+        """录制结束，流水线补齐剩余窗口后结束"""
+        self.complete = True
+        self._changed.set()
+
+    async def wait_for_data(self, timeout: float):
+        """等待新的数据块或录制结束（监视文件只能轮询，等待 timeout 秒）"""
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._changed.clear()
+
+    def discard(self):
+        """删除分块上传的文件（监视的文件不删除）"""
+        if self.owned:
+            try:
+                Path(self.path).unlink(missing_ok=True)
+            except OSError as e:
+                logger.warning(f"Failed to delete recording {self.path}: {e}")
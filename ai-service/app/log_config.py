@@ -0,0 +1,155 @@
+"""
+Logging - 非阻塞日志配置
+
+事件循环中的 logger 调用只把 LogRecord 放入内存队列（QueueHandler），格式化和写 stderr
+都在后台监听线程（QueueListener）中完成，日志 I/O 不会阻塞请求处理。
+
+- 输出格式：text（默认）或 json（LOG_FORMAT），json 每行一个对象，extra 字段原样输出
+- 延迟格式化：消息参数在监听线程中才拼接，热路径使用 %-style 参数而不是 f-string
+- 热路径采样：带 extra=sampled("key") 的记录每个 key 每秒最多输出 LOG_SAMPLE_PER_SECOND 条，
+  被丢弃的条数附在下一条输出的记录上（suppressed 字段）；WARNING 及以上总是输出
+
+用法：
+    logger.info("Received frame %d for session %s", n, session_id, extra=sampled("ws.frame"))
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from app.config import settings
+
+# LogRecord 的标准属性，其余属性视为 extra 字段
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def sampled(key: str) -> dict:
+    """热路径日志的 extra 参数，按 key 限速"""
+    return {"sample_key": key}
+
+
+class JsonFormatter(logging.Formatter):
+    """每条记录输出一行 JSON：时间、级别、logger、消息、extra 字段和异常堆栈"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and key != "sample_key":
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    按 sample_key 限速：每个 key 每秒最多 per_second 条
+
+    Args:
+        per_second: 每个 key 每秒输出上限，0 表示不限速
+    """
+
+    def __init__(self, per_second: float):
+        super().__init__()
+        self.per_second = per_second
+        self._windows: Dict[str, Tuple[int, int, int]] = {}  # key -> (秒, 已输出, 已丢弃)
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, "sample_key", None)
+        if key is None or self.per_second <= 0 or record.levelno >= logging.WARNING:
+            return True
+
+        second = int(time.monotonic())
+        with self._lock:
+            window, emitted, dropped = self._windows.get(key, (second, 0, 0))
+            if window != second:
+                window, emitted = second, 0
+            if emitted >= self.per_second:
+                self._windows[key] = (window, emitted, dropped + 1)
+                return False
+            self._windows[key] = (window, emitted + 1, 0)
+        if dropped:
+            record.suppressed = dropped
+        return True
+
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    不在调用线程中格式化的 QueueHandler
+
+    标准 QueueHandler.prepare() 会在放入队列前调用 format()（也就是在事件循环中拼接消息），
+    这里原样放入记录，由监听线程的 handler 格式化。记录只在进程内传递，不需要可序列化。
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logging(
+    level: Optional[str] = None,
+    fmt: Optional[str] = None,
+    use_queue: Optional[bool] = None,
+    sample_per_second: Optional[float] = None
+) -> None:
+    """
+    配置根 logger（重复调用会替换之前的配置）
+
+    Args:
+        level: 日志级别（默认 LOG_LEVEL）
+        fmt: text / json（默认 LOG_FORMAT）
+        use_queue: 是否经后台线程输出（默认 LOG_QUEUE）
+        sample_per_second: 热路径每个 key 每秒输出上限（默认 LOG_SAMPLE_PER_SECOND）
+    """
+    global _listener
+    shutdown_logging()
+
+    level = (level or settings.log_level).upper()
+    fmt = fmt or settings.log_format
+    use_queue = settings.log_queue if use_queue is None else use_queue
+    sample_per_second = settings.log_sample_per_second if sample_per_second is None else sample_per_second
+
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.setLevel(getattr(logging, level, logging.INFO))
+
+    if use_queue:
+        handler = _LazyQueueHandler(queue.SimpleQueue())
+        _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+        _listener.start()
+    else:
+        handler = output
+    # 采样在入队前进行，被丢弃的记录不占用队列
+    handler.addFilter(SamplingFilter(sample_per_second))
+    root.addHandler(handler)
+
+
+def shutdown_logging() -> None:
+    """停止后台监听线程并输出队列中剩余的记录"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
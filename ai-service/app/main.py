@@ -1,12 +1,19 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
+import time
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.websockets import WebSocketState
+from fastapi.responses import JSONResponse, Response, PlainTextResponse
 from contextlib import asynccontextmanager
 from pydantic import BaseModel
 import logging
 import asyncio
 import base64
+import secrets
+import shutil
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Optional, Tuple
 import os
 
 # Load .env file explicitly (before importing settings)
@@ -17,17 +24,27 @@ logger_init = logging.getLogger(__name__)
 logger_init.info(f"Loading environment from: {env_path}")
 
 from app.config import settings
+from app.log_config import sampled, setup_logging, shutdown_logging
 from app.qwen_client import QwenVisionClient
 from app.grpc_client import SpringBootGrpcClient
 from app.context_manager import ContextManager
-from app.video_processor import VideoProcessor
+from app.video_processor import AUTO_PROFILE, TRANSCODE_PROFILES, WINDOW_PLANNERS, VideoProcessor
 from app.minio_client import MinioClient
-
-# Configure logging
-logging.basicConfig(
-    level=getattr(logging, settings.log_level.upper()),
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+from app.live_recording import LiveRecording
+from app.model_router import PRIORITIES, FrameChangeTracker, RoutingSignals, strip_retracted
+from app.readiness import ReadinessThresholds, WaitTracker
+from app.deferred_queue import DeferredJob, DeferredQueue, DeferredScheduler
+from app.video_pipeline import PipelineResult, VideoAnalysisPipeline
+from app.tracing import tracer
+from app.profiler import cpu_profiler, memory_profiler
+from app.metrics import (
+    REGISTRY, CONTENT_TYPE_LATEST, ACTIVE_SESSIONS, CONTEXT_STORE_SESSIONS, DEFERRED_JOBS, FFMPEG_PROCESSES,
+    FRAME_QUEUE_DEPTH, FRAME_QUEUE_WAIT_SECONDS, FRAMES_DROPPED, GRPC_IN_FLIGHT, LOAD_SCORE, PENDING_WINDOWS, READY,
+    STARTUP_SECONDS, WARM_UP_READY, WEBSOCKET_SEND_SECONDS
 )
+
+# Configure logging（后台线程输出，热路径日志限速）
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # Global instances
@@ -40,17 +57,95 @@ video_processor = VideoProcessor(
     output_dir="./temp_windows"
 )
 minio_client = MinioClient()
+video_pipeline = VideoAnalysisPipeline(
+    qwen_client=qwen_client,
+    grpc_client=grpc_client,
+    context_manager=context_manager,
+    video_processor=video_processor,
+    minio_client=minio_client
+)
+
+# 轮询调用方是否断开连接的间隔（秒）
+DISCONNECT_POLL_INTERVAL = 0.5
+
+# session_id -> 待分析帧队列（WebSocket 会话），元素为 (收到时间, 帧序号, 帧数据)
+frame_queues: Dict[str, asyncio.Queue] = {}
+
+# session_id -> 录制中、正在增量分析的视频（分析结束后保留 INGEST_RESULT_TTL_SECONDS，供 complete 取回结果）
+live_recordings: Dict[str, LiveRecording] = {}
+
+# 帧排队等待时间（最近峰值）与就绪阈值，供 /ready 使用
+frame_wait = WaitTracker()
+readiness = ReadinessThresholds.from_settings()
+
+# 延后分析的视频（deferred=true）：持久化排队，低峰或实时负载低时执行
+deferred_scheduler = DeferredScheduler.from_settings(
+    run=lambda job: _run_deferred(job),
+    load_score=lambda: _evaluate_readiness()[1]["load_score"]
+)
+
+# 抓取时计算的指标
+ACTIVE_SESSIONS.labels("websocket").set_function(lambda: len(frame_queues))
+ACTIVE_SESSIONS.labels("video").set_function(lambda: len(video_pipeline.active_tasks))
+FRAME_QUEUE_DEPTH.set_function(lambda: sum(q.qsize() for q in list(frame_queues.values())))
+CONTEXT_STORE_SESSIONS.set_function(context_manager.get_session_count)
+PENDING_WINDOWS.set_function(lambda: video_pipeline.pending_windows)
+FFMPEG_PROCESSES.set_function(lambda: video_processor.active_ffmpeg)
+GRPC_IN_FLIGHT.set_function(lambda: grpc_client.in_flight)
+DEFERRED_JOBS.set_function(lambda: len(deferred_scheduler.queue))
+
+async def _warm_up():
+    """
+    并行预热外部依赖，第一个请求不再承担建立连接的开销：
+    gRPC channel 池、DashScope 的 DNS + TLS 连接、Minio 客户端和连接、ffmpeg 可执行文件
+
+    每项最多等待 STARTUP_WARM_UP_TIMEOUT_SECONDS，失败只记录日志，不阻止启动
+    （gRPC channel 会在后台继续重连，其余依赖在第一次使用时再建立）。
+    """
+    timeout = settings.startup_warm_up_timeout_seconds
+
+    async def warm(name: str, operation) -> bool:
+        start = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(operation, timeout)
+            ready = bool(result)
+        except FileNotFoundError as e:
+            logger.error(f"Warm-up {name}: {e} (video analysis will not work)")
+            ready = False
+        except Exception as e:
+            logger.warning(f"Warm-up {name} failed: {e!r}")
+            ready = False
+        WARM_UP_READY.labels(name).set(1 if ready else 0)
+        logger.info(f"Warm-up {name}: {'ready' if ready else 'not ready'} in {(time.perf_counter() - start) * 1000:.0f}ms")
+        return ready
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        warm("grpc", grpc_client.connect(timeout=timeout)),
+        warm("qwen", qwen_client.warm_up(timeout=timeout)),
+        warm("minio", asyncio.to_thread(minio_client.warm_up)),
+        warm("ffmpeg", asyncio.to_thread(video_processor.check_ffmpeg)),
+    )
+    STARTUP_SECONDS.labels("warm_up").set(time.perf_counter() - start)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     logger.info("StreamMind AI Service starting up...")
-    logger.info(f"Qwen API configured: {bool(settings.qwen_api_key)}")
+    logger.info(f"Qwen API keys configured: {len(qwen_client.key_pool)}")
     logger.info(f"Spring Boot gRPC: {settings.spring_boot_grpc_host}:{settings.spring_boot_grpc_port}")
+    if settings.startup_warm_up:
+        await _warm_up()
+    deferred_scheduler.start()
     yield
     # Shutdown
     logger.info("StreamMind AI Service shutting down...")
+    await deferred_scheduler.stop()
     await grpc_client.close()
+    await qwen_client.close()
+    tracer.shutdown()
+    shutdown_logging()
 
 app = FastAPI(title="StreamMind AI Service", version="1.0.0", lifespan=lifespan)
 
@@ -75,109 +170,381 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+
+def _current_load() -> Dict[str, float]:
+    """就绪检查的负载项（见 app.readiness）"""
+    keys = qwen_client.key_pool.keys
+    now = time.monotonic()
+    try:
+        free_disk_mb = shutil.disk_usage(video_processor.output_dir).free / (1024 * 1024)
+    except OSError:
+        free_disk_mb = None
+    load = {
+        "sessions": len(frame_queues) + len(video_pipeline.active_tasks),
+        "frames_queued": sum(q.qsize() for q in list(frame_queues.values())),
+        "pending_windows": video_pipeline.pending_windows,
+        "queue_wait_seconds": round(frame_wait.value(), 3),
+        "qwen_in_flight": sum(k.in_flight for k in keys),
+        "qwen_keys_available": sum(1 for k in keys if k.is_available(now)),
+        "grpc_in_flight": grpc_client.in_flight,
+        "ffmpeg_processes": video_processor.active_ffmpeg,
+    }
+    if free_disk_mb is not None:
+        load["free_disk_mb"] = round(free_disk_mb)
+    return load
+
+
+def _evaluate_readiness() -> Tuple[Dict[str, float], dict]:
+    """当前负载及其评估结果（/ready 与延后分析调度共用）"""
+    load = _current_load()
+    result = readiness.evaluate(load)
+    if len(qwen_client.key_pool) and load["qwen_keys_available"] == 0:
+        # 所有 key 都在限流冷却中，新请求只能排队等待
+        result["ready"] = False
+        result["load_score"] = max(result["load_score"], 1.0)
+        result["reasons"].append(f"qwen_keys_available 0 of {len(qwen_client.key_pool)}")
+    return load, result
+
+
+@app.get("/ready")
+async def readiness_check():
+    """
+    Load-aware readiness: 503 when any load item exceeds its READY_* threshold,
+    so load balancers and the Java workers route new work elsewhere.
+    """
+    load, result = _evaluate_readiness()
+    READY.set(1 if result["ready"] else 0)
+    LOAD_SCORE.set(result["load_score"])
+    body = {"status": "ready" if result["ready"] else "not_ready", **result, "load": load}
+    return JSONResponse(body, status_code=200 if result["ready"] else 503)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition"""
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/debug/traces")
+async def list_traced_sessions():
+    """Sessions with spans in the in-memory trace buffer, most recent first"""
+    if not tracer.ring_buffer:
+        raise HTTPException(status_code=404, detail="In-memory trace exporter not enabled")
+    return {"sessions": tracer.ring_buffer.recent_sessions()}
+
+@app.get("/debug/traces/{session_id}")
+async def session_traces(session_id: str, limit: int = 20):
+    """Span waterfall of the most recent traces for a session"""
+    if not tracer.ring_buffer:
+        raise HTTPException(status_code=404, detail="In-memory trace exporter not enabled")
+    return {"session_id": session_id, "traces": tracer.session_waterfall(session_id, max_traces=limit)}
+
+@app.get("/debug/api-keys")
+async def api_key_stats():
+    """Per-key usage of the Qwen API key pool (keys are masked)"""
+    return {
+        "strategy": qwen_client.key_pool.strategy,
+        "keys": qwen_client.key_pool.stats()
+    }
+
+# ========== 管理端点：按需性能分析 ==========
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Admin endpoints need ADMIN_TOKEN configured and sent as X-Admin-Token"""
+    if not settings.admin_token:
+        raise HTTPException(status_code=403, detail="Admin endpoints disabled (ADMIN_TOKEN not set)")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, settings.admin_token):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+@app.post("/admin/profile/cpu", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+async def profile_cpu(seconds: float = 10.0, interval_ms: float = 5.0, format: str = "top",
+                      limit: int = 40, include_idle: bool = False):
+    """
+    Sample stacks of all threads (event loop included) for a bounded time
+
+    format=collapsed returns flamegraph.pl / speedscope input, format=top a text summary.
+    """
+    if format not in ("top", "collapsed"):
+        raise HTTPException(status_code=400, detail="format must be 'top' or 'collapsed'")
+    try:
+        profile = await asyncio.to_thread(cpu_profiler.profile, seconds, interval_ms / 1000, include_idle)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return profile.collapsed() if format == "collapsed" else profile.top(limit)
+
+
+@app.post("/admin/profile/memory/start", dependencies=[Depends(require_admin)])
+async def memory_profile_start(frames: int = 10):
+    """Start tracemalloc (adds allocation overhead until stopped)"""
+    memory_profiler.start(frames)
+    return {"tracing": memory_profiler.tracing}
+
+
+@app.post("/admin/profile/memory/stop", dependencies=[Depends(require_admin)])
+async def memory_profile_stop():
+    memory_profiler.stop()
+    return {"tracing": memory_profiler.tracing}
+
+
+@app.post("/admin/profile/memory/snapshot", dependencies=[Depends(require_admin)])
+async def memory_profile_snapshot(limit: int = 30):
+    try:
+        snapshot_id = await asyncio.to_thread(memory_profiler.snapshot)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"id": snapshot_id, "top": memory_profiler.top(snapshot_id, limit)}
+
+
+@app.get("/admin/profile/memory/snapshots", dependencies=[Depends(require_admin)])
+async def memory_profile_snapshots():
+    return {"tracing": memory_profiler.tracing, "snapshots": memory_profiler.list_snapshots()}
+
+
+@app.get("/admin/profile/memory/diff", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+async def memory_profile_diff(base: int, target: Optional[int] = None, limit: int = 30):
+    """Allocation growth between two snapshots (target defaults to the latest)"""
+    try:
+        return await asyncio.to_thread(memory_profiler.diff, base, target, limit)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
 @app.websocket("/ws/analyze/{session_id}")
 async def websocket_analyze(websocket: WebSocket, session_id: str):
     """
     WebSocket endpoint to receive frames from Node.js signaling service
     and stream analysis results back
+
+    Query parameter priority=low|normal|high selects the model routing priority
+    (high always uses the max model).
     """
+    priority = websocket.query_params.get("priority", "normal")
+    if priority not in PRIORITIES:
+        priority = "normal"
     await websocket.accept()
     logger.info(f"WebSocket connected for session: {session_id}")
 
-    token_index = 0
-    frame_count = 0
+    # 接收和分析分开运行：接收循环能立即发现断开，并取消正在进行的分析（关闭 Qwen SSE 流）
+    # WS_FRAME_QUEUE_SIZE > 0 时队列有上限：满了丢弃最旧的帧，分析不会落后于实时画面
+    frames: asyncio.Queue = asyncio.Queue(maxsize=max(0, settings.ws_frame_queue_size))
+    frame_queues[session_id] = frames
+    analysis_task = asyncio.create_task(_analyze_frames(websocket, session_id, frames, priority))
 
+    received = 0
     try:
-        # Create debug directory for this session
-        debug_dir = Path(f"./debug_frames/{session_id}")
-        debug_dir.mkdir(parents=True, exist_ok=True)
-        logger.info(f"Saving debug frames to: {debug_dir}")
-
         while True:
             # Receive frame data (base64 JPEG) from Node.js
             data = await websocket.receive_text()
+            received += 1
+            now = time.monotonic()
+            if frames.full():
+                dropped_at, dropped, _ = frames.get_nowait()
+                FRAMES_DROPPED.inc()
+                frame_wait.observe(now - dropped_at)
+                FRAME_QUEUE_WAIT_SECONDS.observe(now - dropped_at)
+                logger.info(
+                    "Dropped frame %d for session %s, analysis is behind", dropped, session_id,
+                    extra=sampled("ws.frame_dropped")
+                )
+            frames.put_nowait((now, received, data))
 
-            frame_count += 1
-            logger.info(f"Received frame {frame_count} for session {session_id}, size: {len(data)} bytes")
-
-            # Save frame to debug directory
-            try:
-                import time
-                timestamp = int(time.time())
-                frame_path = debug_dir / f"frame_{frame_count:04d}_{timestamp}.jpg"
-                # Decode base64 and save
-                if data.startswith("data:image"):
-                    # Remove data URI prefix if present
-                    image_data = data.split(',')[1]
-                else:
-                    image_data = data
-
-                with open(frame_path, 'wb') as f:
-                    f.write(base64.b64decode(image_data))
-                logger.info(f"[帧{frame_count}] Saved to: {frame_path.name}")
-            except Exception as e:
-                logger.error(f"Failed to save debug frame {frame_count}: {e}")
-
-            # Get conversation context
-            context = context_manager.get_context(session_id)
-
-            # Analyze frame with Qwen
-            try:
-                logger.info(f"[帧{frame_count}] Starting AI analysis...")
-                accumulated_response = ""
-
-                # 先发送帧号标记到前端
-                frame_marker = f"\n\n📸 [分析帧 {frame_count}] "
-                await websocket.send_text(frame_marker)
-
-                async for token in qwen_client.analyze_frame_streaming(data, context):
-                    # Accumulate the complete response
-                    accumulated_response += token
-
-                    # Send token back to Node.js (optional)
-                    await websocket.send_text(token)
-
-                    # Send token to Spring Boot via gRPC
-                    timestamp = int(asyncio.get_event_loop().time() * 1000)
-                    success = await grpc_client.save_analysis(
-                        session_id=session_id,
-                        content=token,
-                        token_index=token_index,
-                        timestamp=timestamp
-                    )
-
-                    if success:
-                        token_index += 1
-                    else:
-                        logger.error(f"Failed to save token {token_index} for session {session_id}")
-
-                # Update context with the complete analysis for continuity
-                # Add as assistant's response
-                if accumulated_response:
-                    summary = f"[帧{frame_count}分析] {accumulated_response[:200]}..."  # 保存摘要避免上下文过长
-                    context_manager.add_to_context(session_id, summary, role="assistant")
-                    logger.info(f"[帧{frame_count}] Analysis completed: {len(accumulated_response)} chars")
-
-            except Exception as e:
-                logger.error(f"Error analyzing frame: {e}", exc_info=True)
-                await websocket.send_text(f"ERROR: {str(e)}")
+            if analysis_task.done():
+                # 分析任务异常退出（例如发送失败），不再继续接收
+                break
 
     except WebSocketDisconnect:
         logger.info(f"WebSocket disconnected for session: {session_id}")
     except Exception as e:
         logger.error(f"WebSocket error for session {session_id}: {e}", exc_info=True)
     finally:
+        if not analysis_task.done():
+            logger.info(f"Cancelling in-flight analysis for session: {session_id}")
+            analysis_task.cancel()
+        try:
+            await analysis_task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Frame analysis failed for session {session_id}: {e}", exc_info=True)
+
+        frame_queues.pop(session_id, None)
+
         # Clean up context
         context_manager.clear_context(session_id)
         logger.info(f"Cleaned up context for session: {session_id}")
 
 
+def _websocket_closed(websocket: WebSocket) -> bool:
+    return WebSocketState.DISCONNECTED in (websocket.client_state, websocket.application_state)
+
+
+async def _send_text(websocket: WebSocket, text: str):
+    """send_text with latency tracking"""
+    start = asyncio.get_event_loop().time()
+    await websocket.send_text(text)
+    elapsed = asyncio.get_event_loop().time() - start
+    WEBSOCKET_SEND_SECONDS.observe(elapsed)
+    span = tracer.current_span()
+    if span:
+        span.add("ws_send_ms", elapsed * 1000)
+
+
+async def _analyze_frames(websocket: WebSocket, session_id: str, frames: asyncio.Queue, priority: str = "normal"):
+    """
+    Consume received frames in order, analyze each with Qwen and stream results
+    back to the WebSocket and to Spring Boot. Cancelled when the client disconnects.
+    """
+    token_index = 0
+    # 模型路由信号：与上一帧的平均像素差
+    change_tracker = FrameChangeTracker() if qwen_client.router else None
+
+    # Create debug directory for this session
+    debug_dir = Path(f"./debug_frames/{session_id}")
+    debug_dir.mkdir(parents=True, exist_ok=True)
+    logger.info(f"Saving debug frames to: {debug_dir}")
+
+    last_frame = 0
+    while True:
+        # 帧序号按接收顺序编号，被丢弃的帧留下空号
+        received_at, frame_count, data = await frames.get()
+        wait = time.monotonic() - received_at
+        frame_wait.observe(wait)
+        FRAME_QUEUE_WAIT_SECONDS.observe(wait)
+
+        if frame_count > last_frame + 1:
+            # 在两帧的分析之间告知客户端，不会插入到其他帧的输出中间
+            skipped = f"{last_frame + 1}" if frame_count == last_frame + 2 else f"{last_frame + 1}-{frame_count - 1}"
+            await _send_text(websocket, f"\n\n⏭ [跳过帧 {skipped}] 分析跟不上实时画面，已丢弃\n")
+        last_frame = frame_count
+
+        logger.info(
+            "Received frame %d for session %s, size: %d bytes", frame_count, session_id, len(data),
+            extra=sampled("ws.frame")
+        )
+
+        with tracer.span("analyze_frame", session_id=session_id, frame=frame_count, frame_bytes=len(data)) as span:
+            routing = None
+            if change_tracker:
+                change = await asyncio.to_thread(change_tracker.update, data)
+                routing = RoutingSignals(change=change, priority=priority)
+                if span and change is not None:
+                    span.set_attribute("change", round(change, 3))
+            token_index = await _analyze_one_frame(
+                websocket, session_id, data, frame_count, token_index, debug_dir, routing
+            )
+
+
+async def _analyze_one_frame(
+    websocket: WebSocket,
+    session_id: str,
+    data: str,
+    frame_count: int,
+    token_index: int,
+    debug_dir: Path,
+    routing: Optional[RoutingSignals] = None
+) -> int:
+    """Analyze a single frame; returns the next token index"""
+    # Save frame to debug directory
+    with tracer.span("save_debug_frame"):
+        try:
+            import time
+            timestamp = int(time.time())
+            frame_path = debug_dir / f"frame_{frame_count:04d}_{timestamp}.jpg"
+            # Decode base64 and save
+            if data.startswith("data:image"):
+                # Remove data URI prefix if present
+                image_data = data.split(',')[1]
+            else:
+                image_data = data
+
+            with open(frame_path, 'wb') as f:
+                f.write(base64.b64decode(image_data))
+            logger.info("[帧%d] Saved to: %s", frame_count, frame_path.name, extra=sampled("ws.debug_frame"))
+        except Exception as e:
+            logger.error(f"Failed to save debug frame {frame_count}: {e}")
+
+    # Get conversation context
+    context = context_manager.get_context(session_id)
+
+    # Analyze frame with Qwen
+    with tracer.span("model") as model_span:
+        try:
+            logger.info("[帧%d] Starting AI analysis...", frame_count, extra=sampled("ws.analysis_start"))
+            accumulated_response = ""
+            model_start = asyncio.get_event_loop().time()
+
+            # 先发送帧号标记到前端
+            frame_marker = f"\n\n📸 [分析帧 {frame_count}] "
+            await _send_text(websocket, frame_marker)
+
+            async for token in qwen_client.analyze_frame_streaming(data, context, routing):
+                if not accumulated_response and model_span:
+                    model_span.set_attribute("ttft_ms", round((asyncio.get_event_loop().time() - model_start) * 1000, 1))
+
+                # Accumulate the complete response
+                accumulated_response += token
+
+                # Send token back to Node.js (optional)
+                await _send_text(websocket, token)
+
+                # Send token to Spring Boot via gRPC
+                loop_time = asyncio.get_event_loop().time()
+                timestamp = int(loop_time * 1000)
+                success = await grpc_client.save_analysis(
+                    session_id=session_id,
+                    content=token,
+                    token_index=token_index,
+                    timestamp=timestamp
+                )
+                if model_span:
+                    model_span.add("persist_ms", (asyncio.get_event_loop().time() - loop_time) * 1000)
+
+                if success:
+                    token_index += 1
+                else:
+                    logger.error(f"Failed to save token {token_index} for session {session_id}")
+
+            if model_span:
+                model_span.set_attribute("chars", len(accumulated_response))
+
+            # 快速档回答被撤回时只保留重新分析的部分
+            accumulated_response = strip_retracted(accumulated_response)
+
+            # Update context with the complete analysis for continuity
+            # Add as assistant's response
+            if accumulated_response:
+                summary = f"[帧{frame_count}分析] {accumulated_response[:200]}..."  # 保存摘要避免上下文过长
+                context_manager.add_to_context(session_id, summary, role="assistant")
+                logger.info(
+                    "[帧%d] Analysis completed: %d chars", frame_count, len(accumulated_response),
+                    extra=sampled("ws.analysis")
+                )
+
+        except WebSocketDisconnect:
+            # Client is gone, stop consuming model output
+            raise
+        except Exception as e:
+            if isinstance(e, RuntimeError) and _websocket_closed(websocket):
+                # 在已关闭的连接上发送时 Starlette 抛出 RuntimeError
+                raise
+            logger.error(f"Error analyzing frame: {e}", exc_info=True)
+            await _send_text(websocket, f"ERROR: {str(e)}")
+
+    return token_index
+
+
 # ========== 视频分析端点（新方案）==========
 
 class VideoAnalysisRequest(BaseModel):
     """视频分析请求"""
     session_id: str
     video_path: str
+    profile: Optional[str] = None  # 窗口转码配置：source / analysis / analysis-low / auto，为空时用默认配置
+    window_mode: Optional[str] = None  # video / frames（抽帧内联发送，不经过 Minio），为空时用默认配置
+    planner: Optional[str] = None  # 窗口规划：fixed / adaptive（按场景切换切分），为空时用默认配置
+    priority: str = "normal"  # 模型路由优先级：low / normal / high（总是使用最强模型）
+    differential: Optional[bool] = None  # 差量窗口：只发送上一窗口之后的新片段，为空时用默认配置
+    deferred: bool = False  # 不需要立即出结果：放入延后队列，低峰或负载低时分析，立即返回 202
+    deadline_seconds: Optional[float] = None  # 延后分析最晚在多少秒内完成，为空时用 DEFERRED_DEFAULT_DEADLINE_HOURS
 
 
 class VideoAnalysisResponse(BaseModel):
@@ -186,10 +553,12 @@ class VideoAnalysisResponse(BaseModel):
     total_windows: int
     status: str
     message: str
+    skipped_windows: int = 0  # 画面无变化、未调用模型的窗口数
+    analyzed_seconds: float = 0.0  # 发送给模型的视频时长（秒）
 
 
 @app.post("/analyze-video", response_model=VideoAnalysisResponse)
-async def analyze_video(request: VideoAnalysisRequest):
+async def analyze_video(request: VideoAnalysisRequest, http_request: Request, response: Response):
     """
     分析上传的视频文件
 
@@ -199,6 +568,9 @@ async def analyze_video(request: VideoAnalysisRequest):
     3. 逐个窗口进行 AI 分析（直接分析视频）
     4. 流式发送结果到 Spring Boot（gRPC）
     5. 管理上下文连贯性
+
+    调用方断开连接（例如 Java worker 超时放弃）时，分析会被立即取消并清理。
+    deferred=true 时只校验并入队，返回 202（status=queued），结果同样经 gRPC 发送。
     """
     session_id = request.session_id
     video_path = request.video_path
@@ -210,155 +582,288 @@ async def analyze_video(request: VideoAnalysisRequest):
         logger.error(f"Video file not found: {video_path}")
         raise HTTPException(status_code=404, detail=f"Video file not found: {video_path}")
 
-    try:
-        # 1. 切片视频为滑动窗口
-        logger.info(f"Slicing video into windows...")
-        windows = video_processor.slice_video_with_sliding_window(video_path, session_id)
-
-        if not windows:
-            logger.warning(f"No windows created for video {video_path}")
-            return VideoAnalysisResponse(
-                session_id=session_id,
-                total_windows=0,
-                status="completed",
-                message="Video too short, no windows created"
-            )
+    _check_analysis_options(request.profile, request.window_mode, request.priority)
 
-        logger.info(f"Created {len(windows)} windows for analysis")
+    if request.planner and request.planner not in WINDOW_PLANNERS:
+        raise HTTPException(status_code=400, detail=f"Unknown window planner: {request.planner}")
 
-        # 2. 逐个窗口上传到Minio并进行 AI 分析
-        token_index = 0
-        previous_summary = None
-        uploaded_urls = []  # 记录所有上传的Minio URL，用于最后清理
+    if session_id in video_pipeline.active_tasks or session_id in deferred_scheduler.queue:
+        raise HTTPException(status_code=409, detail=f"Video analysis already running for session {session_id}")
 
-        for window in windows:
-            logger.info(
-                f"Analyzing window {window.window_index + 1}/{len(windows)}: "
-                f"{window.start_time:.1f}s - {window.end_time:.1f}s"
-            )
+    if request.deferred:
+        return _enqueue_deferred(request, response)
 
-            # 发送窗口标记到前端
-            window_marker = f"\n\n📹 [分析窗口 {window.window_index + 1}/{len(windows)}] ({window.start_time:.1f}s - {window.end_time:.1f}s)\n"
-            timestamp = int(asyncio.get_event_loop().time() * 1000)
-            await grpc_client.save_analysis(
-                session_id=session_id,
-                content=window_marker,
-                token_index=token_index,
-                timestamp=timestamp
-            )
-            token_index += 1
-            logger.info(f"Sent window marker for window {window.window_index + 1}")
-
-            # 上传窗口视频到Minio
-            video_url = None
-            try:
-                logger.info(f"Uploading window {window.window_index} to Minio...")
-                video_url = minio_client.upload_video(window.file_path)
-                uploaded_urls.append(video_url)
-                logger.info(f"Window uploaded: {video_url}")
-            except Exception as e:
-                logger.error(f"Failed to upload window {window.window_index} to Minio: {e}")
-                error_msg = f"\n[ERROR] 上传窗口 {window.window_index} 到Minio失败: {str(e)}\n"
-                timestamp = int(asyncio.get_event_loop().time() * 1000)
-                await grpc_client.save_analysis(
-                    session_id=session_id,
-                    content=error_msg,
-                    token_index=token_index,
-                    timestamp=timestamp
-                )
-                token_index += 1
-                continue  # 跳过这个窗口的分析
+    pipeline_task = asyncio.create_task(video_pipeline.run(
+        session_id, video_path, request.profile, request.window_mode, request.planner, request.priority,
+        request.differential
+    ))
+    watcher_task = asyncio.create_task(_cancel_on_disconnect(http_request, pipeline_task))
 
-            # 获取上下文
-            context = context_manager.get_context(session_id)
+    try:
+        result = await pipeline_task
+    except asyncio.CancelledError:
+        if not pipeline_task.done():
+            # 当前请求本身被取消（服务关闭等），同时取消流水线
+            pipeline_task.cancel()
+            raise
+        # 流水线被取消：调用方断开，或通过 cancel 端点主动取消
+        logger.warning(f"Video analysis aborted for session {session_id}")
+        raise HTTPException(status_code=499, detail="Video analysis cancelled")
+    except Exception as e:
+        logger.error(f"Video analysis failed for session {session_id}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        watcher_task.cancel()
 
-            # AI 分析窗口视频（使用Minio公网URL）
-            accumulated_response = ""
-            token_count = 0
-            try:
-                async for token in qwen_client.analyze_video_streaming(
-                    video_path=video_url,
-                    start_time=window.start_time,
-                    end_time=window.end_time,
-                    context=context,
-                    previous_summary=previous_summary
-                ):
-                    accumulated_response += token
-                    token_count += 1
-
-                    # 发送 token 到 Spring Boot
-                    timestamp = int(asyncio.get_event_loop().time() * 1000)
-                    success = await grpc_client.save_analysis(
-                        session_id=session_id,
-                        content=token,
-                        token_index=token_index,
-                        timestamp=timestamp
-                    )
-
-                    if success:
-                        token_index += 1
-                    else:
-                        logger.error(f"Failed to save token {token_index}")
-
-                # 检查是否有分析结果
-                if accumulated_response.strip():
-                    # 保存完整的分析结果作为上下文
-                    context_manager.add_to_context(session_id, accumulated_response[:500], role="assistant")
-                    previous_summary = accumulated_response[:200]  # 保留前200字符作为摘要
-                    logger.info(f"Window {window.window_index + 1} analyzed: {len(accumulated_response)} chars, {token_count} tokens")
-                else:
-                    # 如果没有返回内容，记录警告并发送提示
-                    logger.warning(f"Window {window.window_index + 1} returned empty response")
-                    empty_msg = f"[警告] 此窗口分析未返回内容\n"
-                    timestamp = int(asyncio.get_event_loop().time() * 1000)
-                    await grpc_client.save_analysis(
-                        session_id=session_id,
-                        content=empty_msg,
-                        token_index=token_index,
-                        timestamp=timestamp
-                    )
-                    token_index += 1
+    return _video_response(session_id, result)
 
-            except Exception as e:
-                logger.error(f"Error analyzing window {window.window_index}: {e}", exc_info=True)
-                error_msg = f"\n[ERROR] 分析窗口 {window.window_index} 时出错: {str(e)}\n"
-                timestamp = int(asyncio.get_event_loop().time() * 1000)
-                await grpc_client.save_analysis(
-                    session_id=session_id,
-                    content=error_msg,
-                    token_index=token_index,
-                    timestamp=timestamp
-                )
-                token_index += 1
 
-        logger.info(f"Video analysis completed for session {session_id}, total tokens: {token_index}")
+def _check_analysis_options(profile: Optional[str], window_mode: Optional[str], priority: str):
+    """校验视频分析请求中的转码配置、窗口模式和优先级"""
+    if profile and profile != AUTO_PROFILE and profile not in TRANSCODE_PROFILES:
+        raise HTTPException(status_code=400, detail=f"Unknown transcode profile: {profile}")
 
-        # 3. 清理Minio上传的文件
-        logger.info(f"Cleaning up {len(uploaded_urls)} uploaded files from Minio...")
-        for url in uploaded_urls:
-            try:
-                minio_client.delete_video(url)
-            except Exception as e:
-                logger.warning(f"Failed to delete Minio file {url}: {e}")
+    if window_mode and window_mode not in ("video", "frames"):
+        raise HTTPException(status_code=400, detail=f"Unknown window mode: {window_mode}")
+
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"Unknown priority: {priority}")
 
-        # 4. 清理本地窗口文件
-        try:
-            video_processor.cleanup_windows(session_id)
-        except Exception as e:
-            logger.warning(f"Failed to cleanup local windows: {e}")
 
+def _video_response(session_id: str, result: PipelineResult) -> VideoAnalysisResponse:
+    if result.total_windows == 0:
         return VideoAnalysisResponse(
             session_id=session_id,
-            total_windows=len(windows),
+            total_windows=0,
             status="completed",
-            message=f"Successfully analyzed {len(windows)} windows"
+            message="Video too short, no windows created"
         )
 
+    return VideoAnalysisResponse(
+        session_id=session_id,
+        total_windows=result.total_windows,
+        status="completed",
+        message=f"Successfully analyzed {result.total_windows - result.skipped_windows} windows "
+                f"({result.skipped_windows} static windows skipped)",
+        skipped_windows=result.skipped_windows,
+        analyzed_seconds=result.analyzed_seconds
+    )
+
+
+@app.post("/analyze-video/{session_id}/cancel")
+async def cancel_video_analysis(session_id: str):
+    """主动取消正在进行的视频分析，或从延后队列中删除"""
+    if deferred_scheduler.cancel(session_id):
+        return {"session_id": session_id, "status": "cancelled"}
+    if not video_pipeline.cancel(session_id):
+        raise HTTPException(status_code=404, detail=f"No running video analysis for session {session_id}")
+    return {"session_id": session_id, "status": "cancelling"}
+
+
+def _enqueue_deferred(request: VideoAnalysisRequest, response: Response) -> VideoAnalysisResponse:
+    if not DeferredQueue.valid_session_id(request.session_id):
+        # session_id 用作队列文件名
+        raise HTTPException(
+            status_code=400, detail="Deferred session_id may only contain letters, digits, '_' and '-'"
+        )
+    deadline_seconds = request.deadline_seconds
+    if deadline_seconds is None:
+        deadline_seconds = settings.deferred_default_deadline_hours * 3600
+    if deadline_seconds <= 0:
+        raise HTTPException(status_code=400, detail="deadline_seconds must be positive")
+
+    job = DeferredJob(
+        session_id=request.session_id,
+        video_path=request.video_path,
+        deadline=time.time() + deadline_seconds,
+        options={
+            "profile": request.profile,
+            "window_mode": request.window_mode,
+            "planner": request.planner,
+            "priority": request.priority,
+            "differential": request.differential,
+        }
+    )
+    deferred_scheduler.submit(job)
+    logger.info(
+        f"Deferred video analysis for session {job.session_id}, deadline in {deadline_seconds / 3600:.1f}h "
+        f"({len(deferred_scheduler.queue)} jobs queued)"
+    )
+    response.status_code = 202
+    return VideoAnalysisResponse(
+        session_id=job.session_id,
+        total_windows=0,
+        status="queued",
+        message=f"Queued for off-peak analysis, deadline in {deadline_seconds / 3600:.1f}h"
+    )
+
+
+async def _run_deferred(job: DeferredJob):
+    """执行一个延后分析任务（由调度器调用），异常时调度器重新排队"""
+    if not Path(job.video_path).exists():
+        # 视频已被删除，重试没有意义
+        logger.error(f"Deferred video analysis dropped for session {job.session_id}: file not found {job.video_path}")
+        return
+    if job.session_id in video_pipeline.active_tasks:
+        raise RuntimeError(f"Video analysis already running for session {job.session_id}")
+    result = await video_pipeline.run(job.session_id, job.video_path, **job.options)
+    logger.info(
+        f"Deferred video analysis completed for session {job.session_id}: "
+        f"{result.total_windows} windows, {result.skipped_windows} skipped"
+    )
+
+
+@app.get("/analyze-video/deferred")
+async def list_deferred_video_analysis():
+    """延后队列中的任务（所有 worker 进程，运行中的在前，其余按截止时间排序）"""
+    now = time.time()
+    queue = deferred_scheduler.queue
+    jobs = [(job, "running") for job in queue.running_jobs()] + [(job, "queued") for job in queue.jobs()]
+    return {
+        "jobs": [
+            {
+                "session_id": job.session_id,
+                "video_path": job.video_path,
+                "status": status,
+                "attempts": job.attempts,
+                "deadline_in_seconds": round(job.deadline - now, 1),
+                "queued_seconds": round(now - job.enqueued_at, 1),
+            }
+            for job, status in jobs
+        ]
+    }
+
+
+class LiveRecordingRequest(BaseModel):
+    """录制中视频的增量分析请求（窗口按 fixed 规划）"""
+    video_path: Optional[str] = None  # 监视正在写入的文件；为空时通过 chunks 端点分块上传
+    profile: Optional[str] = None
+    window_mode: Optional[str] = None
+    priority: str = "normal"
+    differential: Optional[bool] = None
+
+
+@app.post("/recordings/{session_id}", status_code=202)
+async def start_live_recording(session_id: str, request: LiveRecordingRequest):
+    """
+    开始增量分析一段录制中的视频
+
+    数据通过 POST /recordings/{session_id}/chunks 追加（或 video_path 指向正在写入的文件），
+    已写入的部分足够一个窗口时立即分析；POST /recordings/{session_id}/complete 结束录制，
+    补齐剩余窗口后返回与 /analyze-video 相同的结果。
+    """
+    _check_analysis_options(request.profile, request.window_mode, request.priority)
+    if request.video_path and not Path(request.video_path).exists():
+        raise HTTPException(status_code=404, detail=f"Video file not found: {request.video_path}")
+    previous = live_recordings.get(session_id)
+    if session_id in video_pipeline.active_tasks or (previous and not previous.task.done()):
+        raise HTTPException(status_code=409, detail=f"Video analysis already running for session {session_id}")
+
+    recording = LiveRecording(session_id, request.video_path)
+    live_recordings[session_id] = recording
+    recording.task = asyncio.create_task(_run_live_recording(recording, request))
+    logger.info(f"Live recording started for session {session_id}: {recording.path}")
+    return {"session_id": session_id, "status": "recording", "source": "chunks" if recording.owned else "file"}
+
+
+async def _run_live_recording(recording: LiveRecording, request: LiveRecordingRequest) -> Optional[PipelineResult]:
+    """
+    分析录制中的视频；失败时错误保存在 recording.error 中（任务本身不抛出），
+    录制因超时结束而没有调用 complete 时，结果或错误在 INGEST_RESULT_TTL_SECONDS 内仍可取回
+    """
+    session_id = recording.session_id
+    try:
+        return await video_pipeline.run(
+            session_id, recording.path, request.profile, request.window_mode, None, request.priority,
+            request.differential, recording=recording
+        )
+    except asyncio.CancelledError:
+        logger.warning(f"Live video analysis cancelled for session {session_id}")
+        raise
     except Exception as e:
-        logger.error(f"Video analysis failed for session {session_id}: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=str(e))
+        logger.error(f"Live video analysis failed for session {session_id}: {e}", exc_info=True)
+        recording.error = e
+        return None
+    finally:
+        recording.discard()
+        asyncio.get_running_loop().call_later(
+            settings.ingest_result_ttl_seconds, _expire_live_recording, recording
+        )
+
+
+def _expire_live_recording(recording: LiveRecording):
+    if live_recordings.get(recording.session_id) is recording:
+        del live_recordings[recording.session_id]
+
+
+def _live_recording(session_id: str) -> LiveRecording:
+    recording = live_recordings.get(session_id)
+    if recording is None:
+        raise HTTPException(status_code=404, detail=f"No live recording for session {session_id}")
+    return recording
+
+
+@app.post("/recordings/{session_id}/chunks")
+async def append_recording_chunk(session_id: str, http_request: Request, offset: Optional[int] = None):
+    """
+    追加一段录制数据（请求体为原始字节，按录制顺序发送）
+
+    给出 offset（此前已发送的总字节数）时，与服务端已接收的长度不一致会返回 409，
+    响应中的 bytes_received 即下一块应从哪里开始发送。
+    """
+    recording = _live_recording(session_id)
+    if not recording.owned:
+        raise HTTPException(status_code=400, detail="Recording reads a file on disk, chunks cannot be appended")
+    if recording.task.done():
+        raise HTTPException(
+            status_code=409, detail={"message": "Recording analysis already finished", "bytes_received": recording.size}
+        )
+    try:
+        size = await recording.append(http_request.stream(), offset)
+    except (ValueError, RuntimeError) as e:
+        # offset 不一致或录制已结束
+        raise HTTPException(status_code=409, detail={"message": str(e), "bytes_received": recording.size})
+    logger.debug("Recording %s: %d bytes received", session_id, size, extra=sampled("ingest.chunk"))
+    return {"session_id": session_id, "bytes_received": size}
+
+
+@app.post("/recordings/{session_id}/complete", response_model=VideoAnalysisResponse)
+async def complete_live_recording(session_id: str):
+    """
+    结束录制，等待剩余窗口分析完成后返回结果
+
+    录制已因超时结束时直接返回保留的结果（或错误）。
+    """
+    recording = _live_recording(session_id)
+    if not recording.task.done():
+        recording.finish()
+        logger.info(f"Live recording complete for session {session_id}, {recording.size} bytes")
+    try:
+        # shield：调用方断开不影响收尾分析
+        result = await asyncio.shield(recording.task)
+    except asyncio.CancelledError:
+        if not recording.task.done():
+            raise
+        raise HTTPException(status_code=499, detail="Video analysis cancelled")
+    if recording.error is not None:
+        raise HTTPException(status_code=500, detail=str(recording.error))
+    return _video_response(session_id, result)
+
+
+async def _cancel_on_disconnect(http_request: Request, task: asyncio.Task):
+    """轮询调用方连接状态，断开时取消分析任务"""
+    while not task.done():
+        if await http_request.is_disconnected():
+            logger.warning("Caller disconnected, cancelling video analysis")
+            task.cancel()
+            return
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+
+# 导入本模块（FastAPI、各客户端和全局实例）的耗时
+STARTUP_SECONDS.labels("import").set(time.perf_counter() - _import_started)
 
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=settings.service_port)
+    from app.__main__ import main
+    main()
@@ -0,0 +1,231 @@
+"""
+Media Probe - 一次 ffprobe 获取完整媒体元数据并缓存
+
+一次 ffprobe 调用同时读取 format、首个视频流和视频包（pts/关键帧标记），
+解析为 MediaMetadata。结果按 (绝对路径, mtime, size) 缓存：
+- 内存 LRU（MEDIA_PROBE_CACHE_SIZE 条）
+- 可选磁盘旁路文件 <video>.probe.json（MEDIA_PROBE_SIDECAR=true），服务重启后仍可复用
+
+文件被修改（mtime 或大小变化）后缓存自动失效。
+
+浏览器 MediaRecorder 录制的 WebM 通常没有 duration 头，此时用最后一个包的 pts + duration 计算时长。
+"""
+import json
+import logging
+import os
+import re
+import subprocess
+import threading
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import List, Optional, Tuple
+
+from app.config import settings
+from app.metrics import FFPROBE_SECONDS, MEDIA_PROBE_CACHE
+
+logger = logging.getLogger(__name__)
+
+SIDECAR_SUFFIX = ".probe.json"
+SIDECAR_VERSION = 1
+
+# ffprobe csv 输出（nk=0）中的 key=value，逗号分隔，包含逗号的值带引号（例如 format_name="matroska,webm"）
+_FIELD = re.compile(r'(\w+)=("[^"]*"|[^,]*)')
+
+
+@dataclass
+class MediaMetadata:
+    """视频文件元数据"""
+    path: str
+    duration: float
+    width: int = 0
+    height: int = 0
+    fps: float = 0.0
+    codec: str = ""
+    format_name: str = ""
+    bit_rate: int = 0
+    size_bytes: int = 0
+    frame_count: int = 0
+    keyframes: List[float] = field(default_factory=list)  # 关键帧时间（秒），升序
+
+    @property
+    def keyframe_interval(self) -> float:
+        """平均关键帧间隔（秒），关键帧少于 2 个时为整个时长"""
+        if len(self.keyframes) < 2:
+            return self.duration
+        return (self.keyframes[-1] - self.keyframes[0]) / (len(self.keyframes) - 1)
+
+    def keyframe_at_or_before(self, t: float) -> float:
+        """t 之前（含）最近的关键帧时间"""
+        best = 0.0
+        for k in self.keyframes:
+            if k > t:
+                break
+            best = k
+        return best
+
+
+def _parse_rate(value: str) -> float:
+    """解析 "30000/1001" 形式的帧率"""
+    try:
+        if "/" in value:
+            num, den = value.split("/", 1)
+            return float(num) / float(den) if float(den) else 0.0
+        return float(value)
+    except ValueError:
+        return 0.0
+
+
+def _number(value: Optional[str], cast=float, default=0):
+    try:
+        return cast(value) if value not in (None, "", "N/A") else default
+    except ValueError:
+        return default
+
+
+def _run_ffprobe(path: str) -> MediaMetadata:
+    """单次 ffprobe：format + 首个视频流 + 视频包"""
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries',
+        'format=duration,format_name,bit_rate,size'
+        ':stream=codec_name,width,height,avg_frame_rate,r_frame_rate,nb_frames'
+        ':packet=pts_time,duration_time,flags',
+        '-of', 'csv=p=1:nk=0',
+        path
+    ]
+    with FFPROBE_SECONDS.time():
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+
+    fmt: dict = {}
+    stream: dict = {}
+    keyframes: List[float] = []
+    packets = 0
+    last_end = 0.0
+
+    for line in result.stdout.splitlines():
+        section, _, rest = line.partition(",")
+        values = {k: v.strip('"') for k, v in _FIELD.findall(rest)}
+        if section == "packet":
+            pts = _number(values.get("pts_time"), float, None)
+            if pts is None:
+                continue
+            packets += 1
+            last_end = max(last_end, pts + _number(values.get("duration_time"), float, 0.0))
+            if values.get("flags", "").startswith("K"):
+                keyframes.append(pts)
+        elif section == "stream":
+            stream = values
+        elif section == "format":
+            fmt = values
+
+    duration = _number(fmt.get("duration"), float, 0.0) or last_end
+    if duration <= 0:
+        raise ValueError(f"Could not determine duration of {path}")
+
+    fps = _parse_rate(stream.get("avg_frame_rate", "")) or _parse_rate(stream.get("r_frame_rate", ""))
+    keyframes.sort()
+    return MediaMetadata(
+        path=path,
+        duration=duration,
+        width=_number(stream.get("width"), int),
+        height=_number(stream.get("height"), int),
+        fps=round(fps, 3),
+        codec=stream.get("codec_name", ""),
+        format_name=fmt.get("format_name", ""),
+        bit_rate=_number(fmt.get("bit_rate"), int),
+        size_bytes=_number(fmt.get("size"), int),
+        frame_count=_number(stream.get("nb_frames"), int) or packets,
+        keyframes=keyframes,
+    )
+
+
+class MediaProbe:
+    """
+    带缓存的媒体探测器（线程安全，可在 asyncio.to_thread 中调用）
+
+    Args:
+        max_entries: 内存 LRU 容量
+        sidecar: 是否在视频旁写入/读取 .probe.json
+    """
+
+    def __init__(self, max_entries: int = 256, sidecar: bool = False):
+        self.max_entries = max_entries
+        self.sidecar = sidecar
+        self._cache: "OrderedDict[Tuple[str, int, int], MediaMetadata]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls) -> "MediaProbe":
+        return cls(max_entries=settings.media_probe_cache_size, sidecar=settings.media_probe_sidecar)
+
+    def probe(self, video_path: str) -> MediaMetadata:
+        """
+        获取视频元数据（命中缓存时不启动子进程）
+
+        Raises:
+            FileNotFoundError: 文件不存在
+            subprocess.CalledProcessError: ffprobe 失败
+            ValueError: 无法确定时长
+        """
+        path = os.path.abspath(video_path)
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached:
+                self._cache.move_to_end(key)
+                MEDIA_PROBE_CACHE.labels("hit").inc()
+                return cached
+
+        metadata = self._read_sidecar(path, key) if self.sidecar else None
+        if metadata:
+            MEDIA_PROBE_CACHE.labels("sidecar").inc()
+        else:
+            MEDIA_PROBE_CACHE.labels("miss").inc()
+            metadata = _run_ffprobe(path)
+            logger.info(
+                f"Probed {os.path.basename(path)}: {metadata.duration:.2f}s {metadata.width}x{metadata.height} "
+                f"{metadata.codec} @ {metadata.fps:g}fps, {len(metadata.keyframes)} keyframes"
+            )
+            if self.sidecar:
+                self._write_sidecar(path, key, metadata)
+
+        with self._lock:
+            self._cache[key] = metadata
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return metadata
+
+    def invalidate(self, video_path: str):
+        """移除某个文件的所有缓存条目"""
+        path = os.path.abspath(video_path)
+        with self._lock:
+            for key in [k for k in self._cache if k[0] == path]:
+                del self._cache[key]
+
+    def _read_sidecar(self, path: str, key: Tuple[str, int, int]) -> Optional[MediaMetadata]:
+        try:
+            with open(path + SIDECAR_SUFFIX, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != SIDECAR_VERSION or data.get("mtime_ns") != key[1] or data.get("size") != key[2]:
+                return None
+            return MediaMetadata(**data["metadata"])
+        except (OSError, ValueError, TypeError, KeyError):
+            return None
+
+    def _write_sidecar(self, path: str, key: Tuple[str, int, int], metadata: MediaMetadata):
+        data = {"version": SIDECAR_VERSION, "mtime_ns": key[1], "size": key[2], "metadata": asdict(metadata)}
+        try:
+            tmp = path + SIDECAR_SUFFIX + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp, path + SIDECAR_SUFFIX)
+        except OSError as e:
+            logger.debug(f"Could not write probe sidecar for {path}: {e}")
+
+
+media_probe = MediaProbe.from_settings()
@@ -0,0 +1,347 @@
+"""
+Metrics - 轻量级 Prometheus 风格指标
+
+不依赖 prometheus_client，提供 Counter / Gauge / Histogram 和文本格式导出（/metrics）。
+
+设计要点：
+- 热路径只做字典查找 + 加法，不加锁（所有调用都在事件循环线程或 GIL 下的简单运算）
+- 标签必须预先声明，且每个指标的标签组合数量有上限，超出的组合归入 "other"，
+  避免 session_id 之类的无界标签拖垮内存和抓取
+- Gauge 支持回调函数，在抓取时才计算（例如上下文存储大小），热路径零开销
+"""
+import logging
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 每个指标最多保留的标签组合数
+MAX_LABEL_SETS = 64
+OVERFLOW_LABEL_VALUE = "other"
+
+# 默认耗时分桶（秒）：覆盖 gRPC 单次调用（毫秒级）到窗口分析（分钟级）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """指标基类：负责标签校验和基数限制"""
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._overflow_warned = False
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str, **kwargs: str):
+        """获取某个标签组合对应的子指标"""
+        if kwargs:
+            values = tuple(str(kwargs[n]) for n in self.labelnames)
+        else:
+            values = tuple(str(v) for v in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+
+        child = self._children.get(values)
+        if child is None:
+            if len(self._children) >= MAX_LABEL_SETS:
+                if not self._overflow_warned:
+                    logger.warning(f"Metric {self.name} exceeded {MAX_LABEL_SETS} label sets, folding into '{OVERFLOW_LABEL_VALUE}'")
+                    self._overflow_warned = True
+                values = tuple(OVERFLOW_LABEL_VALUE for _ in self.labelnames)
+                child = self._children.get(values)
+            if child is None:
+                child = self._new_child()
+                self._children[values] = child
+        return child
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        lines.extend(self._samples())
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self._children[()].inc(amount)
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"
+            for values, child in list(self._children.items())
+        ]
+
+
+class _GaugeChild:
+    __slots__ = ("value", "callback")
+
+    def __init__(self):
+        self.value = 0.0
+        self.callback: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set_function(self, callback: Callable[[], float]):
+        """抓取时调用 callback 取值"""
+        self.callback = callback
+
+    def get(self) -> float:
+        if self.callback is not None:
+            try:
+                return float(self.callback())
+            except Exception as e:
+                logger.debug(f"Gauge callback failed: {e}")
+                return float("nan")
+        return self.value
+
+    @contextmanager
+    def track_inprogress(self) -> Iterator[None]:
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self._children[()].set(value)
+
+    def inc(self, amount: float = 1.0):
+        self._children[()].inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._children[()].dec(amount)
+
+    def set_function(self, callback: Callable[[], float]):
+        self._children[()].set_function(callback)
+
+    def track_inprogress(self):
+        return self._children[()].track_inprogress()
+
+    def get(self) -> float:
+        return self._children[()].get()
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.get())}"
+            for values, child in list(self._children.items())
+        ]
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个是 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._children[()].observe(value)
+
+    def time(self):
+        return self._children[()].time()
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+            label_str = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{label_str} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{label_str} {child.count}")
+        return lines
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        """Prometheus 文本格式（0.0.4）"""
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(
+    name: str,
+    documentation: str,
+    labelnames: Sequence[str] = (),
+    buckets: Sequence[float] = DEFAULT_BUCKETS
+) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+# ========== 服务指标 ==========
+# 标签取值都是固定的小集合（mode / outcome / kind），不使用 session_id 等无界值
+
+FFPROBE_SECONDS = histogram("streammind_ffprobe_seconds", "Time spent running ffprobe")
+MEDIA_PROBE_CACHE = counter("streammind_media_probe_total", "Media metadata lookups by cache result", ["result"])
+FFMPEG_WINDOW_SECONDS = histogram("streammind_ffmpeg_window_seconds", "Time spent encoding one video window with ffmpeg")
+FFMPEG_FRAMES_SECONDS = histogram("streammind_ffmpeg_frames_seconds", "Time spent sampling JPEG frames from one video window")
+FFMPEG_ACTIVITY_SECONDS = histogram("streammind_ffmpeg_activity_seconds", "Time spent scoring frame activity with ffmpeg", ["scope"])
+VIDEO_ANALYZED_SECONDS = counter("streammind_video_analyzed_seconds_total", "Seconds of footage sent to the model", ["scheme"])
+STATIC_WINDOWS_SKIPPED = counter("streammind_static_windows_skipped_total", "Video windows skipped because nothing changed on screen")
+DEFERRED_JOBS = gauge("streammind_deferred_jobs", "Deferred video analysis jobs in the queue (including running)")
+DEFERRED_JOBS_STARTED = counter("streammind_deferred_jobs_started_total", "Deferred video jobs started", ["reason"])
+DEFERRED_JOBS_FINISHED = counter("streammind_deferred_jobs_finished_total", "Deferred video jobs finished", ["outcome"])
+
+MINIO_UPLOAD_SECONDS = histogram("streammind_minio_upload_seconds", "Minio upload latency", ["outcome"])
+MINIO_UPLOAD_BYTES = counter("streammind_minio_upload_bytes_total", "Bytes uploaded to Minio")
+MINIO_DELETE_SECONDS = histogram("streammind_minio_delete_seconds", "Minio delete latency", ["outcome"])
+
+QWEN_REQUEST_SECONDS = histogram("streammind_qwen_request_seconds", "Qwen streaming request duration", ["mode", "model", "outcome"])
+QWEN_TTFT_SECONDS = histogram("streammind_qwen_time_to_first_token_seconds", "Qwen time to first token", ["mode", "model"])
+QWEN_TOKENS = counter("streammind_qwen_tokens_total", "Streamed Qwen output chunks", ["mode"])
+QWEN_TOKENS_PER_SECOND = histogram(
+    "streammind_qwen_tokens_per_second",
+    "Qwen output chunks per second after the first token",
+    ["mode"],
+    buckets=(1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200)
+)
+QWEN_IN_FLIGHT = gauge("streammind_qwen_in_flight_requests", "Qwen requests currently streaming", ["mode"])
+MODEL_ROUTE_DECISIONS = counter("streammind_model_route_decisions_total", "Model tier chosen for Qwen requests", ["mode", "tier", "reason"])
+MODEL_TIER_TTFT_SECONDS = histogram(
+    "streammind_model_tier_time_to_first_token_seconds",
+    "Time until the first token reaches the caller, by routed tier (escalated: fast answer discarded before any output)",
+    ["mode", "tier"]
+)
+MODEL_ESCALATIONS = counter("streammind_model_escalations_total", "Fast-model answers discarded and re-run on the max model", ["mode", "reason"])
+RESULT_CACHE_LOOKUPS = counter("streammind_result_cache_lookups_total", "Analysis result cache lookups by tier hit or miss", ["mode", "result"])
+RESULT_CACHE_STORES = counter("streammind_result_cache_stores_total", "Analysis results written to the result cache", ["mode"])
+
+GRPC_SAVE_SECONDS = histogram("streammind_grpc_save_analysis_seconds", "gRPC SaveAnalysis latency", ["outcome"])
+
+STARTUP_SECONDS = gauge("streammind_startup_seconds", "Service startup time by phase (import, warm_up)", ["phase"])
+WARM_UP_READY = gauge("streammind_warm_up_ready", "1 when a dependency was reached during startup warm-up", ["dependency"])
+WEBSOCKET_SEND_SECONDS = histogram("streammind_websocket_send_seconds", "WebSocket send_text latency")
+ACTIVE_SESSIONS = gauge("streammind_active_sessions", "Sessions currently being analyzed", ["kind"])
+FRAME_QUEUE_DEPTH = gauge("streammind_frame_queue_depth", "Frames received but not yet analyzed (all sessions)")
+FRAMES_DROPPED = counter("streammind_frames_dropped_total", "WebSocket frames replaced by a newer frame before analysis")
+FRAME_QUEUE_WAIT_SECONDS = histogram("streammind_frame_queue_wait_seconds", "Time a WebSocket frame waits in the session queue before analysis")
+PENDING_WINDOWS = gauge("streammind_pending_video_windows", "Video windows planned but not yet analyzed (all sessions)")
+FFMPEG_PROCESSES = gauge("streammind_ffmpeg_processes", "FFmpeg processes currently running")
+GRPC_IN_FLIGHT = gauge("streammind_grpc_in_flight_requests", "SaveAnalysis calls currently in flight")
+READY = gauge("streammind_ready", "1 when /ready reports the instance as ready (last evaluation)")
+LOAD_SCORE = gauge("streammind_load_score", "Highest load-to-threshold ratio from the last /ready evaluation")
+CONTEXT_STORE_SESSIONS = gauge("streammind_context_store_sessions", "Sessions held in the context store")
@@ -2,23 +2,32 @@
 Minio Client - Upload video files and return public URLs
 Compatible with S3 API
 """
+import asyncio
 import logging
+import os
+import threading
+import time
 from pathlib import Path
-from typing import Optional
+from typing import AsyncIterator, Dict, List, Optional
 import uuid
 from urllib.parse import urljoin
 
-import boto3
 from botocore.exceptions import ClientError
-from botocore.client import Config
 
 from app.config import settings
+from app.log_config import sampled
+from app.metrics import MINIO_DELETE_SECONDS, MINIO_UPLOAD_BYTES, MINIO_UPLOAD_SECONDS
 
 logger = logging.getLogger(__name__)
 
 
 class MinioClient:
-    """Minio客户端（S3兼容）"""
+    """
+    Minio客户端（S3兼容）
+
+    boto3 导入和 S3 客户端创建（加载服务模型）耗时较长，推迟到第一次使用时进行，
+    服务启动时由 warm_up() 在线程池中提前完成。
+    """
 
     def __init__(self):
         """初始化Minio客户端"""
@@ -27,25 +36,56 @@ class MinioClient:
         self.access_key = settings.minio_access_key
         self.secret_key = settings.minio_secret_key
         self.public_url = settings.minio_public_url
+        self.configured = bool(self.endpoint_url and self.bucket_name)
+        self._s3_client = None
+        self._s3_failed = False
+        self._s3_lock = threading.Lock()
 
-        if not all([self.endpoint_url, self.bucket_name]):
+        if not self.configured:
             logger.warning("Minio configuration not complete, upload will not work")
-            self.s3_client = None
-        else:
-            try:
-                # 创建S3客户端（Minio兼容S3 API）
-                self.s3_client = boto3.client(
-                    's3',
-                    endpoint_url=self.endpoint_url,
-                    aws_access_key_id=self.access_key,
-                    aws_secret_access_key=self.secret_key,
-                    config=Config(signature_version='s3v4'),
-                    region_name='us-east-1'  # Minio doesn't require specific region
-                )
-                logger.info(f"Minio client initialized: bucket={self.bucket_name}, endpoint={self.endpoint_url}")
-            except Exception as e:
-                logger.error(f"Failed to initialize Minio client: {e}")
-                self.s3_client = None
+
+    @property
+    def s3_client(self):
+        """S3 客户端（第一次访问时创建，配置不完整或创建失败时为 None）"""
+        if self._s3_client is not None or not self.configured or self._s3_failed:
+            return self._s3_client
+        with self._s3_lock:
+            if self._s3_client is None and not self._s3_failed:
+                try:
+                    import boto3
+                    from botocore.client import Config
+
+                    # 创建S3客户端（Minio兼容S3 API）
+                    self._s3_client = boto3.client(
+                        's3',
+                        endpoint_url=self.endpoint_url,
+                        aws_access_key_id=self.access_key,
+                        aws_secret_access_key=self.secret_key,
+                        config=Config(signature_version='s3v4'),
+                        region_name='us-east-1'  # Minio doesn't require specific region
+                    )
+                    logger.info(f"Minio client initialized: bucket={self.bucket_name}, endpoint={self.endpoint_url}")
+                except Exception as e:
+                    logger.error(f"Failed to initialize Minio client: {e}")
+                    self._s3_failed = True
+        return self._s3_client
+
+    def warm_up(self) -> bool:
+        """
+        创建 S3 客户端并请求一次 HeadBucket（解析 DNS、建立连接池中的第一条连接），
+        第一个窗口上传不再承担这些开销。阻塞调用，应在线程池中运行。
+
+        Returns:
+            bucket 是否可访问
+        """
+        if not self.s3_client:
+            return False
+        try:
+            self.s3_client.head_bucket(Bucket=self.bucket_name)
+            return True
+        except Exception as e:
+            logger.warning(f"Minio warm-up failed for bucket {self.bucket_name}: {e}")
+            return False
 
     def upload_video(self, local_path: str, object_name: Optional[str] = None) -> str:
         """
@@ -74,9 +114,10 @@ class MinioClient:
             unique_id = str(uuid.uuid4())[:8]
             object_name = f"videos/{unique_id}_{filename}"
 
+        upload_start = time.perf_counter()
         try:
             # 上传文件
-            logger.info(f"Uploading {local_path} to Minio as {object_name}...")
+            logger.info("Uploading %s to Minio as %s...", local_path, object_name, extra=sampled("minio.upload"))
 
             # 自动检测 Content-Type
             content_type = 'video/mp4' if local_path.endswith('.mp4') else 'video/webm'
@@ -88,25 +129,126 @@ class MinioClient:
                     object_name,
                     ExtraArgs={'ContentType': content_type}
                 )
+            MINIO_UPLOAD_SECONDS.labels("success").observe(time.perf_counter() - upload_start)
+            MINIO_UPLOAD_BYTES.inc(os.path.getsize(local_path))
 
-            # 生成公网URL
-            # 如果用户配置了公网URL，使用它；否则使用endpoint
-            if self.public_url:
-                public_url = urljoin(self.public_url, object_name)
-            else:
-                # 从endpoint构造URL
-                public_url = f"{self.endpoint_url}/{self.bucket_name}/{object_name}"
-
-            logger.info(f"Video uploaded successfully: {public_url}")
+            public_url = self._public_url(object_name)
+            logger.info("Video uploaded successfully: %s", public_url, extra=sampled("minio.upload"))
             return public_url
 
         except ClientError as e:
+            MINIO_UPLOAD_SECONDS.labels("error").observe(time.perf_counter() - upload_start)
             logger.error(f"Minio error: {e}")
             raise
         except Exception as e:
+            MINIO_UPLOAD_SECONDS.labels("error").observe(time.perf_counter() - upload_start)
             logger.error(f"Failed to upload video to Minio: {e}")
             raise
 
+    async def upload_stream(
+        self,
+        chunks: AsyncIterator[bytes],
+        filename: str,
+        content_type: str = "video/mp4"
+    ) -> str:
+        """
+        把字节流上传到Minio并返回公网URL（不经过本地文件）
+
+        数据按 MINIO_PART_SIZE_MB 分片：总大小不足一个分片时用单次 PUT，否则用分片上传。
+        内存中最多保留两个分片（一个正在上传、一个正在填充），上传慢时通过管道反压 FFmpeg。
+        出错或任务被取消时中止分片上传，不留下不完整的对象。
+
+        Args:
+            chunks: 数据块（例如 VideoProcessor.stream_window_async）
+            filename: 文件名，对象名称为 videos/{uuid}_{filename}
+            content_type: Content-Type
+
+        Returns:
+            str: 公网访问URL
+        """
+        if not self.s3_client:
+            raise RuntimeError("Minio client not initialized, check your configuration")
+
+        object_name = f"videos/{str(uuid.uuid4())[:8]}_{filename}"
+        part_size = max(settings.minio_part_size_mb, 5) * 1024 * 1024  # S3 要求除最后一片外不小于 5 MiB
+        upload_start = time.perf_counter()
+        buffer = bytearray()
+        total = 0
+        upload_id: Optional[str] = None
+        parts: List[Dict] = []
+        in_flight: Optional[asyncio.Future] = None
+
+        try:
+            async for chunk in chunks:
+                buffer += chunk
+                total += len(chunk)
+                if len(buffer) < part_size:
+                    continue
+                if upload_id is None:
+                    response = await asyncio.to_thread(
+                        self.s3_client.create_multipart_upload,
+                        Bucket=self.bucket_name, Key=object_name, ContentType=content_type
+                    )
+                    upload_id = response["UploadId"]
+                if in_flight:
+                    parts.append(await in_flight)
+                in_flight = asyncio.ensure_future(asyncio.to_thread(
+                    self._upload_part, object_name, upload_id, len(parts) + 1, bytes(buffer)
+                ))
+                buffer = bytearray()
+
+            if upload_id is None:
+                await asyncio.to_thread(
+                    self.s3_client.put_object,
+                    Bucket=self.bucket_name, Key=object_name, Body=bytes(buffer), ContentType=content_type
+                )
+            else:
+                if in_flight:
+                    parts.append(await in_flight)
+                    in_flight = None
+                if buffer:
+                    parts.append(await asyncio.to_thread(
+                        self._upload_part, object_name, upload_id, len(parts) + 1, bytes(buffer)
+                    ))
+                await asyncio.to_thread(
+                    self.s3_client.complete_multipart_upload,
+                    Bucket=self.bucket_name, Key=object_name, UploadId=upload_id,
+                    MultipartUpload={"Parts": parts}
+                )
+        except BaseException as e:
+            MINIO_UPLOAD_SECONDS.labels("error").observe(time.perf_counter() - upload_start)
+            if not isinstance(e, asyncio.CancelledError):
+                logger.error(f"Failed to stream {object_name} to Minio: {e}")
+            if in_flight:
+                await asyncio.gather(in_flight, return_exceptions=True)
+            if upload_id:
+                await asyncio.gather(asyncio.to_thread(
+                    self.s3_client.abort_multipart_upload,
+                    Bucket=self.bucket_name, Key=object_name, UploadId=upload_id
+                ), return_exceptions=True)
+            raise
+
+        MINIO_UPLOAD_SECONDS.labels("success").observe(time.perf_counter() - upload_start)
+        MINIO_UPLOAD_BYTES.inc(total)
+        public_url = self._public_url(object_name)
+        logger.info(
+            "Video streamed successfully: %s (%.0f KiB, %d part(s))", public_url, total / 1024, max(len(parts), 1),
+            extra=sampled("minio.upload")
+        )
+        return public_url
+
+    def _upload_part(self, object_name: str, upload_id: str, part_number: int, data: bytes) -> Dict:
+        response = self.s3_client.upload_part(
+            Bucket=self.bucket_name, Key=object_name, UploadId=upload_id, PartNumber=part_number, Body=data
+        )
+        return {"PartNumber": part_number, "ETag": response["ETag"]}
+
+    def _public_url(self, object_name: str) -> str:
+        """生成公网URL：配置了公网URL时使用它，否则从 endpoint 构造"""
+        if self.public_url:
+            return urljoin(self.public_url, object_name)
+        return f"{self.endpoint_url}/{self.bucket_name}/{object_name}"
+
     def delete_video(self, object_name: str) -> bool:
         """
         删除Minio上的视频文件
@@ -121,6 +263,7 @@ class MinioClient:
             logger.warning("Minio client not initialized, cannot delete")
             return False
 
+        delete_start = time.perf_counter()
         try:
             # 如果传入的是完整URL，解析出object_name
             if object_name.startswith("http"):
@@ -138,15 +281,18 @@ class MinioClient:
                     if object_name.startswith(f"{self.bucket_name}/"):
                         object_name = object_name[len(self.bucket_name)+1:]
 
-            logger.info(f"Deleting Minio object: {object_name}")
+            logger.info("Deleting Minio object: %s", object_name, extra=sampled("minio.delete"))
             self.s3_client.delete_object(Bucket=self.bucket_name, Key=object_name)
-            logger.info(f"Successfully deleted: {object_name}")
+            MINIO_DELETE_SECONDS.labels("success").observe(time.perf_counter() - delete_start)
+            logger.info("Successfully deleted: %s", object_name, extra=sampled("minio.delete"))
             return True
 
         except ClientError as e:
+            MINIO_DELETE_SECONDS.labels("error").observe(time.perf_counter() - delete_start)
             logger.error(f"Minio error when deleting {object_name}: {e}")
             return False
         except Exception as e:
+            MINIO_DELETE_SECONDS.labels("error").observe(time.perf_counter() - delete_start)
             logger.error(f"Failed to delete Minio object {object_name}: {e}")
             return False
 
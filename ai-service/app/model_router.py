@@ -0,0 +1,172 @@
+"""
+Model Router - 按请求内容选择模型档位
+
+qwen-vl-max 最慢也最贵，对几乎静止的画面和空闲窗口没有必要。路由依据廉价信号选择档位：
+- 画面变化幅度：相邻帧（或窗口内采样帧）的平均像素差（0-255）
+- 会话优先级：high 总是使用最强模型
+- 没有信号时（例如第一帧 / 第一个窗口）使用最强模型
+
+快速档只先攒够 min_chars 个字的前缀：前缀里出现 [ERROR]/[WARNING] 或低置信度表述
+（"无法确定"、"看不清" 等），或者回答不到 min_chars 字就结束时，丢弃并直接用最强模型
+重新分析（升级），调用方看不出区别。前缀通过后其余 token 直接转发；完整回答仍被判定
+需要升级时，先输出 RETRACTION_MARKER 撤回已发送的内容，再输出最强模型的回答。
+调用方累计文本时用 strip_retracted() 只保留撤回标记之后的部分。
+
+QWEN_FAST_MODEL 为空时不启用路由，全部使用 AI 模型配置（ai_model_name）。
+"""
+import base64
+import io
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+from app.config import settings
+
+try:
+    from PIL import Image, ImageChops, ImageStat
+except ImportError:  # Pillow 未安装时 WebSocket 帧没有变化幅度信号，总是使用最强模型
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+PRIORITIES = ("low", "normal", "high")
+
+# 快速档回答中出现这些表述时升级到最强模型
+LOW_CONFIDENCE_MARKERS = (
+    "无法确定", "无法识别", "无法判断", "看不清", "不清楚", "不确定", "模糊",
+    "unclear", "cannot determine", "not sure",
+)
+
+# 快速档回答已发出一部分后升级时输出，表示之前的内容作废、之后是最强模型的回答
+RETRACTION_MARKER = "\n\n[RETRACTED] 以上快速分析置信度不足，以下为重新分析：\n"
+
+# 比较帧变化时的缩略图长边（像素）
+_THUMBNAIL_EDGE = 160
+
+
+@dataclass
+class RoutingSignals:
+    """一次请求的路由信号"""
+    change: Optional[float] = None  # 平均像素差（0-255），None 表示未知
+    priority: str = "normal"
+
+
+@dataclass
+class RouteDecision:
+    """路由结果"""
+    model: str
+    tier: str    # fast / max
+    reason: str  # high_priority / no_signal / active / low_change
+
+
+class ModelRouter:
+    """
+    模型档位路由
+
+    Args:
+        max_model: 最强模型（默认档）
+        fast_model: 快速模型
+        fast_max_change: 画面变化不超过该值时使用快速模型
+        min_chars: 快速模型回答少于该字数时升级
+    """
+
+    def __init__(self, max_model: str, fast_model: str, fast_max_change: float = 0.5, min_chars: int = 20):
+        self.max_model = max_model
+        self.fast_model = fast_model
+        self.fast_max_change = fast_max_change
+        self.min_chars = min_chars
+
+    @classmethod
+    def from_settings(cls) -> Optional["ModelRouter"]:
+        """QWEN_FAST_MODEL 为空时返回 None（不路由）"""
+        if not settings.qwen_fast_model:
+            return None
+        return cls(
+            max_model=settings.ai_model_name,
+            fast_model=settings.qwen_fast_model,
+            fast_max_change=settings.router_fast_max_change,
+            min_chars=settings.router_min_chars
+        )
+
+    def route(self, signals: Optional[RoutingSignals]) -> RouteDecision:
+        if signals and signals.priority == "high":
+            return RouteDecision(self.max_model, "max", "high_priority")
+        if not signals or signals.change is None:
+            return RouteDecision(self.max_model, "max", "no_signal")
+        if signals.change > self.fast_max_change:
+            return RouteDecision(self.max_model, "max", "active")
+        return RouteDecision(self.fast_model, "fast", "low_change")
+
+    def escalation_reason(self, text: str) -> Optional[str]:
+        """快速模型的完整回答需要升级时返回原因（error / too_short / low_confidence），否则返回 None"""
+        reason = self._flagged(text)
+        if reason is None and len(text.strip()) < self.min_chars:
+            return "too_short"
+        return reason
+
+    def prefix_escalation_reason(self, text: str) -> Optional[str]:
+        """
+        检查尚未输出的回答前缀
+
+        Returns:
+            已能确定需要升级时返回原因（error / low_confidence）；前缀不到 min_chars 字时返回 "pending"；
+            前缀可以放行时返回 None
+        """
+        reason = self._flagged(text)
+        if reason:
+            return reason
+        if len(text.strip()) < self.min_chars:
+            return "pending"
+        return None
+
+    @staticmethod
+    def _flagged(text: str) -> Optional[str]:
+        if "[ERROR]" in text or "[WARNING]" in text:
+            return "error"
+        lowered = text.lower()
+        if any(marker in lowered for marker in LOW_CONFIDENCE_MARKERS):
+            return "low_confidence"
+        return None
+
+
+def strip_retracted(text: str) -> str:
+    """去掉最后一个撤回标记及其之前的内容（没有撤回时原样返回）"""
+    _, marker, rest = text.rpartition(RETRACTION_MARKER)
+    return rest if marker else text
+
+
+class FrameChangeTracker:
+    """
+    记录会话上一帧的灰度缩略图，计算新帧的平均像素差
+
+    JPEG 用 draft 模式按 1/2、1/4、1/8 比例解码，只需要几毫秒；建议在线程池中调用 update()。
+    """
+
+    def __init__(self):
+        self._previous = None
+
+    def update(self, image: str) -> Optional[float]:
+        """
+        Args:
+            image: base64 JPEG（可带 data URI 前缀）
+
+        Returns:
+            与上一帧的平均像素差（0-255）；第一帧、Pillow 未安装或解码失败时返回 None
+        """
+        if Image is None:
+            return None
+        try:
+            if image.startswith("data:image"):
+                image = image.split(",", 1)[1]
+            frame = Image.open(io.BytesIO(base64.b64decode(image)))
+            frame.draft("L", (_THUMBNAIL_EDGE, _THUMBNAIL_EDGE))
+            frame = frame.convert("L")
+            frame.thumbnail((_THUMBNAIL_EDGE, _THUMBNAIL_EDGE))
+        except Exception as e:
+            logger.debug(f"Could not decode frame for change detection: {e}")
+            return None
+
+        previous, self._previous = self._previous, frame
+        if previous is None or previous.size != frame.size:
+            return None
+        return ImageStat.Stat(ImageChops.difference(previous, frame)).mean[0]
@@ -0,0 +1,217 @@
+"""
+Profiler - 生产环境按需性能分析
+
+- CPU：后台线程定时采样所有线程（包括事件循环线程）的调用栈，限时运行，开销与采样间隔成正比。
+  输出 collapsed 格式（可直接交给 flamegraph.pl / speedscope）或按自身/累计采样数排序的 top-N 文本。
+- 内存：基于 tracemalloc 的快照和快照差异（top-N 分配位置）。
+
+同一时间只允许一个 CPU 采样任务。
+"""
+import logging
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAX_PROFILE_SECONDS = 60.0
+MIN_INTERVAL_SECONDS = 0.001
+
+
+@dataclass
+class CpuProfile:
+    """一次采样的结果"""
+    duration: float
+    interval: float
+    samples: int = 0
+    stacks: Counter = field(default_factory=Counter)  # collapsed stack -> 采样数
+
+    def collapsed(self) -> str:
+        """flamegraph collapsed 格式：每行 "frame;frame;frame count" """
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+    def top(self, limit: int = 30) -> str:
+        """按自身采样数和累计采样数排序的函数列表"""
+        self_counts: Counter = Counter()
+        total_counts: Counter = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            self_counts[frames[-1]] += count
+            for frame in set(frames[1:]):  # 跳过线程名
+                total_counts[frame] += count
+
+        total = max(self.samples, 1)
+        lines = [
+            f"CPU profile: {self.samples} samples over {self.duration:.1f}s (interval {self.interval * 1000:.1f}ms)",
+            "",
+            f"{'self%':>7} {'total%':>7}  function",
+        ]
+        for frame, count in self_counts.most_common(limit):
+            lines.append(f"{count * 100 / total:6.1f}% {total_counts[frame] * 100 / total:6.1f}%  {frame}")
+        return "\n".join(lines) + "\n"
+
+
+class SamplingProfiler:
+    """基于 sys._current_frames() 的采样分析器"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def profile(self, seconds: float, interval: float = 0.005, include_idle: bool = False) -> CpuProfile:
+        """
+        阻塞采样 seconds 秒（应在线程池中调用，不要在事件循环里直接调用）
+
+        Args:
+            seconds: 采样时长，最大 60 秒
+            interval: 采样间隔（秒）
+            include_idle: 是否保留空闲线程（等待锁/selector）的样本
+
+        Raises:
+            RuntimeError: 已有采样在运行
+        """
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A CPU profile is already running")
+
+        seconds = min(max(seconds, 0.1), MAX_PROFILE_SECONDS)
+        interval = max(interval, MIN_INTERVAL_SECONDS)
+        result = CpuProfile(duration=seconds, interval=interval)
+        own_id = threading.get_ident()
+
+        try:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_id:
+                        continue
+                    stack = self._collapse(frame)
+                    if not include_idle and self._is_idle(stack):
+                        continue
+                    name = names.get(thread_id)
+                    if name is None:
+                        names = {t.ident: t.name for t in threading.enumerate()}
+                        name = names.get(thread_id, str(thread_id))
+                    result.stacks[f"{name};{';'.join(stack)}"] += 1
+                    result.samples += 1
+                time.sleep(interval)
+        finally:
+            self._lock.release()
+
+        logger.info(f"CPU profile finished: {result.samples} samples in {seconds:.1f}s")
+        return result
+
+    @staticmethod
+    def _collapse(frame) -> List[str]:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+            frame = frame.f_back
+        stack.reverse()
+        return stack
+
+    @staticmethod
+    def _is_idle(stack: List[str]) -> bool:
+        """线程在等待 I/O 或锁（selector.select、Condition.wait、队列 get）时视为空闲"""
+        if not stack:
+            return True
+        leaf = stack[-1]
+        return leaf.startswith(("select (", "wait (", "_worker (", "get (", "poll (", "_wait_for_tstate_lock ("))
+
+
+class MemoryProfiler:
+    """tracemalloc 快照管理"""
+
+    def __init__(self, max_snapshots: int = 10):
+        self.max_snapshots = max_snapshots
+        self._snapshots: Dict[int, Tuple[float, tracemalloc.Snapshot]] = {}
+        self._next_id = 1
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = 10):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            logger.info(f"tracemalloc started ({frames} frames)")
+
+    def stop(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+            self._snapshots.clear()
+            logger.info("tracemalloc stopped")
+
+    def snapshot(self) -> int:
+        """
+        拍摄快照，返回快照 ID（只保留最近 max_snapshots 个）
+
+        Raises:
+            RuntimeError: tracemalloc 未启动
+        """
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is not running, start it first")
+        snap = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+        snapshot_id = self._next_id
+        self._next_id += 1
+        self._snapshots[snapshot_id] = (time.time(), snap)
+        while len(self._snapshots) > self.max_snapshots:
+            del self._snapshots[min(self._snapshots)]
+        return snapshot_id
+
+    def list_snapshots(self) -> List[dict]:
+        return [
+            {"id": sid, "taken_at": taken_at}
+            for sid, (taken_at, _) in sorted(self._snapshots.items())
+        ]
+
+    def _get(self, snapshot_id: int) -> tracemalloc.Snapshot:
+        if snapshot_id not in self._snapshots:
+            raise KeyError(f"Snapshot {snapshot_id} not found")
+        return self._snapshots[snapshot_id][1]
+
+    def top(self, snapshot_id: int, limit: int = 30, key_type: str = "lineno") -> str:
+        """快照中分配最多的位置"""
+        snap = self._get(snapshot_id)
+        stats = snap.statistics(key_type)
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [
+            f"Snapshot {snapshot_id}: traced current={current / 1e6:.1f}MB peak={peak / 1e6:.1f}MB",
+            "",
+        ]
+        for stat in stats[:limit]:
+            frame = stat.traceback[0]
+            lines.append(f"{stat.size / 1024:10.1f} KiB {stat.count:8d} blocks  {frame.filename}:{frame.lineno}")
+        return "\n".join(lines) + "\n"
+
+    def diff(self, base_id: int, target_id: Optional[int] = None, limit: int = 30, key_type: str = "lineno") -> str:
+        """两个快照之间增长最多的分配位置（target 默认取最新快照）"""
+        base = self._get(base_id)
+        if target_id is None:
+            target_id = max(self._snapshots)
+        target = self._get(target_id)
+        stats = target.compare_to(base, key_type)
+        lines = [f"Allocation diff: snapshot {base_id} -> {target_id}", ""]
+        for stat in stats[:limit]:
+            frame = stat.traceback[0]
+            lines.append(
+                f"{stat.size_diff / 1024:+10.1f} KiB {stat.count_diff:+8d} blocks  "
+                f"(now {stat.size / 1024:.1f} KiB)  {frame.filename}:{frame.lineno}"
+            )
+        return "\n".join(lines) + "\n"
+
+
+cpu_profiler = SamplingProfiler()
+memory_profiler = MemoryProfiler()
@@ -1,12 +1,33 @@
+import asyncio
+import functools
 import httpx
 import logging
-from typing import AsyncGenerator
-import json
+import time
+from typing import AsyncGenerator, Callable, List, Optional, Tuple
+from contextlib import aclosing
 
 from .config import settings
+from .key_pool import ApiKeyPool
+from .qwen_replay import RecordingTransport, transport_from_settings
+from .model_router import RETRACTION_MARKER, ModelRouter, RoutingSignals, strip_retracted
+from .result_cache import ResultCache
+from .metrics import (
+    MODEL_ESCALATIONS, MODEL_ROUTE_DECISIONS, MODEL_TIER_TTFT_SECONDS,
+    QWEN_IN_FLIGHT, QWEN_REQUEST_SECONDS, QWEN_TOKENS, QWEN_TOKENS_PER_SECOND, QWEN_TTFT_SECONDS
+)
+from .sse_parser import DashScopeChunk, iter_dashscope_chunks
 
 logger = logging.getLogger(__name__)
 
+# Bump when the prompts or the way responses are post-processed change, so cached results are not reused
+PROMPT_VERSION = "1"
+
+# Responses containing these markers are not cached
+_UNCACHEABLE_MARKERS = ("[ERROR]", "[WARNING]")
+
+# Yielded internally by _fast_tier when the fast answer was discarded before any output
+_ESCALATED = object()
+
 ANALYSIS_PROMPT = """请分析这张屏幕截图,基于前面的分析历史,**只描述发生的变化和新的活动**:
 
 重点关注:
@@ -51,20 +72,371 @@ VIDEO_ANALYSIS_PROMPT_TEMPLATE = """请分析这段视频内容（时间范围
 请开始分析：
 """
 
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    """Parse the Retry-After header (seconds) if the server sent one"""
+    value = response.headers.get("Retry-After")
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
 class QwenVisionClient:
-    def __init__(self):
-        self.api_key = settings.qwen_api_key
-        self.api_url = settings.qwen_api_url
+    def __init__(
+        self,
+        key_pool: Optional[ApiKeyPool] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        cache: Optional[ResultCache] = None,
+        router: Optional[ModelRouter] = None
+    ):
+        """
+        Args:
+            key_pool: API key pool (default: built from settings)
+            transport: httpx transport shared by all requests, e.g. a recording or
+                replay transport (default: from QWEN_RECORD_DIR / QWEN_REPLAY_DIR,
+                otherwise a direct connection)
+            cache: Result cache keyed by content (default: from RESULT_CACHE_* settings,
+                None when disabled)
+            router: Fast/max model routing (default: from QWEN_FAST_MODEL, None when
+                not configured, i.e. every request uses the max model)
+        """
+        self.key_pool = key_pool or ApiKeyPool.from_settings()
         self.model = settings.ai_model_name
         self.timeout = settings.timeout_seconds
+        self.transport = transport or transport_from_settings()
+        self.cache = cache if cache is not None else ResultCache.from_settings()
+        self.router = router if router is not None else ModelRouter.from_settings()
+        self._http: Optional[httpx.AsyncClient] = None
 
-        if not self.api_key:
+        if not len(self.key_pool):
             logger.warning("Qwen API key not configured!")
 
+    def _client(self) -> httpx.AsyncClient:
+        """
+        Shared AsyncClient, created on first use in the serving event loop
+
+        Connections (and TLS sessions) to DashScope are kept alive and reused across
+        requests instead of being set up again for every frame or window.
+        """
+        if self._http is None or self._http.is_closed:
+            self._http = httpx.AsyncClient(
+                timeout=self.timeout,
+                transport=self.transport,
+                # Streams are long-lived; do not cap concurrency here (the key pool does)
+                limits=httpx.Limits(max_connections=None, max_keepalive_connections=32)
+            )
+        return self._http
+
+    async def warm_up(self, timeout: float = 5.0) -> int:
+        """
+        Resolve DNS and open a TLS connection to every configured endpoint ahead of
+        the first request (a HEAD request, no tokens are spent)
+
+        Skipped for replay and injected test transports, which have nothing to connect to.
+
+        Returns:
+            Number of endpoints reached
+        """
+        if self.transport is not None and not isinstance(self.transport, RecordingTransport):
+            return 0
+        client = self._client()
+
+        async def touch(endpoint: str) -> bool:
+            try:
+                await client.head(endpoint, timeout=timeout)
+                return True
+            except httpx.HTTPError as e:
+                logger.warning(f"Qwen warm-up failed for {endpoint}: {e!r}")
+                return False
+
+        endpoints = sorted({state.endpoint for state in self.key_pool.keys})
+        results = await asyncio.gather(*(touch(endpoint) for endpoint in endpoints))
+        return sum(results)
+
+    async def close(self):
+        """Close the shared client and transport (the recording transport owns a connection pool)"""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+        if isinstance(self.transport, RecordingTransport):
+            await self.transport.shutdown()
+
+    def _throttle_retry(self, can_retry: bool, tried: set) -> Tuple[bool, float]:
+        """Whether to retry a throttled request, and how long to wait for a key to come off cooldown first"""
+        if not can_retry:
+            return False, 0.0
+        delay = self.key_pool.available_in(exclude=tried)
+        if delay > settings.qwen_throttle_max_wait_seconds:
+            logger.warning(f"All API keys cooling down for {delay:.1f}s, not retrying")
+            return False, 0.0
+        return True, delay
+
+    async def _stream_events(self, payload: dict, mode: str) -> AsyncGenerator[DashScopeChunk, None]:
+        """
+        POST a request to DashScope and yield decoded stream chunks
+
+        A key is taken from the pool for every attempt. When a key is throttled
+        (HTTP 429 or a Throttling.* error code) it is put into cooldown and the
+        request is retried on another key, as long as nothing has been yielded yet.
+        When every key is cooling down (e.g. a single key), the retry waits for the
+        earliest cooldown to end if that is within QWEN_THROTTLE_MAX_WAIT_SECONDS,
+        otherwise the throttling error is returned instead of re-sending at once.
+
+        Args:
+            payload: DashScope request body
+            mode: "frame" or "video", used as the metrics label
+
+        Raises:
+            httpx.HTTPStatusError: Non-throttling HTTP errors, or throttling after all retries
+        """
+        attempts = max(1, settings.max_retries)
+        tried = set()
+
+        model = payload.get("model", self.model)
+        request_start = time.perf_counter()
+        first_token_at = None
+        token_count = 0
+        outcome = "error"
+        in_flight = QWEN_IN_FLIGHT.labels(mode)
+        in_flight.inc()
+
+        try:
+            for attempt in range(attempts):
+                key_state = self.key_pool.acquire(exclude=tried)
+                tried.add(key_state.key)
+                can_retry = attempt + 1 < attempts
+                retry = False
+                retry_delay = 0.0
+                failed = True
+                usage = None
+
+                headers = {
+                    "Authorization": f"Bearer {key_state.key}",
+                    "Content-Type": "application/json",
+                    "X-DashScope-SSE": "enable"
+                }
+
+                try:
+                    client = self._client()
+                    async with client.stream(
+                        "POST",
+                        key_state.endpoint,
+                        json=payload,
+                        headers=headers
+                    ) as response:
+                        if response.is_error:
+                            # Read the body so error handlers can log response.text
+                            await response.aread()
+                        if response.status_code == 429:
+                            self.key_pool.mark_throttled(key_state, _retry_after(response))
+                            retry, retry_delay = self._throttle_retry(can_retry, tried)
+                        if not retry:
+                            response.raise_for_status()
+
+                            yielded = False
+                            stream = iter_dashscope_chunks(response.aiter_bytes())
+                            async with aclosing(stream) as chunks:
+                                async for chunk in chunks:
+                                    if chunk.code and str(chunk.code).startswith("Throttling") and not yielded:
+                                        self.key_pool.mark_throttled(key_state)
+                                        retry, retry_delay = self._throttle_retry(can_retry, tried)
+                                        if retry:
+                                            break
+
+                                    if chunk.usage:
+                                        usage = chunk.usage
+
+                                    if chunk.texts:
+                                        token_count += 1
+                                        if first_token_at is None:
+                                            first_token_at = time.perf_counter()
+                                            QWEN_TTFT_SECONDS.labels(mode, model).observe(first_token_at - request_start)
+
+                                    yielded = True
+                                    yield chunk
+                    failed = False
+                except GeneratorExit:
+                    # Caller stopped consuming (e.g. after finish_reason=stop), not a key failure
+                    failed = False
+                    raise
+                finally:
+                    if usage:
+                        self.key_pool.record_usage(
+                            key_state,
+                            input_tokens=usage.get("input_tokens", 0),
+                            output_tokens=usage.get("output_tokens", 0)
+                        )
+                    self.key_pool.release(key_state, error=failed or retry)
+
+                if not retry:
+                    outcome = "success"
+                    return
+                if retry_delay > 0:
+                    logger.warning(
+                        f"All API keys cooling down, retrying Qwen request in {retry_delay:.1f}s "
+                        f"(attempt {attempt + 2}/{attempts})"
+                    )
+                    await asyncio.sleep(retry_delay)
+                else:
+                    logger.warning(f"Retrying Qwen request with another API key (attempt {attempt + 2}/{attempts})")
+        except GeneratorExit:
+            outcome = "success"
+            raise
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            finished_at = time.perf_counter()
+            in_flight.dec()
+            QWEN_REQUEST_SECONDS.labels(mode, model, outcome).observe(finished_at - request_start)
+            QWEN_TOKENS.labels(mode).inc(token_count)
+            if first_token_at is not None and token_count > 1 and finished_at > first_token_at:
+                QWEN_TOKENS_PER_SECOND.labels(mode).observe((token_count - 1) / (finished_at - first_token_at))
+
+    async def _cached(
+        self,
+        payload: dict,
+        mode: str,
+        produce: Callable[[], AsyncGenerator[str, None]],
+        media_digest: Optional[str] = None,
+        store: bool = True
+    ) -> AsyncGenerator[str, None]:
+        """
+        Serve tokens from the result cache, or stream them from produce() and cache them
+
+        Only complete responses without [ERROR]/[WARNING] markers are stored. A response
+        the caller stopped consuming early is not stored either. With store=False a cached
+        answer is still served, but whatever produce() yields is not written back (used
+        for fast-tier answers, which must not be replayed as the max model's answer).
+        """
+        key = self.cache.key(payload, PROMPT_VERSION, media_digest, mode) if self.cache else None
+        if key:
+            cached = await self.cache.lookup(key, mode)
+            if cached is not None:
+                logger.info(f"Result cache hit ({mode}, {len(cached)} tokens)")
+                for token in cached:
+                    yield token
+                return
+
+        tokens = []
+        async with aclosing(produce()) as stream:
+            async for token in stream:
+                tokens.append(token)
+                yield token
+
+        if store and key and tokens and not any(t.startswith(_UNCACHEABLE_MARKERS) for t in tokens):
+            await self.cache.store(key, tokens, mode)
+
+    async def _routed(
+        self,
+        payload: dict,
+        mode: str,
+        routing: Optional[RoutingSignals],
+        stream: Callable[[dict], AsyncGenerator[str, None]],
+        media_digest: Optional[str] = None
+    ) -> AsyncGenerator[str, None]:
+        """
+        Stream tokens from the model tier the router picks for this request, via the result cache
+
+        The result cache only ever stores max-model answers (keyed on payload["model"]).
+        A fast-tier request is still served from the cache when the max model already
+        answered the same request; see _fast_tier for how fast answers are streamed.
+
+        Args:
+            payload: DashScope request body for the max model
+            mode: "frame" or "video", used as the metrics label
+            routing: Routing signals (None: no signal, max model)
+            stream: Called with a payload, yields response tokens
+            media_digest: Content digest for the result cache key (see ResultCache.key)
+        """
+        started = time.perf_counter()
+        tier = "max"
+        produce = functools.partial(stream, payload)
+        store = True
+        if self.router is not None:
+            decision = self.router.route(routing)
+            MODEL_ROUTE_DECISIONS.labels(mode, decision.tier, decision.reason).inc()
+            if decision.tier == "fast":
+                tier = decision.tier
+                produce = functools.partial(self._fast_tier, payload, mode, decision.model, stream, media_digest)
+                store = False
+
+        first = True
+        async with aclosing(self._cached(payload, mode, produce, media_digest, store)) as tokens:
+            async for token in tokens:
+                if first:
+                    first = False
+                    label = "escalated" if token is _ESCALATED else tier
+                    MODEL_TIER_TTFT_SECONDS.labels(mode, label).observe(time.perf_counter() - started)
+                if token is _ESCALATED:
+                    continue
+                yield token
+
+    async def _fast_tier(
+        self,
+        payload: dict,
+        mode: str,
+        fast_model: str,
+        stream: Callable[[dict], AsyncGenerator[str, None]],
+        media_digest: Optional[str] = None
+    ) -> AsyncGenerator[str, None]:
+        """
+        Stream a fast-model answer, escalating to the max model when it is not good enough
+
+        Tokens are held back only until the answer has router.min_chars characters. An
+        error or low-confidence prefix, or an answer that ends before that, is discarded
+        silently (the caller has seen nothing) and the request is re-run on the max model.
+        Past the prefix, tokens are passed straight through and the finished text is
+        checked once more; if it still needs escalation RETRACTION_MARKER is yielded
+        before the max model's answer. The max-model answer goes through the result cache.
+
+        A silent escalation yields the _ESCALATED sentinel first so _routed can label
+        the client-visible latency; _routed drops it.
+        """
+        held = []
+        text = ""
+        released = False
+        reason = None
+        async with aclosing(stream({**payload, "model": fast_model})) as tokens:
+            async for token in tokens:
+                text += token
+                if released:
+                    yield token
+                    continue
+                held.append(token)
+                reason = self.router.prefix_escalation_reason(text)
+                if reason == "pending":
+                    continue
+                if reason is not None:
+                    break
+                released = True
+                for held_token in held:
+                    yield held_token
+                held = []
+
+        if reason in (None, "pending"):
+            reason = self.router.escalation_reason(text)
+            if reason is None:
+                for held_token in held:
+                    yield held_token
+                return
+
+        MODEL_ESCALATIONS.labels(mode, reason).inc()
+        logger.info(
+            f"Escalating {mode} request from {fast_model} to {payload['model']} "
+            f"({reason}, {'retracting sent answer' if released else 'nothing sent'})"
+        )
+        yield RETRACTION_MARKER if released else _ESCALATED
+
+        async with aclosing(self._cached(payload, mode, functools.partial(stream, payload), media_digest)) as tokens:
+            async for token in tokens:
+                yield token
+
     async def analyze_frame_streaming(
         self,
         base64_image: str,
-        context: list[dict] = None
+        context: list[dict] = None,
+        routing: Optional[RoutingSignals] = None
     ) -> AsyncGenerator[str, None]:
         """
         Analyze a single frame with streaming response
@@ -72,6 +444,7 @@ class QwenVisionClient:
         Args:
             base64_image: Base64-encoded JPEG image (with or without data URI prefix)
             context: Previous conversation context (optional)
+            routing: Signals for picking the model tier (optional, default: max model)
 
         Yields:
             str: Individual tokens from the AI response
@@ -109,53 +482,21 @@ class QwenVisionClient:
             }
         }
 
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-            "X-DashScope-SSE": "enable"
-        }
+        async with aclosing(self._routed(payload, "frame", routing, self._stream_frame_tokens)) as tokens:
+            async for token in tokens:
+                yield token
 
+    async def _stream_frame_tokens(self, payload: dict) -> AsyncGenerator[str, None]:
+        """Stream tokens for a frame request, turning errors into [ERROR] tokens"""
         try:
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                async with client.stream(
-                    "POST",
-                    self.api_url,
-                    json=payload,
-                    headers=headers
-                ) as response:
-                    response.raise_for_status()
-
-                    # Parse SSE stream
-                    async for line in response.aiter_lines():
-                        if line.startswith("data:"):
-                            data_str = line[5:].strip()
-                            if not data_str:
-                                continue
-
-                            try:
-                                data = json.loads(data_str)
-                                output = data.get("output", {})
-                                choices = output.get("choices", [])
-
-                                if choices and len(choices) > 0:
-                                    message = choices[0].get("message", {})
-                                    content = message.get("content", [])
-
-                                    # Extract text from content
-                                    for item in content:
-                                        if isinstance(item, dict) and "text" in item:
-                                            yield item["text"]
-                                        elif isinstance(item, str):
-                                            yield item
-
-                                # Check if finished
-                                finish_reason = choices[0].get("finish_reason") if choices else None
-                                if finish_reason == "stop":
-                                    break
-
-                            except json.JSONDecodeError:
-                                logger.warning(f"Failed to parse SSE data: {data_str}")
-                                continue
+            async with aclosing(self._stream_events(payload, mode="frame")) as events:
+                async for chunk in events:
+                    for text in chunk.texts:
+                        yield text
+
+                    # Check if finished
+                    if chunk.is_finished:
+                        break
 
         except httpx.HTTPStatusError as e:
             logger.error(f"Qwen API HTTP error: {e.response.status_code} - {e.response.text}")
@@ -174,34 +515,30 @@ class QwenVisionClient:
         tokens = []
         async for token in self.analyze_frame_streaming(base64_image, context):
             tokens.append(token)
-        return "".join(tokens)
+        return strip_retracted("".join(tokens))
 
-    async def analyze_video_streaming(
+    def _video_payload(
         self,
-        video_path: str,
+        video,
         start_time: float,
         end_time: float,
         context: list[dict] = None,
-        previous_summary: str = None
-    ) -> AsyncGenerator[str, None]:
-        """
-        Analyze a video window with streaming response
-
-        Args:
-            video_path: Path to video file or HTTP/HTTPS URL
-            start_time: Window start time (seconds)
-            end_time: Window end time (seconds)
-            context: Previous conversation context (optional)
-            previous_summary: Summary of previous windows analysis
-
-        Yields:
-            str: Individual tokens from the AI response
-        """
+        previous_summary: str = None,
+        fps: Optional[float] = None,
+        anchor_image: Optional[str] = None
+    ) -> dict:
+        """Build the DashScope request for a video window (URL or list of images)"""
         # Build context instruction
         if previous_summary:
             context_instruction = f"之前的分析摘要：{previous_summary}\n\n请基于以上内容，分析当前时间段的新内容。"
         else:
             context_instruction = "这是第一个分析窗口，请完整描述视频内容。"
+        if anchor_image:
+            # 差量窗口：视频不再包含与上一个窗口重叠的部分，用上一段结束时的画面衔接
+            context_instruction = (
+                f"第一张图片是上一段视频结束时（{start_time:.1f}秒）的画面，这之前的内容已经分析过，"
+                f"视频只包含之后的新内容。\n\n{context_instruction}"
+            )
 
         # Build prompt with time range and context
         prompt = VIDEO_ANALYSIS_PROMPT_TEMPLATE.format(
@@ -210,30 +547,27 @@ class QwenVisionClient:
             context_instruction=context_instruction
         )
 
-        # Build message content
-        # Qwen-VL API 格式：https://help.aliyun.com/zh/model-studio/vision
-        if video_path.startswith("http://") or video_path.startswith("https://"):
-            # Use HTTP URL directly (推荐方式)
-            video_url = video_path
-        else:
-            # 本地文件需要先上传到 Minio 获取 URL
-            logger.warning(f"Local file path detected: {video_path}, should use Minio URL instead")
-            import os
-            abs_video_path = os.path.abspath(video_path)
-            video_url = f"file://{abs_video_path}"
-
         # Qwen-VL API 正确格式
         # type 必须是 'text', 'image', 'audio', 'video' 或 'image_hw' (来自错误信息)
+        video_item = {
+            "type": "video",
+            "video": video
+        }
+        if fps:
+            # 图片序列的抽帧频率，模型据此理解帧间时间间隔
+            video_item["fps"] = round(fps, 3)
+
         message_content = [
-            {
-                "type": "video",
-                "video": video_url
-            },
+            video_item,
             {
                 "type": "text",
                 "text": prompt
             }
         ]
+        if anchor_image:
+            if not anchor_image.startswith("data:image"):
+                anchor_image = f"data:image/jpeg;base64,{anchor_image}"
+            message_content.insert(0, {"type": "image", "image": anchor_image})
 
         # Include context if provided
         messages = []
@@ -246,7 +580,7 @@ class QwenVisionClient:
         })
 
         # Build request payload
-        payload = {
+        return {
             "model": self.model,
             "input": {
                 "messages": messages
@@ -256,71 +590,40 @@ class QwenVisionClient:
             }
         }
 
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-            "X-DashScope-SSE": "enable"
-        }
-
+    async def _stream_video_tokens(
+        self,
+        payload: dict,
+        start_time: float,
+        end_time: float
+    ) -> AsyncGenerator[str, None]:
+        """Stream tokens for a video window request, turning errors into [ERROR] tokens"""
         try:
             logger.info(f"Analyzing video window: {start_time:.1f}s - {end_time:.1f}s")
 
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                async with client.stream(
-                    "POST",
-                    self.api_url,
-                    json=payload,
-                    headers=headers
-                ) as response:
-                    response.raise_for_status()
-
-                    # Parse SSE stream
-                    response_received = False
-                    async for line in response.aiter_lines():
-                        if line.startswith("data:"):
-                            data_str = line[5:].strip()
-                            if not data_str:
-                                continue
-
-                            try:
-                                data = json.loads(data_str)
-
-                                # Check for API errors
-                                if "code" in data and data["code"] != "Success":
-                                    error_msg = data.get("message", "Unknown error")
-                                    logger.error(f"Qwen API error: {error_msg}")
-                                    yield f"[ERROR] Qwen API: {error_msg}"
-                                    break
-
-                                output = data.get("output", {})
-                                choices = output.get("choices", [])
-
-                                if choices and len(choices) > 0:
-                                    response_received = True
-                                    message = choices[0].get("message", {})
-                                    content = message.get("content", [])
-
-                                    # Extract text from content
-                                    if content:
-                                        for item in content:
-                                            if isinstance(item, dict) and "text" in item:
-                                                yield item["text"]
-                                            elif isinstance(item, str):
-                                                yield item
-
-                                # Check if finished
-                                finish_reason = choices[0].get("finish_reason") if choices else None
-                                if finish_reason == "stop":
-                                    break
-
-                            except json.JSONDecodeError:
-                                logger.warning(f"Failed to parse SSE data: {data_str[:100]}...")
-                                continue
-
-                    # Check if any response was received
-                    if not response_received:
-                        logger.warning(f"No response received for video window {start_time:.1f}s - {end_time:.1f}s")
-                        yield "[WARNING] API 未返回分析结果"
+            response_received = False
+            async with aclosing(self._stream_events(payload, mode="video")) as events:
+                async for chunk in events:
+                    # Check for API errors
+                    if chunk.is_error:
+                        error_msg = chunk.message or "Unknown error"
+                        logger.error(f"Qwen API error: {error_msg}")
+                        yield f"[ERROR] Qwen API: {error_msg}"
+                        break
+
+                    if chunk.has_choices:
+                        response_received = True
+
+                    for text in chunk.texts:
+                        yield text
+
+                    # Check if finished
+                    if chunk.is_finished:
+                        break
+
+            # Check if any response was received
+            if not response_received:
+                logger.warning(f"No response received for video window {start_time:.1f}s - {end_time:.1f}s")
+                yield "[WARNING] API 未返回分析结果"
 
         except httpx.HTTPStatusError as e:
             logger.error(f"Qwen API HTTP error: {e.response.status_code} - {e.response.text}")
@@ -332,6 +635,92 @@ class QwenVisionClient:
             logger.error(f"Unexpected error calling Qwen API: {e}", exc_info=True)
             yield f"[ERROR] {str(e)}"
 
+    async def analyze_video_streaming(
+        self,
+        video_path: str,
+        start_time: float,
+        end_time: float,
+        context: list[dict] = None,
+        previous_summary: str = None,
+        content_digest: Optional[str] = None,
+        routing: Optional[RoutingSignals] = None,
+        anchor_image: Optional[str] = None
+    ) -> AsyncGenerator[str, None]:
+        """
+        Analyze a video window with streaming response
+
+        Args:
+            video_path: Path to video file or HTTP/HTTPS URL
+            start_time: Window start time (seconds)
+            end_time: Window end time (seconds)
+            context: Previous conversation context (optional)
+            previous_summary: Summary of previous windows analysis
+            content_digest: Hash of the window file; enables the result cache for this
+                request (the URL itself changes on every upload)
+            routing: Signals for picking the model tier (optional, default: max model)
+            anchor_image: Base64 JPEG of the last already-analyzed frame (differential
+                windows, where the video starts at start_time instead of overlapping)
+
+        Yields:
+            str: Individual tokens from the AI response
+        """
+        # Build message content
+        # Qwen-VL API 格式：https://help.aliyun.com/zh/model-studio/vision
+        if video_path.startswith("http://") or video_path.startswith("https://"):
+            # Use HTTP URL directly (推荐方式)
+            video_url = video_path
+        else:
+            # 本地文件需要先上传到 Minio 获取 URL
+            logger.warning(f"Local file path detected: {video_path}, should use Minio URL instead")
+            import os
+            abs_video_path = os.path.abspath(video_path)
+            video_url = f"file://{abs_video_path}"
+
+        payload = self._video_payload(
+            video_url, start_time, end_time, context, previous_summary, anchor_image=anchor_image
+        )
+        stream = functools.partial(self._stream_video_tokens, start_time=start_time, end_time=end_time)
+        async with aclosing(self._routed(payload, "video", routing, stream, content_digest)) as tokens:
+            async for token in tokens:
+                yield token
+
+    async def analyze_video_frames_streaming(
+        self,
+        images: List[str],
+        start_time: float,
+        end_time: float,
+        context: list[dict] = None,
+        previous_summary: str = None,
+        routing: Optional[RoutingSignals] = None,
+        anchor_image: Optional[str] = None
+    ) -> AsyncGenerator[str, None]:
+        """
+        Analyze a video window sent inline as an ordered list of frames (no object storage)
+
+        Args:
+            images: Base64-encoded JPEG frames in time order (with or without data URI prefix)
+            start_time: Window start time (seconds)
+            end_time: Window end time (seconds)
+            context: Previous conversation context (optional)
+            previous_summary: Summary of previous windows analysis
+            routing: Signals for picking the model tier (optional, default: max model)
+            anchor_image: Base64 JPEG of the last already-analyzed frame (differential windows)
+
+        Yields:
+            str: Individual tokens from the AI response
+        """
+        frames = [i if i.startswith("data:image") else f"data:image/jpeg;base64,{i}" for i in images]
+        duration = end_time - start_time
+        fps = len(frames) / duration if duration > 0 else None
+
+        payload = self._video_payload(
+            frames, start_time, end_time, context, previous_summary, fps=fps, anchor_image=anchor_image
+        )
+        stream = functools.partial(self._stream_video_tokens, start_time=start_time, end_time=end_time)
+        async with aclosing(self._routed(payload, "video", routing, stream)) as tokens:
+            async for token in tokens:
+                yield token
+
     async def analyze_video(
         self,
         video_path: str,
@@ -348,4 +737,4 @@ class QwenVisionClient:
             video_path, start_time, end_time, context, previous_summary
         ):
             tokens.append(token)
-        return "".join(tokens)
+        return strip_retracted("".join(tokens))
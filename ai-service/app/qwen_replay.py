@@ -0,0 +1,269 @@
+"""
+Qwen Record & Replay - 录制和回放 DashScope SSE 流量
+
+作为 httpx transport 挂在 QwenVisionClient 上：
+- RecordingTransport: 透传真实请求，同时把原始 SSE 字节流连同到达时间写入归档目录
+- ReplayTransport: 不访问网络，按请求指纹从归档中找到录制并原样回放（可按原速或加速）
+
+请求指纹只包含对结果有影响且可复现的内容：模型、参数、提示词文本、上下文、
+图片（及图片序列形式的视频）内容的哈希；视频 URL 是随机生成的 Minio 对象名，只记为 "video"。
+
+归档格式：每次请求一个 JSON 文件
+    {"fingerprint", "mode", "request", "status_code", "headers",
+     "headers_at", "chunks": [[偏移秒数, base64 字节], ...]}
+"""
+import asyncio
+import base64
+import hashlib
+import itertools
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 回放时保留的响应头
+_KEPT_HEADERS = ("content-type", "content-encoding", "retry-after", "x-dashscope-request-id")
+
+
+def request_fingerprint(body: dict) -> Tuple[str, str]:
+    """
+    计算请求指纹
+
+    Returns:
+        (fingerprint, mode)：mode 为 "video" 或 "frame"
+    """
+    mode = "frame"
+    messages = []
+    for message in body.get("input", {}).get("messages", []):
+        content = message.get("content")
+        if isinstance(content, list):
+            normalized = []
+            for item in content:
+                if not isinstance(item, dict):
+                    normalized.append(item)
+                elif "video" in item:
+                    mode = "video"
+                    if isinstance(item["video"], list):
+                        # 图片序列：内容可复现，按帧哈希
+                        frames = "".join(str(f) for f in item["video"]).encode("utf-8")
+                        normalized.append({"video": hashlib.sha256(frames).hexdigest()[:16]})
+                    else:
+                        normalized.append({"video": "video"})
+                elif "image" in item:
+                    digest = hashlib.sha256(str(item["image"]).encode("utf-8")).hexdigest()[:16]
+                    normalized.append({"image": digest})
+                else:
+                    normalized.append(item)
+            content = normalized
+        messages.append({"role": message.get("role"), "content": content})
+
+    canonical = json.dumps(
+        {"model": body.get("model"), "parameters": body.get("parameters"), "messages": messages},
+        ensure_ascii=False, sort_keys=True
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest(), mode
+
+
+def _request_summary(body: dict) -> dict:
+    """归档中记录的请求摘要（不含图片数据和 API Key）"""
+    messages = body.get("input", {}).get("messages", [])
+    prompt = ""
+    if messages and isinstance(messages[-1].get("content"), list):
+        prompt = next((item.get("text", "") for item in messages[-1]["content"]
+                       if isinstance(item, dict) and "text" in item), "")
+    return {"model": body.get("model"), "context_messages": max(len(messages) - 1, 0), "prompt": prompt[:200]}
+
+
+class _RecordingStream(httpx.AsyncByteStream):
+    """透传响应字节流，记录每块数据的到达时间，关闭时写入归档"""
+
+    def __init__(self, inner: httpx.AsyncByteStream, on_close):
+        self._inner = inner
+        self._on_close = on_close
+        self.chunks: List[Tuple[float, bytes]] = []
+
+    async def __aiter__(self):
+        async for chunk in self._inner:
+            self.chunks.append((time.perf_counter(), chunk))
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._inner.aclose()
+        finally:
+            await self._on_close(self.chunks)
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """
+    录制 transport
+
+    多个 AsyncClient 共享同一个实例，aclose() 不关闭底层连接池，服务关闭时调用 shutdown()。
+    """
+
+    def __init__(self, archive_dir: str, inner: Optional[httpx.AsyncBaseTransport] = None):
+        self.archive_dir = archive_dir
+        self.inner = inner or httpx.AsyncHTTPTransport()
+        self.recorded = 0
+        os.makedirs(archive_dir, exist_ok=True)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(await request.aread() or b"{}")
+        fingerprint, mode = request_fingerprint(body)
+        started = time.perf_counter()
+        response = await self.inner.handle_async_request(request)
+        headers_at = time.perf_counter() - started
+
+        async def save(chunks: List[Tuple[float, bytes]]):
+            record = {
+                "fingerprint": fingerprint,
+                "mode": mode,
+                "recorded_at": time.time(),
+                "request": _request_summary(body),
+                "status_code": response.status_code,
+                "headers": {k: v for k, v in response.headers.items() if k.lower() in _KEPT_HEADERS},
+                "headers_at": round(headers_at, 6),
+                "chunks": [[round(t - started, 6), base64.b64encode(data).decode("ascii")] for t, data in chunks],
+            }
+            path = os.path.join(self.archive_dir, f"{int(time.time())}-{fingerprint[:16]}-{uuid.uuid4().hex[:6]}.json")
+            try:
+                await asyncio.to_thread(_write_json, path, record)
+                self.recorded += 1
+                logger.debug(f"Recorded Qwen stream {path} ({len(chunks)} chunks)")
+            except OSError as e:
+                logger.warning(f"Failed to write Qwen recording {path}: {e}")
+
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_RecordingStream(response.stream, save),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self):
+        # 共享实例：随单个 AsyncClient 关闭时不关闭连接池
+        pass
+
+    async def shutdown(self):
+        await self.inner.aclose()
+
+
+def _write_json(path: str, record: dict):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(record, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+class _ReplayStream(httpx.AsyncByteStream):
+    """按录制时的时间间隔（除以 speed）回放数据块"""
+
+    def __init__(self, chunks: List[Tuple[float, bytes]], start: float, speed: float):
+        self._chunks = chunks
+        self._start = start
+        self._speed = speed
+
+    async def __aiter__(self):
+        for offset, data in self._chunks:
+            if self._speed > 0:
+                delay = self._start + offset / self._speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            yield data
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """
+    回放 transport
+
+    Args:
+        archive_dir: 录制归档目录
+        speed: 回放速度倍数（1 为原速，0 表示不等待）
+        strict: 为 True 时找不到相同指纹的录制返回 404；
+            否则按请求类型（frame/video）轮流使用其他录制，适合压测
+    """
+
+    def __init__(self, archive_dir: str, speed: float = 1.0, strict: bool = False):
+        self.archive_dir = archive_dir
+        self.speed = speed
+        self.strict = strict
+        self.by_fingerprint: Dict[str, List[dict]] = {}
+        self.by_mode: Dict[str, List[dict]] = {}
+        self._fingerprint_cycles: Dict[str, itertools.cycle] = {}
+        self._mode_cycles: Dict[str, itertools.cycle] = {}
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        if not os.path.isdir(self.archive_dir):
+            logger.warning(f"Qwen replay archive not found: {self.archive_dir}")
+            return
+        for name in sorted(os.listdir(self.archive_dir)):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.archive_dir, name), encoding="utf-8") as f:
+                    record = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping unreadable Qwen recording {name}: {e}")
+                continue
+            record["chunks"] = [(offset, base64.b64decode(data)) for offset, data in record["chunks"]]
+            self.by_fingerprint.setdefault(record["fingerprint"], []).append(record)
+            self.by_mode.setdefault(record.get("mode", "frame"), []).append(record)
+
+        self._fingerprint_cycles = {k: itertools.cycle(v) for k, v in self.by_fingerprint.items()}
+        self._mode_cycles = {k: itertools.cycle(v) for k, v in self.by_mode.items()}
+        logger.info(f"Loaded {sum(len(v) for v in self.by_fingerprint.values())} Qwen recordings from {self.archive_dir}")
+
+    def _find(self, fingerprint: str, mode: str) -> Optional[dict]:
+        if fingerprint in self._fingerprint_cycles:
+            self.hits += 1
+            return next(self._fingerprint_cycles[fingerprint])
+        self.misses += 1
+        if not self.strict and mode in self._mode_cycles:
+            return next(self._mode_cycles[mode])
+        return None
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        start = time.perf_counter()
+        body = json.loads(await request.aread() or b"{}")
+        fingerprint, mode = request_fingerprint(body)
+        record = self._find(fingerprint, mode)
+
+        if record is None:
+            logger.warning(f"No Qwen recording for {mode} request {fingerprint[:16]}")
+            return httpx.Response(
+                404,
+                json={"code": "ReplayMiss", "message": f"No recording for fingerprint {fingerprint}"},
+                request=request,
+            )
+
+        if self.speed > 0:
+            await asyncio.sleep(max(0.0, record.get("headers_at", 0.0) / self.speed))
+
+        return httpx.Response(
+            status_code=record["status_code"],
+            headers=record.get("headers", {}),
+            stream=_ReplayStream(record["chunks"], start, self.speed),
+            request=request,
+        )
+
+
+def transport_from_settings() -> Optional[httpx.AsyncBaseTransport]:
+    """根据 QWEN_REPLAY_DIR / QWEN_RECORD_DIR 构造 transport（都未设置时返回 None，直连 DashScope）"""
+    if settings.qwen_replay_dir:
+        logger.info(f"Qwen replay mode: {settings.qwen_replay_dir} (speed x{settings.qwen_replay_speed})")
+        return ReplayTransport(settings.qwen_replay_dir, settings.qwen_replay_speed, settings.qwen_replay_strict)
+    if settings.qwen_record_dir:
+        logger.info(f"Recording Qwen streams to {settings.qwen_record_dir}")
+        return RecordingTransport(settings.qwen_record_dir)
+    return None
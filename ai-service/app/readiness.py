@@ -0,0 +1,109 @@
+"""
+Readiness - 按实时负载判断实例是否还能接收新任务
+
+/health 只说明进程活着；/ready 汇总当前负载并与阈值比较，超过任一阈值时返回 503，
+负载均衡和 Java worker 据此把新任务分给其他实例。
+
+负载项（阈值为 0 表示不检查该项）：
+- sessions: WebSocket 会话 + 进行中的视频分析
+- pending_windows: 视频分析中尚未处理的窗口
+- queue_wait_seconds: 帧从收到到开始分析的排队时间（最近峰值，按半衰期衰减）
+- qwen_in_flight: 正在进行的 Qwen 流式请求
+- grpc_in_flight: 尚未完成的 SaveAnalysis 调用
+- ffmpeg_processes: 正在运行的 FFmpeg 进程
+- free_disk_mb: 窗口临时目录所在磁盘的剩余空间（低于阈值时不就绪）
+
+load_score 是各项负载与阈值之比的最大值（0 表示空闲，>= 1 表示饱和），便于调度方选择最空闲的实例。
+"""
+import math
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List
+
+from app.config import settings
+
+
+class WaitTracker:
+    """
+    最近的排队等待时间：保持峰值，随时间按半衰期衰减
+
+    Args:
+        half_life: 半衰期（秒）
+    """
+
+    def __init__(self, half_life: float = 30.0):
+        self.half_life = half_life
+        self._peak = 0.0
+        self._at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _decayed(self, now: float) -> float:
+        return self._peak * math.pow(0.5, (now - self._at) / self.half_life)
+
+    def observe(self, wait: float):
+        now = time.monotonic()
+        with self._lock:
+            self._peak = max(wait, self._decayed(now))
+            self._at = now
+
+    def value(self) -> float:
+        with self._lock:
+            return self._decayed(time.monotonic())
+
+
+@dataclass
+class ReadinessThresholds:
+    """就绪阈值，0 表示不检查"""
+    max_sessions: int = 0
+    max_pending_windows: int = 0
+    max_queue_wait_seconds: float = 10.0
+    max_qwen_in_flight: int = 0
+    max_grpc_in_flight: int = 256
+    max_ffmpeg_processes: int = 0
+    min_free_disk_mb: float = 1024.0
+
+    @classmethod
+    def from_settings(cls) -> "ReadinessThresholds":
+        return cls(
+            max_sessions=settings.ready_max_sessions,
+            max_pending_windows=settings.ready_max_pending_windows,
+            max_queue_wait_seconds=settings.ready_max_queue_wait_seconds,
+            max_qwen_in_flight=settings.ready_max_qwen_in_flight,
+            max_grpc_in_flight=settings.ready_max_grpc_in_flight,
+            max_ffmpeg_processes=settings.ready_max_ffmpeg_processes,
+            min_free_disk_mb=settings.ready_min_free_disk_mb
+        )
+
+    def evaluate(self, load: Dict[str, float]) -> dict:
+        """
+        Args:
+            load: 负载项（见模块说明）
+
+        Returns:
+            {"ready", "load_score", "reasons"}，reasons 列出超过阈值的负载项
+        """
+        limits = {
+            "sessions": self.max_sessions,
+            "pending_windows": self.max_pending_windows,
+            "queue_wait_seconds": self.max_queue_wait_seconds,
+            "qwen_in_flight": self.max_qwen_in_flight,
+            "grpc_in_flight": self.max_grpc_in_flight,
+            "ffmpeg_processes": self.max_ffmpeg_processes,
+        }
+        reasons: List[str] = []
+        score = 0.0
+        for name, limit in limits.items():
+            if limit <= 0 or name not in load:
+                continue
+            ratio = load[name] / limit
+            score = max(score, ratio)
+            if ratio >= 1:
+                reasons.append(f"{name} {load[name]:g} >= {limit:g}")
+
+        free_disk = load.get("free_disk_mb")
+        if self.min_free_disk_mb > 0 and free_disk is not None and free_disk < self.min_free_disk_mb:
+            score = max(score, 1.0)
+            reasons.append(f"free_disk_mb {free_disk:.0f} < {self.min_free_disk_mb:.0f}")
+
+        return {"ready": not reasons, "load_score": round(score, 3), "reasons": reasons}
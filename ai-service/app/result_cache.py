@@ -0,0 +1,278 @@
+"""
+Result Cache - 按内容缓存 Qwen 分析结果
+
+相同的帧（静止屏幕、重复的幻灯片）和相同的窗口（重试或重新排队的视频）不再重复调用模型。
+
+缓存键由以下内容计算：
+- 媒体内容摘要：图片 / 图片序列按内容哈希；URL 形式的视频由调用方提供窗口文件的哈希
+- 提示词版本（PROMPT_VERSION）和模型
+- 归一化的请求文本：提示词、上下文（空白折叠，去掉 [帧N分析] 中的帧号，只取最近
+  RESULT_CACHE_CONTEXT_DEPTH 条，实时帧为 RESULT_CACHE_FRAME_CONTEXT_DEPTH 条）
+
+上下文必须参与缓存键：分析提示词要求模型只描述相对历史的变化，同一画面在不同上下文下
+正确的回答不同（第一次是完整描述，之后是"无变化"）。去掉帧号后，上下文最近几条相同的请求
+（例如静止画面连续得到相同的回答）可以在调小上下文条数时命中。
+
+两级存储：
+- 内存 LRU（RESULT_CACHE_SIZE 条，RESULT_CACHE_TTL_SECONDS 过期）
+- 可选磁盘目录（RESULT_CACHE_DIR），服务重启后仍可命中，按 TTL 定期清理
+
+缓存值是模型输出的 token 列表，命中时按原顺序重新流式输出。
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from app.config import settings
+from app.metrics import RESULT_CACHE_LOOKUPS, RESULT_CACHE_STORES
+
+logger = logging.getLogger(__name__)
+
+# 每写入这么多条后清理一次磁盘上的过期条目
+_PRUNE_EVERY = 500
+
+
+def content_digest(data) -> str:
+    """图片（base64 / data URI 字符串）、图片列表或字节内容的摘要"""
+    digest = hashlib.sha256()
+    if isinstance(data, (bytes, bytearray)):
+        digest.update(data)
+    elif isinstance(data, list):
+        for item in data:
+            digest.update(str(item).encode("utf-8"))
+            digest.update(b"\0")
+    else:
+        digest.update(str(data).encode("utf-8"))
+    return digest.hexdigest()
+
+
+# 上下文摘要中的帧号（main.py 写入的 "[帧N分析]"），不同帧的相同结果归一为同一文本
+_FRAME_NUMBER = re.compile(r"\[帧\d+分析\]")
+
+
+def _normalize_text(text: str) -> str:
+    return " ".join(text.split())
+
+
+def _normalize_context(text: str) -> str:
+    return _FRAME_NUMBER.sub("[帧分析]", _normalize_text(text))
+
+
+class ResultCache:
+    """
+    两级分析结果缓存（线程安全，磁盘读写在线程池中进行）
+
+    Args:
+        max_entries: 内存 LRU 容量
+        ttl_seconds: 条目有效期（秒）
+        disk_dir: 磁盘目录，为空时只用内存
+        context_depth: 参与缓存键的最近上下文条数，负数表示全部。
+            调小后静止画面在不同上下文下也能命中，但结果可能与当前上下文不完全衔接
+        frame_context_depth: 实时帧请求（mode="frame"）使用的上下文条数，为空时与 context_depth 相同
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl_seconds: float = 86400,
+        disk_dir: Optional[str] = None,
+        context_depth: int = -1,
+        frame_context_depth: Optional[int] = None
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir
+        self.context_depth = context_depth
+        self.frame_context_depth = context_depth if frame_context_depth is None else frame_context_depth
+        self._memory: "OrderedDict[str, Tuple[float, List[str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stores = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @classmethod
+    def from_settings(cls) -> Optional["ResultCache"]:
+        """RESULT_CACHE_ENABLED=false 时返回 None"""
+        if not settings.result_cache_enabled:
+            return None
+        return cls(
+            max_entries=settings.result_cache_size,
+            ttl_seconds=settings.result_cache_ttl_seconds,
+            disk_dir=settings.result_cache_dir or None,
+            context_depth=settings.result_cache_context_depth,
+            frame_context_depth=settings.result_cache_frame_context_depth
+        )
+
+    def key(
+        self,
+        payload: dict,
+        prompt_version: str,
+        media_digest: Optional[str] = None,
+        mode: str = "video"
+    ) -> Optional[str]:
+        """
+        计算请求的缓存键
+
+        Args:
+            payload: DashScope 请求体
+            prompt_version: 提示词版本
+            media_digest: URL 形式视频的内容摘要（URL 每次上传都不同，不能用于缓存）
+            mode: frame / video，决定参与缓存键的上下文条数
+
+        Returns:
+            缓存键；请求包含没有摘要的视频 URL 时返回 None（不缓存）
+        """
+        messages = payload.get("input", {}).get("messages", [])
+        context, current = messages[:-1], messages[-1:]
+        depth = self.frame_context_depth if mode == "frame" else self.context_depth
+        if depth >= 0:
+            context = context[-depth:] if depth else []
+
+        normalized = []
+        for index, message in enumerate(context + current):
+            normalize = _normalize_context if index < len(context) else _normalize_text
+            content = message.get("content")
+            if isinstance(content, str):
+                normalized.append([message.get("role"), normalize(content)])
+                continue
+            items = []
+            for item in content or []:
+                if not isinstance(item, dict):
+                    items.append(item)
+                elif "video" in item:
+                    video = item["video"]
+                    if isinstance(video, list):
+                        items.append({"video": content_digest(video), "fps": item.get("fps")})
+                    elif media_digest:
+                        items.append({"video": media_digest})
+                    else:
+                        return None
+                elif "image" in item:
+                    items.append({"image": content_digest(item["image"])})
+                elif "text" in item:
+                    items.append({"text": normalize(item["text"])})
+                else:
+                    items.append(item)
+            normalized.append([message.get("role"), items])
+
+        canonical = json.dumps(
+            {"v": prompt_version, "model": payload.get("model"), "messages": normalized},
+            ensure_ascii=False, sort_keys=True
+        )
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    async def lookup(self, key: str, mode: str) -> Optional[List[str]]:
+        """查找缓存（先内存后磁盘），磁盘命中的条目会放回内存"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and now - entry[0] <= self.ttl_seconds:
+                self._memory.move_to_end(key)
+                RESULT_CACHE_LOOKUPS.labels(mode, "memory").inc()
+                return list(entry[1])
+            if entry:
+                del self._memory[key]
+
+        if self.disk_dir:
+            entry = await asyncio.to_thread(self._read_disk, key, now)
+            if entry:
+                self._remember(key, entry)
+                RESULT_CACHE_LOOKUPS.labels(mode, "disk").inc()
+                return list(entry[1])
+
+        RESULT_CACHE_LOOKUPS.labels(mode, "miss").inc()
+        return None
+
+    async def store(self, key: str, tokens: List[str], mode: str):
+        entry = (time.time(), list(tokens))
+        self._remember(key, entry)
+        RESULT_CACHE_STORES.labels(mode).inc()
+        if self.disk_dir:
+            await asyncio.to_thread(self._write_disk, key, entry)
+
+    def clear(self):
+        """清空内存缓存（磁盘条目按 TTL 过期）"""
+        with self._lock:
+            self._memory.clear()
+
+    def _remember(self, key: str, entry: Tuple[float, List[str]]):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _read_disk(self, key: str, now: float) -> Optional[Tuple[float, List[str]]]:
+        path = self._disk_path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            created_at, tokens = float(data["created_at"]), list(data["tokens"])
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, TypeError, KeyError) as e:
+            logger.debug(f"Unreadable result cache entry {path}: {e}")
+            return None
+        if now - created_at > self.ttl_seconds:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return created_at, tokens
+
+    def _write_disk(self, key: str, entry: Tuple[float, List[str]]):
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 临时文件名唯一：相同窗口同时写入同一个键时互不覆盖
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump({"created_at": entry[0], "tokens": entry[1]}, f, ensure_ascii=False)
+                os.replace(tmp, path)
+            except BaseException:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+                raise
+        except OSError as e:
+            logger.warning(f"Failed to write result cache entry {path}: {e}")
+            return
+
+        with self._lock:
+            self._stores += 1
+            prune = self._stores % _PRUNE_EVERY == 0
+        if prune:
+            self.prune_disk()
+
+    def prune_disk(self) -> int:
+        """删除磁盘上的过期条目，返回删除数量"""
+        if not self.disk_dir:
+            return 0
+        cutoff = time.time() - self.ttl_seconds
+        removed = 0
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    continue
+        if removed:
+            logger.info(f"Pruned {removed} expired result cache entries from {self.disk_dir}")
+        return removed
@@ -0,0 +1,262 @@
+"""
+SSE Parser - DashScope 流式响应的增量解析器
+
+直接处理 response.aiter_bytes() 的字节块：
+- 支持 \\n、\\r\\n、\\r 三种换行，以及跨块被截断的行
+- 多行 data: 字段按规范用 \\n 拼接
+- 解析 id: / event: / retry: 字段，忽略注释行（例如 DashScope 的 :HTTP_STATUS/200）
+- JSON 解码优先使用 orjson（未安装时退回标准库 json）
+
+DashScope 事件被解码为 DashScopeChunk，帧分析和视频分析共用。
+"""
+import logging
+from dataclasses import dataclass, field
+from typing import AsyncIterator, List, Optional
+
+try:
+    import orjson
+
+    def _loads(raw: bytes):
+        return orjson.loads(raw)
+
+    JSONDecodeError = orjson.JSONDecodeError
+except ImportError:
+    import json
+
+    def _loads(raw: bytes):
+        return json.loads(raw)
+
+    JSONDecodeError = json.JSONDecodeError
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class SSEEvent:
+    """一个完整的 SSE 事件"""
+    raw: bytes  # data 字段（多行已用 \n 拼接），保持字节形式以便直接交给 JSON 解码
+    event: str = "message"
+    id: Optional[str] = None
+    retry: Optional[int] = None
+
+    @property
+    def data(self) -> str:
+        return self.raw.decode("utf-8", errors="replace")
+
+
+class SSEParser:
+    """
+    增量 SSE 解析器
+
+    用法：
+        parser = SSEParser()
+        async for chunk in response.aiter_bytes():
+            for event in parser.feed(chunk):
+                ...
+        for event in parser.flush():
+            ...
+    """
+
+    def __init__(self):
+        self._buffer = b""
+        self._data: List[bytes] = []
+        self._event: Optional[str] = None
+        self._last_id: Optional[str] = None  # 按规范，id 在后续事件中保持
+        self._retry: Optional[int] = None
+
+    def feed(self, chunk: bytes) -> List[SSEEvent]:
+        """
+        输入一个字节块，返回其中已完整的事件
+
+        Args:
+            chunk: 任意切分的响应字节
+
+        Returns:
+            本次解析出的事件列表（可能为空）
+        """
+        buf = self._buffer + chunk if self._buffer else chunk
+        events: List[SSEEvent] = []
+
+        if b"\r" not in buf:
+            # 快速路径：只有 \n 换行（DashScope 的常见情况）
+            lines = buf.split(b"\n")
+            self._buffer = lines.pop()
+            data = self._data
+            for line in lines:
+                # 常见字段内联处理以减少函数调用
+                if line[:5] == b"data:":
+                    data.append(line[6:] if line[5:6] == b" " else line[5:])
+                elif not line:
+                    if data:
+                        raw = data[0] if len(data) == 1 else b"\n".join(data)
+                        events.append(SSEEvent(raw, self._event or "message", self._last_id, self._retry))
+                        data.clear()
+                    self._event = None
+                elif line[:1] == b":":
+                    continue
+                elif line[:3] == b"id:" and b"\x00" not in line:
+                    value = line[4:] if line[3:4] == b" " else line[3:]
+                    self._last_id = value.decode("utf-8", errors="replace")
+                elif line[:6] == b"event:":
+                    value = line[7:] if line[6:7] == b" " else line[6:]
+                    self._event = value.decode("utf-8", errors="replace")
+                else:
+                    self._process_line(line, events)
+            return events
+
+        start = 0
+        size = len(buf)
+        while start < size:
+            nl = buf.find(b"\n", start)
+            cr = buf.find(b"\r", start, nl if nl != -1 else size)
+            if cr != -1:
+                if cr == size - 1:
+                    # \r 在块尾，可能是被截断的 \r\n，等待下一块
+                    break
+                end = cr
+                next_start = cr + 2 if buf[cr + 1] == 0x0A else cr + 1
+            elif nl != -1:
+                end = nl
+                next_start = nl + 1
+            else:
+                break
+            self._process_line(buf[start:end], events)
+            start = next_start
+
+        self._buffer = buf[start:]
+        return events
+
+    def flush(self) -> List[SSEEvent]:
+        """流结束：处理剩余的不完整行并派发未结束的事件"""
+        events: List[SSEEvent] = []
+        if self._buffer:
+            self._process_line(self._buffer.rstrip(b"\r"), events)
+            self._buffer = b""
+        self._dispatch(events)
+        return events
+
+    def _process_line(self, line: bytes, events: List[SSEEvent]):
+        if not line:
+            self._dispatch(events)
+            return
+        if line[0] == 0x3A:  # ':' 注释行
+            return
+
+        colon = line.find(b":")
+        if colon == -1:
+            name, value = line, b""
+        else:
+            name = line[:colon]
+            value = line[colon + 1:]
+            if value[:1] == b" ":
+                value = value[1:]
+
+        if name == b"data":
+            self._data.append(value)
+        elif name == b"event":
+            self._event = value.decode("utf-8", errors="replace")
+        elif name == b"id":
+            if b"\x00" not in value:
+                self._last_id = value.decode("utf-8", errors="replace")
+        elif name == b"retry":
+            if value.isdigit():
+                self._retry = int(value)
+        # 其他字段按规范忽略
+
+    def _dispatch(self, events: List[SSEEvent]):
+        if not self._data:
+            self._event = None
+            return
+        data = self._data
+        raw = data[0] if len(data) == 1 else b"\n".join(data)
+        events.append(SSEEvent(raw, self._event or "message", self._last_id, self._retry))
+        data.clear()
+        self._event = None
+
+
+@dataclass(slots=True)
+class DashScopeChunk:
+    """DashScope 流式响应中的一个增量结果"""
+    texts: List[str] = field(default_factory=list)
+    finish_reason: Optional[str] = None
+    has_choices: bool = False
+    code: Optional[str] = None
+    message: Optional[str] = None
+    usage: Optional[dict] = None
+    request_id: Optional[str] = None
+    event_id: Optional[str] = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self.texts)
+
+    @property
+    def is_error(self) -> bool:
+        return bool(self.code) and self.code != "Success"
+
+    @property
+    def is_finished(self) -> bool:
+        return self.finish_reason == "stop"
+
+
+def decode_dashscope_event(event: SSEEvent) -> Optional[DashScopeChunk]:
+    """
+    把 SSE 事件解码为 DashScopeChunk
+
+    Returns:
+        解码结果；data 为空或不是合法 JSON 时返回 None
+    """
+    raw = event.raw
+    if not raw or raw.isspace():
+        return None
+
+    try:
+        data = _loads(raw)
+    except JSONDecodeError:
+        logger.warning(f"Failed to parse SSE data: {raw[:100]!r}...")
+        return None
+
+    if not isinstance(data, dict):
+        return None
+
+    get = data.get
+    chunk = DashScopeChunk([], None, False, get("code"), get("message"), get("usage"), get("request_id"), event.id)
+
+    output = data.get("output")
+    choices = output.get("choices") if output else None
+    if choices:
+        chunk.has_choices = True
+        choice = choices[0]
+        chunk.finish_reason = choice.get("finish_reason")
+        message = choice.get("message")
+        content = message.get("content") if message else None
+        if content:
+            # content 可能是 [{"text": ...}] 或纯字符串列表
+            for item in content:
+                if isinstance(item, dict):
+                    text = item.get("text")
+                    if text is not None:
+                        chunk.texts.append(text)
+                elif isinstance(item, str):
+                    chunk.texts.append(item)
+
+    return chunk
+
+
+async def iter_dashscope_chunks(byte_stream: AsyncIterator[bytes]) -> AsyncIterator[DashScopeChunk]:
+    """
+    从响应字节流中逐个产出 DashScopeChunk
+
+    Args:
+        byte_stream: 例如 response.aiter_bytes()
+    """
+    parser = SSEParser()
+    async for raw_chunk in byte_stream:
+        for event in parser.feed(raw_chunk):
+            chunk = decode_dashscope_event(event)
+            if chunk is not None:
+                yield chunk
+    for event in parser.flush():
+        chunk = decode_dashscope_event(event)
+        if chunk is not None:
+            yield chunk
@@ -0,0 +1,365 @@
+"""
+Tracing - 轻量级请求链路追踪
+
+每个 /analyze-video 调用或每个 WebSocket 帧是一条 trace，内部的切片、上传、模型、持久化
+等步骤是带父子关系的 span。当前 span 通过 contextvars 传递，asyncio 任务和
+asyncio.to_thread 会自动继承。
+
+结束的 span 交给可插拔的导出器：
+- memory: 内存环形缓冲，供 /debug/traces/{session_id} 查看瀑布图
+- jsonl: 每个 span 一行 JSON 追加到文件
+- otlp: 按 OTLP/HTTP JSON 格式批量发送到 collector（例如 http://otel-collector:4318/v1/traces）
+"""
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Span:
+    """一个计时单元"""
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str] = None
+    session_id: Optional[str] = None
+    start_ns: int = 0
+    end_ns: int = 0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    status: str = "ok"
+    error: Optional[str] = None
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def add(self, key: str, amount: float):
+        """累加数值属性（例如一个窗口内多次 gRPC 调用的总耗时）"""
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "session_id": self.session_id,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "status": self.status,
+            "error": self.error,
+        }
+
+
+class SpanExporter:
+    """导出器接口"""
+
+    def export(self, span: Span):
+        raise NotImplementedError
+
+    def shutdown(self):
+        pass
+
+
+class RingBufferExporter(SpanExporter):
+    """保留最近 max_spans 个 span（内存）"""
+
+    def __init__(self, max_spans: int = 10000):
+        self.spans: Deque[Span] = deque(maxlen=max_spans)
+
+    def export(self, span: Span):
+        self.spans.append(span)
+
+    def session_spans(self, session_id: str) -> List[Span]:
+        return [s for s in list(self.spans) if s.session_id == session_id]
+
+    def recent_sessions(self, limit: int = 50) -> List[str]:
+        seen: Dict[str, None] = {}
+        for span in reversed(list(self.spans)):
+            if span.session_id and span.session_id not in seen:
+                seen[span.session_id] = None
+                if len(seen) >= limit:
+                    break
+        return list(seen)
+
+
+class JsonFileExporter(SpanExporter):
+    """
+    每个 span 一行 JSON 追加写入文件
+
+    与 OTLPJsonExporter 一样，span 先进入内存队列，由后台线程序列化并写入（文件句柄保持打开），
+    事件循环上不做文件 I/O。
+    """
+
+    def __init__(self, path: str, flush_interval: float = 1.0, max_queue: int = 20000):
+        self.path = path
+        self.flush_interval = flush_interval
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+        self._queue: Deque[Span] = deque(maxlen=max_queue)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="jsonl-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, span: Span):
+        self._queue.append(span)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self._flush()
+        self._flush()
+
+    def _flush(self):
+        if not self._queue:
+            return
+        try:
+            while self._queue:
+                span = self._queue.popleft()
+                self._file.write(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n")
+            self._file.flush()
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to write spans to {self.path}: {e}")
+
+    def shutdown(self):
+        self._stop.set()
+        self._thread.join(timeout=5.0)
+        self._file.close()
+
+
+class OTLPJsonExporter(SpanExporter):
+    """
+    OTLP/HTTP JSON 导出器
+
+    span 先进入内存队列，由后台线程按批发送，不阻塞事件循环；发送失败只记录日志。
+    """
+
+    def __init__(self, endpoint: str, service_name: str = "streammind-ai-service",
+                 batch_size: int = 256, flush_interval: float = 2.0, max_queue: int = 20000):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: Deque[Span] = deque(maxlen=max_queue)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="otlp-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, span: Span):
+        self._queue.append(span)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self._flush()
+        self._flush()
+
+    def _flush(self):
+        while self._queue:
+            batch = []
+            while self._queue and len(batch) < self.batch_size:
+                batch.append(self._queue.popleft())
+            try:
+                import httpx
+                httpx.post(self.endpoint, json=self._to_otlp(batch), timeout=5.0)
+            except Exception as e:
+                logger.warning(f"Failed to export {len(batch)} spans to OTLP endpoint: {e}")
+                return
+
+    def _to_otlp(self, spans: List[Span]) -> dict:
+        def attr(key: str, value: Any) -> dict:
+            if isinstance(value, bool):
+                return {"key": key, "value": {"boolValue": value}}
+            if isinstance(value, int):
+                return {"key": key, "value": {"intValue": str(value)}}
+            if isinstance(value, float):
+                return {"key": key, "value": {"doubleValue": value}}
+            return {"key": key, "value": {"stringValue": str(value)}}
+
+        otlp_spans = []
+        for span in spans:
+            attributes = [attr(k, v) for k, v in span.attributes.items()]
+            if span.session_id:
+                attributes.append(attr("session.id", span.session_id))
+            otlp_span = {
+                "traceId": span.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": 1,  # SPAN_KIND_INTERNAL
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns),
+                "attributes": attributes,
+                "status": {"code": 2, "message": span.error or ""} if span.status == "error" else {"code": 1},
+            }
+            if span.parent_id:
+                otlp_span["parentSpanId"] = span.parent_id
+            otlp_spans.append(otlp_span)
+
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [attr("service.name", self.service_name)]},
+                "scopeSpans": [{"scope": {"name": "app.tracing"}, "spans": otlp_spans}],
+            }]
+        }
+
+    def shutdown(self):
+        self._stop.set()
+        self._thread.join(timeout=5.0)
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+class Tracer:
+    """创建 span 并分发给导出器"""
+
+    def __init__(self, exporters: Optional[List[SpanExporter]] = None, enabled: bool = True):
+        self.exporters: List[SpanExporter] = exporters or []
+        self.enabled = enabled
+        self.ring_buffer: Optional[RingBufferExporter] = next(
+            (e for e in self.exporters if isinstance(e, RingBufferExporter)), None
+        )
+
+    @classmethod
+    def from_settings(cls) -> "Tracer":
+        """
+        根据 TRACE_EXPORTERS 构造（逗号分隔：memory, jsonl, otlp；为空则关闭追踪）
+        """
+        exporters: List[SpanExporter] = []
+        for name in (n.strip().lower() for n in settings.trace_exporters.split(",")):
+            if not name:
+                continue
+            if name == "memory":
+                exporters.append(RingBufferExporter(settings.trace_buffer_size))
+            elif name == "jsonl":
+                exporters.append(JsonFileExporter(settings.trace_file))
+            elif name == "otlp":
+                exporters.append(OTLPJsonExporter(settings.trace_otlp_endpoint))
+            else:
+                logger.warning(f"Unknown trace exporter: {name}")
+        return cls(exporters, enabled=bool(exporters))
+
+    @contextmanager
+    def span(self, name: str, session_id: Optional[str] = None, **attributes: Any) -> Iterator[Optional[Span]]:
+        """
+        开始一个 span，作为当前 span 的子 span（没有当前 span 时开始新的 trace）
+
+        Args:
+            name: span 名称
+            session_id: 会话 ID（不传时继承父 span）
+            **attributes: 初始属性
+
+        Yields:
+            Span（追踪关闭时为 None）
+        """
+        if not self.enabled:
+            yield None
+            return
+
+        parent = _current_span.get()
+        span = Span(
+            name=name,
+            trace_id=parent.trace_id if parent else secrets.token_hex(16),
+            span_id=secrets.token_hex(8),
+            parent_id=parent.span_id if parent else None,
+            session_id=session_id or (parent.session_id if parent else None),
+            start_ns=time.time_ns(),
+            attributes=attributes,
+        )
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = "error"
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            _current_span.reset(token)
+            self._export(span)
+
+    def current_span(self) -> Optional[Span]:
+        return _current_span.get()
+
+    def _export(self, span: Span):
+        for exporter in self.exporters:
+            try:
+                exporter.export(span)
+            except Exception as e:
+                logger.debug(f"Span export failed: {e}")
+
+    def session_waterfall(self, session_id: str, max_traces: int = 20) -> List[dict]:
+        """
+        最近几条 trace 的瀑布图数据（需要 memory 导出器）
+
+        Returns:
+            每条 trace：根 span 名称、总耗时、按开始时间排序的 span（含相对偏移和深度）
+        """
+        if not self.ring_buffer:
+            return []
+
+        by_trace: Dict[str, List[Span]] = {}
+        for span in self.ring_buffer.session_spans(session_id):
+            by_trace.setdefault(span.trace_id, []).append(span)
+
+        traces = []
+        for trace_id, spans in by_trace.items():
+            spans.sort(key=lambda s: s.start_ns)
+            ids = {s.span_id: s for s in spans}
+            trace_start = spans[0].start_ns
+            trace_end = max(s.end_ns for s in spans)
+
+            def depth(s: Span) -> int:
+                d = 0
+                while s.parent_id and s.parent_id in ids:
+                    s = ids[s.parent_id]
+                    d += 1
+                return d
+
+            root = next((s for s in spans if not s.parent_id or s.parent_id not in ids), spans[0])
+            traces.append({
+                "trace_id": trace_id,
+                "root": root.name,
+                "start_ns": trace_start,
+                "duration_ms": round((trace_end - trace_start) / 1e6, 3),
+                "spans": [
+                    {
+                        "name": s.name,
+                        "span_id": s.span_id,
+                        "parent_id": s.parent_id,
+                        "depth": depth(s),
+                        "offset_ms": round((s.start_ns - trace_start) / 1e6, 3),
+                        "duration_ms": round(s.duration_ms, 3),
+                        "status": s.status,
+                        "error": s.error,
+                        "attributes": s.attributes,
+                    }
+                    for s in spans
+                ],
+            })
+
+        traces.sort(key=lambda t: t["start_ns"], reverse=True)
+        return traces[:max_traces]
+
+    def shutdown(self):
+        for exporter in self.exporters:
+            exporter.shutdown()
+
+
+tracer = Tracer.from_settings()
@@ -0,0 +1,748 @@
+"""
+Video Analysis Pipeline - 视频滑动窗口分析流程
+
+流程（逐个窗口）：
+1. FFmpeg 切出窗口视频
+2. 上传到 Minio 获取公网 URL
+3. Qwen 流式分析
+4. token 通过 gRPC 发送到 Spring Boot
+
+图片序列模式（window_mode=frames）跳过 1、2：从窗口抽取若干代表帧，
+以图片列表形式直接放进请求，不经过对象存储。
+
+切片前先计算窗口的画面活动度（VIDEO_SKIP_STATIC_WINDOWS），画面没有变化的窗口不切片、
+不调用模型；连续的静止窗口合并为一条占位标记发送，保持时间线完整。第一个窗口总是分析。
+
+上传方式为 stream（VIDEO_UPLOAD_MODE）时 1、2 合并：FFmpeg 输出分片 MP4 到管道，
+直接分片上传到 Minio，窗口不写入本地磁盘。
+
+启用模型分级路由（QWEN_FAST_MODEL）时，窗口活动度的平均帧差同时作为路由信号：
+画面变化小的窗口先交给快速模型，第一个窗口和高优先级会话总是使用最强模型。
+
+窗口规划为 adaptive（VIDEO_WINDOW_PLANNER）时先解码一遍整段视频得到活动度时间线，
+在场景切换处切分窗口，静止判断也直接复用这条时间线。
+
+差量窗口（VIDEO_DIFFERENTIAL_WINDOWS）时窗口规划不变，但每个窗口只发送上一个窗口结束之后的新片段
+（固定规划下 15 秒窗口变为 10 秒），重叠部分改为一张锚点帧（已分析片段的最后一帧）加上一窗口摘要，
+模型据此衔接叙述。前一个窗口上传失败时下一个窗口仍发送完整窗口。
+
+录制中的视频（LiveRecording，分块上传或正在写入的文件）按 fixed 规划的窗口边界增量分析：
+已写入的部分足够一个完整窗口时立即切出分析，录制结束后按最终时长补齐剩余窗口，
+结果延迟约为一个窗口长度。
+
+整个流程运行在一个 asyncio 任务中，可以随时取消：
+取消时会终止 FFmpeg、关闭 Qwen SSE 流，并立即清理已上传的对象和本地窗口文件。
+"""
+import asyncio
+import hashlib
+import logging
+import subprocess
+import time
+from contextlib import aclosing
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.context_manager import ContextManager
+from app.grpc_client import SpringBootGrpcClient
+from app.live_recording import LiveRecording
+from app.log_config import sampled
+from app.metrics import STATIC_WINDOWS_SKIPPED, VIDEO_ANALYZED_SECONDS
+from app.minio_client import MinioClient
+from app.model_router import RoutingSignals, strip_retracted
+from app.qwen_client import QwenVisionClient
+from app.tracing import Span, tracer
+from app.video_processor import ActivitySample, TranscodeProfile, VideoProcessor, WindowActivity
+
+logger = logging.getLogger(__name__)
+
+# 录制中文件的最后一个包可能属于尚未写完的数据块，窗口结束时间与已写入时长之间留出的余量（秒）
+_LIVE_MARGIN_SECONDS = 1.0
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@dataclass
+class _RunState:
+    """一次 run() 内跨窗口共享的状态"""
+    session_id: str
+    token_index: int = 0
+    previous_summary: Optional[str] = None
+    profile: Optional[TranscodeProfile] = None
+    window_mode: str = "video"  # video: MP4 + Minio URL；frames: 内联图片序列
+    priority: str = "normal"  # 会话优先级，high 时总是使用最强模型
+    differential: bool = False  # 差量窗口：只发送上一个窗口之后的新片段
+    covered_until: Optional[float] = None  # 已发送给模型（或判定为静止）的视频结束时间
+    anchor_time: Optional[float] = None  # 当前窗口被截短时的锚点帧时间（即新片段开始时间）
+    segment_share: float = 1.0  # 当前发送片段占规划窗口的比例（图片序列模式按比例减少帧数）
+    analyzed_seconds: float = 0.0  # 发送给模型的视频总时长
+    skipped_windows: int = 0
+    total_windows: int = 0
+    windows_done: int = 0
+    activity: Optional[WindowActivity] = None  # 当前窗口的活动度（模型路由信号）
+    timeline: Optional[List[ActivitySample]] = None  # adaptive 规划时整段视频的活动度
+    static_run: Optional[Tuple[int, int, float, float]] = None  # 尚未发送占位标记的连续静止窗口 (首, 尾, 开始, 结束)
+    uploaded_urls: List[str] = field(default_factory=list)  # 记录所有上传的Minio URL，用于最后清理
+    pending_uploads: List[asyncio.Future] = field(default_factory=list)  # 取消时仍在进行的上传
+
+
+@dataclass
+class PipelineResult:
+    """视频分析结果"""
+    session_id: str
+    total_windows: int
+    total_tokens: int
+    skipped_windows: int = 0
+    analyzed_seconds: float = 0.0
+
+
+class VideoAnalysisPipeline:
+    """
+    视频分析流水线
+
+    每次 run() 对应一个会话；正在运行的会话记录在 active_tasks 中，
+    可以通过 cancel() 主动取消（例如调用方断开连接）。
+    """
+
+    def __init__(
+        self,
+        qwen_client: QwenVisionClient,
+        grpc_client: SpringBootGrpcClient,
+        context_manager: ContextManager,
+        video_processor: VideoProcessor,
+        minio_client: MinioClient
+    ):
+        self.qwen_client = qwen_client
+        self.grpc_client = grpc_client
+        self.context_manager = context_manager
+        self.video_processor = video_processor
+        self.minio_client = minio_client
+        # session_id -> 正在运行的分析任务
+        self.active_tasks: Dict[str, asyncio.Task] = {}
+        # session_id -> 运行状态（就绪检查统计剩余窗口）
+        self.run_states: Dict[str, "_RunState"] = {}
+
+    @property
+    def pending_windows(self) -> int:
+        """所有进行中的视频分析尚未处理完的窗口数"""
+        return sum(max(0, s.total_windows - s.windows_done) for s in list(self.run_states.values()))
+
+    def cancel(self, session_id: str) -> bool:
+        """
+        取消会话正在进行的分析
+
+        Returns:
+            bool: 存在正在运行的任务并已请求取消时返回 True
+        """
+        task = self.active_tasks.get(session_id)
+        if task and not task.done():
+            logger.info(f"Cancelling video analysis for session {session_id}")
+            task.cancel()
+            return True
+        return False
+
+    async def _emit(self, state: "_RunState", content: str):
+        """发送一段内容到 Spring Boot，成功后推进 token_index"""
+        timestamp = int(asyncio.get_event_loop().time() * 1000)
+        start = time.perf_counter()
+        success = await self.grpc_client.save_analysis(
+            session_id=state.session_id,
+            content=content,
+            token_index=state.token_index,
+            timestamp=timestamp
+        )
+        span = tracer.current_span()
+        if span:
+            span.add("persist_ms", (time.perf_counter() - start) * 1000)
+        if success:
+            state.token_index += 1
+        else:
+            logger.error(f"Failed to save token {state.token_index}")
+
+    async def run(
+        self,
+        session_id: str,
+        video_path: str,
+        profile: Optional[str] = None,
+        window_mode: Optional[str] = None,
+        planner: Optional[str] = None,
+        priority: str = "normal",
+        differential: Optional[bool] = None,
+        recording: Optional[LiveRecording] = None
+    ) -> PipelineResult:
+        """
+        分析视频（在当前任务中运行，可被取消）
+
+        Args:
+            session_id: 会话 ID
+            video_path: 本地视频路径
+            profile: 窗口转码配置名（为空时使用 VIDEO_TRANSCODE_PROFILE）
+            window_mode: video（切片上传 Minio）或 frames（抽帧内联发送），为空时使用 VIDEO_WINDOW_MODE
+            planner: 窗口规划方式 fixed / adaptive，为空时使用 VIDEO_WINDOW_PLANNER
+            priority: 会话优先级 low / normal / high（模型路由）
+            differential: 是否使用差量窗口，为空时使用 VIDEO_DIFFERENTIAL_WINDOWS
+            recording: 录制中的视频（video_path 为其文件），按 fixed 窗口边界增量分析，忽略 planner
+
+        Returns:
+            分析结果
+        """
+        task = asyncio.current_task()
+        if task:
+            self.active_tasks[session_id] = task
+
+        state = _RunState(
+            session_id=session_id,
+            window_mode=window_mode or settings.video_window_mode,
+            priority=priority,
+            differential=settings.video_differential_windows if differential is None else differential
+        )
+        self.run_states[session_id] = state
+
+        try:
+            with tracer.span("analyze_video", session_id=session_id, video_path=video_path) as root:
+                try:
+                    if recording:
+                        return await self._run_live_windows(state, recording, root, profile)
+                    return await self._run_windows(state, video_path, root, profile, planner)
+                finally:
+                    with tracer.span("cleanup"):
+                        await self._cleanup(session_id, state.uploaded_urls, state.pending_uploads)
+
+        except asyncio.CancelledError:
+            logger.warning(f"Video analysis cancelled for session {session_id} after {state.token_index} tokens")
+            raise
+
+        finally:
+            if self.active_tasks.get(session_id) is task:
+                del self.active_tasks[session_id]
+            if self.run_states.get(session_id) is state:
+                del self.run_states[session_id]
+
+    async def _run_windows(
+        self,
+        state: "_RunState",
+        video_path: str,
+        root: Optional[Span],
+        profile: Optional[str] = None,
+        planner: Optional[str] = None
+    ) -> PipelineResult:
+        """规划窗口并逐个分析"""
+        session_id = state.session_id
+
+        # 1. 规划滑动窗口
+        logger.info("Slicing video into windows...")
+        with tracer.span("probe"):
+            metadata = await asyncio.to_thread(self.video_processor.get_metadata, video_path)
+        duration = metadata.duration
+        state.profile = self.video_processor.resolve_profile(profile, duration)
+        planner = planner or settings.video_window_planner
+        if planner == "adaptive":
+            try:
+                with tracer.span("activity_timeline"):
+                    state.timeline = await asyncio.to_thread(
+                        self.video_processor.activity_timeline, video_path, settings.video_activity_fps
+                    )
+            except Exception as e:
+                logger.warning(f"Activity timeline failed, falling back to fixed windows: {e}")
+                planner = "fixed"
+        plan = self.video_processor.plan(video_path, planner, duration, state.timeline)
+
+        if not plan:
+            logger.warning(f"No windows created for video {video_path}")
+            return PipelineResult(session_id=session_id, total_windows=0, total_tokens=0)
+
+        logger.info(f"Planned {len(plan)} windows for analysis")
+        total = len(plan)
+        state.total_windows = total
+        if root:
+            root.set_attribute("duration_s", duration)
+            root.set_attribute("resolution", f"{metadata.width}x{metadata.height}")
+            root.set_attribute("codec", metadata.codec)
+            root.set_attribute("profile", state.profile.name)
+            root.set_attribute("window_mode", state.window_mode)
+            root.set_attribute("planner", planner)
+            root.set_attribute("windows", total)
+            root.set_attribute("differential", state.differential)
+
+        # 2. 逐个窗口切片、上传到Minio并进行 AI 分析
+        for window_index, window_start, end_time in plan:
+            await self._run_window(state, video_path, window_index, window_start, end_time, total)
+        await self._flush_static_run(state, total)
+        return self._result(state, total, root)
+
+    async def _run_live_windows(
+        self,
+        state: "_RunState",
+        recording: LiveRecording,
+        root: Optional[Span],
+        profile: Optional[str] = None
+    ) -> PipelineResult:
+        """
+        分析录制中的视频：已写入的部分足够一个完整的 fixed 窗口时立即分析，录制结束后补齐剩余窗口
+
+        窗口边界与录制完成后按 fixed 规划的结果相同；录制中窗口总数未知，窗口标记只显示序号。
+        """
+        video_path = recording.path
+        window_size = self.video_processor.window_size
+        step_size = self.video_processor.step_size
+        # 总时长未知，auto 按短视频选择配置
+        state.profile = self.video_processor.resolve_profile(profile, 0.0)
+        if root:
+            root.set_attribute("live", True)
+            root.set_attribute("profile", state.profile.name)
+            root.set_attribute("window_mode", state.window_mode)
+            root.set_attribute("differential", state.differential)
+
+        next_index = 0
+        available = 0.0
+        probed_size = -1
+        while True:
+            # 先读结束标记再探测：结束前写入的数据都会被这次探测看到
+            complete = recording.complete
+            recording.refresh()
+            # 文件没有变化时沿用上次的结果；有变化时只解析上次探测位置之后的部分
+            if recording.size != probed_size:
+                probed_size = recording.size
+                available = await asyncio.to_thread(self.video_processor.available_duration, video_path, available)
+            if complete:
+                break
+            if recording.idle_seconds > settings.ingest_idle_timeout_seconds:
+                logger.warning(
+                    f"No new data for session {state.session_id} in {recording.idle_seconds:.0f}s, "
+                    f"treating the recording as complete"
+                )
+                recording.finish()
+                continue
+
+            ready = 0
+            while next_index * step_size + window_size <= available - _LIVE_MARGIN_SECONDS:
+                window_start = next_index * step_size
+                state.total_windows = next_index + 1
+                await self._run_window(state, video_path, next_index, window_start, window_start + window_size, None)
+                next_index += 1
+                ready += 1
+            if not ready:
+                await recording.wait_for_data(settings.ingest_poll_seconds)
+
+        # 录制结束：按最终时长规划，补齐尚未分析的窗口（包括末尾不足一个窗口的部分）
+        plan = self.video_processor.plan_windows(available)
+        total = len(plan)
+        state.total_windows = total
+        logger.info(
+            f"Recording for session {state.session_id} complete: {available:.1f}s, "
+            f"{next_index} windows analyzed live, {max(total - next_index, 0)} remaining"
+        )
+        if root:
+            root.set_attribute("duration_s", available)
+            root.set_attribute("windows", total)
+            root.set_attribute("live_windows", next_index)
+        for window_index, window_start, end_time in plan[next_index:]:
+            await self._run_window(state, video_path, window_index, window_start, end_time, total)
+        await self._flush_static_run(state, total)
+        return self._result(state, total, root)
+
+    async def _run_window(
+        self,
+        state: "_RunState",
+        video_path: str,
+        window_index: int,
+        window_start: float,
+        end_time: float,
+        total: Optional[int]
+    ):
+        """按规划的窗口边界分析一个窗口（差量模式下从已分析部分之后开始）"""
+        start_time = self._segment_start(state, window_start, end_time)
+        state.anchor_time = start_time if start_time > window_start else None
+        state.segment_share = (end_time - start_time) / (end_time - window_start)
+        with tracer.span("window", window_index=window_index, start_s=start_time, end_s=end_time):
+            await self._process_window(state, video_path, window_index, start_time, end_time, total)
+        state.windows_done += 1
+
+    @staticmethod
+    def _result(state: "_RunState", total: int, root: Optional[Span]) -> PipelineResult:
+        """汇总分析结果"""
+        session_id = state.session_id
+        if root:
+            root.set_attribute("skipped_windows", state.skipped_windows)
+            root.set_attribute("analyzed_s", round(state.analyzed_seconds, 1))
+        logger.info(
+            f"Video analysis completed for session {session_id}, total tokens: {state.token_index}, "
+            f"skipped {state.skipped_windows}/{total} static windows, {state.analyzed_seconds:.1f}s sent to the model"
+        )
+        return PipelineResult(
+            session_id=session_id,
+            total_windows=total,
+            total_tokens=state.token_index,
+            skipped_windows=state.skipped_windows,
+            analyzed_seconds=round(state.analyzed_seconds, 3)
+        )
+
+    @staticmethod
+    def _segment_start(state: "_RunState", start_time: float, end_time: float) -> float:
+        """
+        窗口实际发送的开始时间
+
+        差量模式下跳过已经发送过（或判定为静止）的部分，新片段短于 VIDEO_DIFFERENTIAL_MIN_SECONDS
+        时向前补齐；其他情况下为窗口开始时间。
+        """
+        if not state.differential or state.covered_until is None or state.covered_until <= start_time:
+            return start_time
+        return max(start_time, min(state.covered_until, end_time - settings.video_differential_min_seconds))
+
+    async def _process_window(
+        self,
+        state: "_RunState",
+        video_path: str,
+        window_index: int,
+        start_time: float,
+        end_time: float,
+        total: Optional[int]
+    ):
+        """切片（或抽帧）、分析一个窗口，结果通过 gRPC 发送"""
+        if await self._is_static_window(state, video_path, window_index, start_time, end_time):
+            state.skipped_windows += 1
+            STATIC_WINDOWS_SKIPPED.inc()
+            if state.static_run:
+                first, _, run_start, _ = state.static_run
+                state.static_run = (first, window_index, run_start, end_time)
+            else:
+                state.static_run = (window_index, window_index, start_time, end_time)
+            state.covered_until = end_time
+            return
+        await self._flush_static_run(state, total)
+
+        if state.window_mode == "frames":
+            tokens = await self._prepare_frames_window(state, video_path, window_index, start_time, end_time, total)
+        else:
+            tokens = await self._prepare_video_window(state, video_path, window_index, start_time, end_time, total)
+        if tokens is not None:
+            state.covered_until = end_time
+            state.analyzed_seconds += end_time - start_time
+            VIDEO_ANALYZED_SECONDS.labels("differential" if state.differential else "overlap").inc(end_time - start_time)
+            await self._analyze_window(state, window_index, tokens)
+
+    async def _is_static_window(
+        self,
+        state: "_RunState",
+        video_path: str,
+        window_index: int,
+        start_time: float,
+        end_time: float
+    ) -> bool:
+        """
+        窗口画面是否没有变化（第一个窗口、关闭跳过或计算失败时返回 False）
+
+        关闭跳过但启用了模型路由时仍计算活动度，结果记录在 state.activity 中作为路由信号。
+        """
+        state.activity = None
+        if window_index == 0 or not (settings.video_skip_static_windows or self.qwen_client.router):
+            return False
+        with tracer.span("activity") as span:
+            try:
+                if state.timeline is not None:
+                    activity = WindowActivity.from_samples(window_index, start_time, end_time, state.timeline)
+                else:
+                    activity = await self.video_processor.score_activity_async(
+                        video_path, window_index, start_time, end_time, fps=settings.video_activity_fps
+                    )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Activity scoring failed for window {window_index}, analyzing it anyway: {e}")
+                return False
+            state.activity = activity
+            static = settings.video_skip_static_windows and activity.is_static(settings.video_static_threshold)
+            if span:
+                span.set_attribute("peak", activity.peak)
+                span.set_attribute("mean", round(activity.mean, 3))
+                span.set_attribute("static", static)
+        if static:
+            logger.info(
+                f"Skipping static window {window_index + 1}: {start_time:.1f}s - {end_time:.1f}s "
+                f"(peak diff {activity.peak:g} < {settings.video_static_threshold:g})"
+            )
+        return static
+
+    @staticmethod
+    def _routing(state: "_RunState") -> RoutingSignals:
+        """当前窗口的模型路由信号：窗口内相邻采样帧的平均像素差"""
+        return RoutingSignals(
+            change=state.activity.mean if state.activity else None,
+            priority=state.priority
+        )
+
+    async def _anchor_frame(self, state: "_RunState", video_path: str, window_index: int) -> Optional[str]:
+        """
+        差量窗口的锚点帧：新片段开始前的最后一帧（base64 JPEG）
+
+        窗口没有被截短时返回 None；抽帧失败时也返回 None，只靠摘要衔接。
+        """
+        if state.anchor_time is None:
+            return None
+        with tracer.span("anchor_frame"):
+            try:
+                frames = await self.video_processor.extract_frames_async(
+                    video_path, window_index, max(0.0, state.anchor_time - 0.25), state.anchor_time,
+                    count=1,
+                    max_edge=settings.video_frame_max_edge,
+                    quality=settings.video_frame_quality
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Anchor frame failed for window {window_index}, continuing without it: {e}")
+                return None
+        return frames.images[0] if frames.images else None
+
+    async def _flush_static_run(self, state: "_RunState", total: Optional[int]):
+        """为累计的连续静止窗口发送一条占位标记"""
+        if not state.static_run:
+            return
+        first, last, start_time, end_time = state.static_run
+        state.static_run = None
+        label = f"{first + 1}" if first == last else f"{first + 1}-{last + 1}"
+        if total:
+            label += f"/{total}"
+        await self._emit(state, f"\n\n⏸ [静止窗口 {label}] ({start_time:.1f}s - {end_time:.1f}s) 画面无明显变化，已跳过分析\n")
+
+    async def _emit_window_marker(self, state: "_RunState", window_index: int, start_time: float, end_time: float,
+                                  total: Optional[int]):
+        # 录制中的视频窗口总数未知，只显示序号
+        label = f"{window_index + 1}/{total}" if total else f"{window_index + 1}"
+        logger.info(
+            "Analyzing window %s: %.1fs - %.1fs", label, start_time, end_time,
+            extra=sampled("pipeline.window")
+        )
+
+        # 发送窗口标记到前端
+        window_marker = f"\n\n📹 [分析窗口 {label}] ({start_time:.1f}s - {end_time:.1f}s)\n"
+        await self._emit(state, window_marker)
+        logger.debug("Sent window marker for window %d", window_index + 1, extra=sampled("pipeline.window"))
+
+    async def _prepare_video_window(
+        self,
+        state: "_RunState",
+        video_path: str,
+        window_index: int,
+        start_time: float,
+        end_time: float,
+        total: Optional[int]
+    ) -> Optional[AsyncIterator[str]]:
+        """MP4 模式：切片、上传到 Minio，返回按 URL 分析的 token 流（上传失败时返回 None）"""
+        if settings.video_upload_mode == "stream":
+            uploaded = await self._stream_window(state, video_path, window_index, start_time, end_time, total)
+        else:
+            uploaded = await self._slice_and_upload(state, video_path, window_index, start_time, end_time, total)
+        if uploaded is None:
+            return None  # 跳过这个窗口的分析
+        video_url, digest = uploaded
+        anchor = await self._anchor_frame(state, video_path, window_index)
+
+        # AI 分析窗口视频（使用Minio公网URL；窗口内容摘要用于结果缓存）
+        return self.qwen_client.analyze_video_streaming(
+            video_path=video_url,
+            start_time=start_time,
+            end_time=end_time,
+            context=self.context_manager.get_context(state.session_id),
+            previous_summary=state.previous_summary,
+            content_digest=digest,
+            routing=self._routing(state),
+            anchor_image=anchor
+        )
+
+    async def _slice_and_upload(
+        self,
+        state: "_RunState",
+        video_path: str,
+        window_index: int,
+        start_time: float,
+        end_time: float,
+        total: Optional[int]
+    ) -> Optional[Tuple[str, str]]:
+        """切片到本地文件后上传，返回 (URL, 窗口文件 SHA-256)（上传失败时返回 None）"""
+        session_id = state.session_id
+
+        with tracer.span("slice"):
+            window = await self.video_processor.extract_window_async(
+                video_path, session_id, window_index, start_time, end_time, state.profile
+            )
+            digest = await asyncio.to_thread(_file_sha256, window.file_path)
+
+        await self._emit_window_marker(state, window.window_index, window.start_time, window.end_time, total)
+
+        # 上传窗口视频到Minio
+        try:
+            with tracer.span("upload"):
+                logger.info("Uploading window %d to Minio...", window.window_index, extra=sampled("pipeline.upload"))
+                upload = asyncio.ensure_future(
+                    asyncio.to_thread(self.minio_client.upload_video, window.file_path)
+                )
+                try:
+                    # shield：取消时上传线程无法中断，需要在清理阶段等待它完成后再删除对象
+                    video_url = await asyncio.shield(upload)
+                except asyncio.CancelledError:
+                    state.pending_uploads.append(upload)
+                    raise
+            state.uploaded_urls.append(video_url)
+            logger.info("Window uploaded: %s", video_url, extra=sampled("pipeline.upload"))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to upload window {window.window_index} to Minio: {e}")
+            error_msg = f"\n[ERROR] 上传窗口 {window.window_index} 到Minio失败: {str(e)}\n"
+            await self._emit(state, error_msg)
+            return None
+        return video_url, digest
+
+    async def _stream_window(
+        self,
+        state: "_RunState",
+        video_path: str,
+        window_index: int,
+        start_time: float,
+        end_time: float,
+        total: Optional[int]
+    ) -> Optional[Tuple[str, str]]:
+        """FFmpeg 输出经管道直接分片上传，返回 (URL, 上传内容 SHA-256)（上传失败时返回 None）"""
+        await self._emit_window_marker(state, window_index, start_time, end_time, total)
+
+        filename = VideoProcessor.window_filename(window_index, start_time, end_time)
+        digest = hashlib.sha256()
+
+        async def hashed(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+            async for chunk in chunks:
+                digest.update(chunk)
+                yield chunk
+
+        try:
+            with tracer.span("stream_upload"):
+                async with aclosing(self.video_processor.stream_window_async(
+                    video_path, window_index, start_time, end_time, state.profile
+                )) as chunks, aclosing(hashed(chunks)) as body:
+                    video_url = await self.minio_client.upload_stream(body, filename)
+        except (asyncio.CancelledError, subprocess.CalledProcessError):
+            # 取消时分片上传已中止；FFmpeg 失败与文件模式的切片失败一样向上抛出
+            raise
+        except Exception as e:
+            logger.error(f"Failed to stream window {window_index} to Minio: {e}")
+            await self._emit(state, f"\n[ERROR] 上传窗口 {window_index} 到Minio失败: {str(e)}\n")
+            return None
+
+        state.uploaded_urls.append(video_url)
+        logger.info("Window streamed: %s", video_url, extra=sampled("pipeline.upload"))
+        return video_url, digest.hexdigest()
+
+    async def _prepare_frames_window(
+        self,
+        state: "_RunState",
+        video_path: str,
+        window_index: int,
+        start_time: float,
+        end_time: float,
+        total: Optional[int]
+    ) -> AsyncIterator[str]:
+        """图片序列模式：抽取代表帧直接内联发送给模型，不经过 Minio"""
+        anchor = await self._anchor_frame(state, video_path, window_index)
+        with tracer.span("sample_frames") as span:
+            frames = await self.video_processor.extract_frames_async(
+                video_path, window_index, start_time, end_time,
+                # 差量窗口只覆盖新片段，帧密度与完整窗口一致
+                count=max(1, round(settings.video_frames_per_window * state.segment_share)),
+                sampling=settings.video_frame_sampling,
+                max_edge=settings.video_frame_max_edge,
+                quality=settings.video_frame_quality
+            )
+            if span:
+                span.set_attribute("frames", len(frames.images))
+                span.set_attribute("kib", round(frames.total_bytes / 1024, 1))
+
+        await self._emit_window_marker(state, window_index, start_time, end_time, total)
+
+        return self.qwen_client.analyze_video_frames_streaming(
+            images=frames.images,
+            start_time=start_time,
+            end_time=end_time,
+            context=self.context_manager.get_context(state.session_id),
+            previous_summary=state.previous_summary,
+            routing=self._routing(state),
+            anchor_image=anchor
+        )
+
+    async def _analyze_window(self, state: "_RunState", window_index: int, tokens: AsyncIterator[str]):
+        """消费模型 token 流，逐个发送到 Spring Boot 并更新上下文"""
+        session_id = state.session_id
+        accumulated_response = ""
+        token_count = 0
+        with tracer.span("model") as model_span:
+            model_start = time.perf_counter()
+            try:
+                async with aclosing(tokens):
+                    async for token in tokens:
+                        if token_count == 0 and model_span:
+                            model_span.set_attribute("ttft_ms", round((time.perf_counter() - model_start) * 1000, 1))
+                        accumulated_response += token
+                        token_count += 1
+
+                        # 发送 token 到 Spring Boot
+                        await self._emit(state, token)
+
+                if model_span:
+                    model_span.set_attribute("tokens", token_count)
+
+                # 快速档回答被撤回时只保留重新分析的部分
+                accumulated_response = strip_retracted(accumulated_response)
+
+                # 检查是否有分析结果
+                if accumulated_response.strip():
+                    # 保存完整的分析结果作为上下文
+                    self.context_manager.add_to_context(session_id, accumulated_response[:500], role="assistant")
+                    state.previous_summary = accumulated_response[:200]  # 保留前200字符作为摘要
+                    logger.info(
+                        "Window %d analyzed: %d chars, %d tokens", window_index + 1, len(accumulated_response),
+                        token_count, extra=sampled("pipeline.analyzed")
+                    )
+                else:
+                    # 如果没有返回内容，记录警告并发送提示
+                    logger.warning(f"Window {window_index + 1} returned empty response")
+                    await self._emit(state, "[警告] 此窗口分析未返回内容\n")
+
+            except Exception as e:
+                logger.error(f"Error analyzing window {window_index}: {e}", exc_info=True)
+                if model_span:
+                    model_span.status = "error"
+                    model_span.error = str(e)
+                error_msg = f"\n[ERROR] 分析窗口 {window_index} 时出错: {str(e)}\n"
+                await self._emit(state, error_msg)
+
+    async def _cleanup(
+        self,
+        session_id: str,
+        uploaded_urls: List[str],
+        pending_uploads: List[asyncio.Future]
+    ):
+        """清理 Minio 上传的文件和本地窗口文件"""
+        for upload in pending_uploads:
+            try:
+                uploaded_urls.append(await asyncio.wait_for(upload, timeout=60))
+            except Exception as e:
+                logger.warning(f"Pending upload did not finish during cleanup: {e}")
+
+        # 3. 清理Minio上传的文件
+        logger.info(f"Cleaning up {len(uploaded_urls)} uploaded files from Minio...")
+        for url in uploaded_urls:
+            try:
+                await asyncio.to_thread(self.minio_client.delete_video, url)
+            except Exception as e:
+                logger.warning(f"Failed to delete Minio file {url}: {e}")
+
+        # 4. 清理本地窗口文件
+        try:
+            self.video_processor.cleanup_windows(session_id)
+        except Exception as e:
+            logger.warning(f"Failed to cleanup local windows: {e}")
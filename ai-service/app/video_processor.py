@@ -1,15 +1,76 @@
 """
 Video Processor - 使用 FFmpeg 滑动窗口切片视频
 """
+import asyncio
+import base64
+import re
 import subprocess
 import os
+import time
 import logging
+import threading
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List, Tuple
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from dataclasses import dataclass
 
+from app.config import settings
+from app.media_probe import MediaMetadata, MediaProbe, media_probe
+from app.metrics import FFMPEG_ACTIVITY_SECONDS, FFMPEG_FRAMES_SECONDS, FFMPEG_WINDOW_SECONDS
+
 logger = logging.getLogger(__name__)
 
+# available_duration 增量探测时 -read_intervals 的读取长度（覆盖到文件末尾）
+_PROBE_READ_TO_END_SECONDS = 10 ** 6
+
+
+@dataclass(frozen=True)
+class TranscodeProfile:
+    """
+    窗口视频的转码参数
+
+    视觉模型按约 2 fps 抽帧理解视频，源分辨率和帧率对分析没有帮助，
+    只会增加上传大小、Minio 存储和模型的视频 token 消耗。
+    """
+    name: str
+    max_edge: Optional[int] = None  # 长边上限（像素），None 表示保持源分辨率
+    fps: Optional[float] = None     # 输出帧率，None 表示保持源帧率
+    preset: str = "fast"
+    crf: int = 23
+    tune: Optional[str] = None
+
+    def video_filters(self) -> Optional[str]:
+        filters = []
+        if self.fps:
+            filters.append(f"fps={self.fps:g}")
+        if self.max_edge:
+            # 只缩小不放大，保持宽高比，宽高取偶数（yuv420p 要求）
+            filters.append(
+                f"scale='min(iw,{self.max_edge})':'min(ih,{self.max_edge})'"
+                f":force_original_aspect_ratio=decrease:force_divisible_by=2"
+            )
+        return ",".join(filters) or None
+
+
+TRANSCODE_PROFILES: Dict[str, TranscodeProfile] = {
+    # 原有行为：源分辨率和帧率
+    "source": TranscodeProfile("source"),
+    "analysis": TranscodeProfile("analysis", max_edge=1920, fps=4, preset="veryfast", crf=26, tune="stillimage"),
+    "analysis-low": TranscodeProfile("analysis-low", max_edge=1280, fps=2, preset="veryfast", crf=28, tune="stillimage"),
+}
+
+AUTO_PROFILE = "auto"
+
+FRAME_SAMPLING_MODES = ("uniform", "scene")
+
+# showinfo 滤镜输出中的帧时间
+_SHOWINFO_PTS = re.compile(rb"pts_time:\s*([0-9.]+)")
+# metadata=print 输出的帧时间和 signalstats 对相邻帧差分图的统计
+_METADATA_PTS = re.compile(rb"frame:\s*\d+\s+pts:\s*\S+\s+pts_time:([0-9.]+)")
+_DIFF_STAT = re.compile(rb"lavfi\.signalstats\.(YMAX|YAVG)=([0-9.]+)")
+
+WINDOW_PLANNERS = ("fixed", "adaptive")
+
 
 @dataclass
 class VideoWindow:
@@ -21,6 +82,103 @@ class VideoWindow:
     duration: float
 
 
+@dataclass
+class WindowFrames:
+    """窗口的代表帧（图片序列模式）"""
+    window_index: int
+    start_time: float
+    end_time: float
+    images: List[str]        # base64 JPEG（无 data URI 前缀）
+    timestamps: List[float]  # 每帧在原视频中的时间（秒）
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(len(i) for i in self.images) * 3 // 4
+
+
+@dataclass
+class ActivitySample:
+    """相邻两个采样帧的差分统计"""
+    time: float  # 后一帧在原视频中的时间（秒）
+    peak: float  # 差分图最大像素值（0-255）
+    mean: float  # 差分图平均像素值（0-255）
+
+
+def _parse_activity(stderr: bytes, offset: float = 0.0) -> List[ActivitySample]:
+    """解析 metadata=print 的日志输出"""
+    samples: List[ActivitySample] = []
+    for line in stderr.splitlines():
+        pts = _METADATA_PTS.search(line)
+        if pts:
+            samples.append(ActivitySample(time=offset + float(pts.group(1)), peak=0.0, mean=0.0))
+            continue
+        stat = _DIFF_STAT.search(line)
+        if stat and samples:
+            if stat.group(1) == b"YMAX":
+                samples[-1].peak = float(stat.group(2))
+            else:
+                samples[-1].mean = float(stat.group(2))
+    return samples
+
+
+def _activity_filters(fps: float, max_edge: int) -> str:
+    return (
+        f"fps={fps:g},"
+        f"scale='min(iw,{max_edge})':'min(ih,{max_edge})':force_original_aspect_ratio=decrease,"
+        f"format=gray,tblend=all_mode=difference,signalstats,metadata=print"
+    )
+
+
+@dataclass
+class WindowActivity:
+    """
+    窗口画面活动度
+
+    按低帧率、灰度、缩小后的相邻采样帧做差分，peak 为差分图的最大像素值，
+    mean 为平均像素值（0-255）。压缩噪声通常在 5 以内，光标移动、打字等局部变化也会到 100 以上。
+    """
+    window_index: int
+    start_time: float
+    end_time: float
+    peak: float
+    mean: float
+    samples: int  # 参与比较的相邻帧对数
+
+    def is_static(self, threshold: float) -> bool:
+        return self.samples > 0 and self.peak < threshold
+
+    @classmethod
+    def from_samples(cls, window_index: int, start_time: float, end_time: float,
+                     samples: List[ActivitySample]) -> "WindowActivity":
+        """汇总时间落在 [start_time, end_time] 内的采样"""
+        inside = [x for x in samples if start_time - 1e-6 <= x.time <= end_time + 1e-6]
+        return cls(
+            window_index=window_index,
+            start_time=start_time,
+            end_time=end_time,
+            peak=max((x.peak for x in inside), default=0.0),
+            mean=sum(x.mean for x in inside) / len(inside) if inside else 0.0,
+            samples=len(inside)
+        )
+
+
+def _split_jpegs(data: bytes) -> List[bytes]:
+    """
+    拆分 image2pipe 输出的 MJPEG 流
+
+    JPEG 熵编码数据中的 0xFF 会被填充为 0xFF00，因此 FFD9 只会作为结束标记出现。
+    """
+    images = []
+    start = data.find(b"\xff\xd8")
+    while start != -1:
+        end = data.find(b"\xff\xd9", start + 2)
+        if end == -1:
+            break
+        images.append(data[start:end + 2])
+        start = data.find(b"\xff\xd8", end + 2)
+    return images
+
+
 class VideoProcessor:
     """
     视频处理器
@@ -31,7 +189,8 @@ class VideoProcessor:
         self,
         window_size: float = 15.0,  # 窗口大小（秒）
         step_size: float = 10.0,    # 步长（秒）
-        output_dir: str = "./temp_windows"
+        output_dir: str = "./temp_windows",
+        probe: Optional[MediaProbe] = None
     ):
         """
         初始化视频处理器
@@ -40,11 +199,75 @@ class VideoProcessor:
             window_size: 窗口大小（秒），默认 15 秒
             step_size: 步长（秒），默认 10 秒（与前一窗口重叠 5 秒）
             output_dir: 窗口视频输出目录
+            probe: 媒体元数据探测器（默认使用全局缓存实例）
         """
         self.window_size = window_size
         self.step_size = step_size
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.probe = probe or media_probe
+        self.active_ffmpeg = 0  # 正在运行的 FFmpeg 进程数（就绪检查）
+        self._ffmpeg_lock = threading.Lock()
+
+    @contextmanager
+    def _ffmpeg_running(self):
+        """统计正在运行的 FFmpeg 进程（同步调用在线程池中运行，需要加锁）"""
+        with self._ffmpeg_lock:
+            self.active_ffmpeg += 1
+        try:
+            yield
+        finally:
+            with self._ffmpeg_lock:
+                self.active_ffmpeg -= 1
+
+    @staticmethod
+    def check_ffmpeg() -> Dict[str, str]:
+        """
+        检查 ffmpeg / ffprobe 是否可用（服务启动时调用，同时把可执行文件载入页缓存）
+
+        Returns:
+            {名称: 版本行}
+
+        Raises:
+            FileNotFoundError: 找不到可执行文件
+            subprocess.CalledProcessError: 运行失败
+        """
+        versions = {}
+        for binary in ("ffmpeg", "ffprobe"):
+            result = subprocess.run([binary, "-version"], capture_output=True, text=True, check=True)
+            versions[binary] = result.stdout.split("\n", 1)[0]
+        return versions
+
+    def resolve_profile(self, name: Optional[str], duration: float) -> TranscodeProfile:
+        """
+        选择转码配置
+
+        Args:
+            name: 配置名；为空时使用 VIDEO_TRANSCODE_PROFILE。
+                "auto" 时按时长选择：不超过 VIDEO_PROFILE_LOW_AFTER_SECONDS 用 analysis，否则 analysis-low
+            duration: 视频时长（秒）
+
+        Raises:
+            ValueError: 未知的配置名
+        """
+        name = name or settings.video_transcode_profile
+        if name == AUTO_PROFILE:
+            name = "analysis" if duration <= settings.video_profile_low_after_seconds else "analysis-low"
+        if name not in TRANSCODE_PROFILES:
+            raise ValueError(f"Unknown transcode profile: {name} (available: {', '.join(TRANSCODE_PROFILES)}, auto)")
+        return TRANSCODE_PROFILES[name]
+
+    def get_metadata(self, video_path: str) -> MediaMetadata:
+        """
+        获取视频元数据（时长、分辨率、帧率、编码、关键帧），同一文件只探测一次
+
+        Args:
+            video_path: 视频文件路径
+
+        Returns:
+            媒体元数据
+        """
+        return self.probe.probe(video_path)
 
     def get_video_duration(self, video_path: str) -> float:
         """
@@ -57,15 +280,7 @@ class VideoProcessor:
             视频时长（秒）
         """
         try:
-            cmd = [
-                'ffprobe',
-                '-v', 'error',
-                '-show_entries', 'format=duration',
-                '-of', 'default=noprint_wrappers=1:nokey=1',
-                video_path
-            ]
-            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-            duration = float(result.stdout.strip())
+            duration = self.get_metadata(video_path).duration
             logger.info(f"Video duration: {duration:.2f} seconds")
             return duration
         except subprocess.CalledProcessError as e:
@@ -78,12 +293,14 @@ class VideoProcessor:
     def slice_video_with_sliding_window(
         self,
         video_path: str,
-        session_id: str
+        session_id: str,
+        profile: Optional[str] = None,
+        planner: Optional[str] = None
     ) -> List[VideoWindow]:
         """
         使用滑动窗口切片视频
 
-        策略：
+        策略（fixed）：
         - 窗口大小：15 秒
         - 步长：10 秒
         - 重叠：5 秒
@@ -93,50 +310,40 @@ class VideoProcessor:
         - window_2: 10-25秒
         - window_3: 20-30秒
 
+        adaptive 策略见 plan_adaptive_windows。
+
         Args:
             video_path: 原始视频文件路径
             session_id: 会话 ID
+            profile: 转码配置名（见 resolve_profile）
+            planner: 窗口规划方式 fixed / adaptive（为空时使用 VIDEO_WINDOW_PLANNER）
 
         Returns:
             窗口列表
         """
         # 获取视频时长
         duration = self.get_video_duration(video_path)
-
-        # 创建会话专用目录
-        session_dir = self.output_dir / session_id
-        session_dir.mkdir(parents=True, exist_ok=True)
+        transcode = self.resolve_profile(profile, duration)
 
         windows: List[VideoWindow] = []
-        window_index = 0
-        current_time = 0.0
-
-        while current_time < duration:
-            # 计算窗口结束时间
-            end_time = min(current_time + self.window_size, duration)
-            window_duration = end_time - current_time
-
-            # 如果剩余时间太短（<5秒），合并到上一个窗口
-            if window_duration < 5.0 and window_index > 0:
-                logger.info(f"Remaining duration {window_duration:.2f}s too short, skipping")
-                break
 
-            # 生成窗口文件路径（使用 MP4 格式，Qwen API 推荐）
-            window_filename = f"window_{window_index:03d}_{int(current_time)}_{int(end_time)}.mp4"
-            window_path = session_dir / window_filename
+        for window_index, start_time, end_time in self.plan(video_path, planner, duration):
+            window_duration = end_time - start_time
+            window_path = self._window_path(session_id, window_index, start_time, end_time)
 
             # 使用 FFmpeg 切片
             try:
                 self._extract_window(
                     video_path=video_path,
-                    start_time=current_time,
+                    start_time=start_time,
                     duration=window_duration,
-                    output_path=str(window_path)
+                    output_path=str(window_path),
+                    profile=transcode
                 )
 
                 windows.append(VideoWindow(
                     window_index=window_index,
-                    start_time=current_time,
+                    start_time=start_time,
                     end_time=end_time,
                     file_path=str(window_path),
                     duration=window_duration
@@ -144,7 +351,7 @@ class VideoProcessor:
 
                 logger.info(
                     f"Created window {window_index}: "
-                    f"{current_time:.2f}s - {end_time:.2f}s "
+                    f"{start_time:.2f}s - {end_time:.2f}s "
                     f"({window_duration:.2f}s)"
                 )
 
@@ -152,19 +359,256 @@ class VideoProcessor:
                 logger.error(f"Failed to create window {window_index}: {e}")
                 raise
 
+        logger.info(f"Created {len(windows)} windows for video (duration: {duration:.2f}s)")
+        return windows
+
+    def plan_windows(self, duration: float) -> List[Tuple[int, float, float]]:
+        """
+        按滑动窗口策略计算窗口边界（不切片）
+
+        剩余时间太短（<5秒）时不再单独成窗。
+
+        Args:
+            duration: 视频时长（秒）
+
+        Returns:
+            [(window_index, start_time, end_time), ...]
+        """
+        windows_info = []
+        window_index = 0
+        current_time = 0.0
+
+        while current_time < duration:
+            # 计算窗口结束时间
+            end_time = min(current_time + self.window_size, duration)
+            window_duration = end_time - current_time
+
+            # 如果剩余时间太短（<5秒），合并到上一个窗口
+            if window_duration < 5.0 and window_index > 0:
+                logger.info(f"Remaining duration {window_duration:.2f}s too short, skipping")
+                break
+
+            windows_info.append((window_index, current_time, end_time))
+
             # 移动到下一个窗口
             window_index += 1
             current_time += self.step_size
 
-        logger.info(f"Created {len(windows)} windows for video (duration: {duration:.2f}s)")
-        return windows
+        return windows_info
+
+    def available_duration(self, video_path: str, since: float = 0.0) -> float:
+        """
+        正在写入的视频中已经可以解码的时长（最后一个视频包的时间戳）
+
+        只解析容器、不解码。since > 0 时用 -read_intervals 从该时间点（之前最近的关键帧）开始读取，
+        录制中反复探测时每次只解析新写入的部分，而不是整个文件。普通 MP4 在写完 moov 之前无法解析。
+
+        Args:
+            video_path: 视频文件路径
+            since: 上次探测到的时长（秒）
+
+        Returns:
+            已写入部分的时长（秒）；探测失败或超时时返回 since
+        """
+        cmd = [
+            'ffprobe',
+            '-v', 'error',
+            '-select_streams', 'v:0',
+        ]
+        if since > 0:
+            # 只写起点（"T%"）时 WebM 没有 Cues 会读不到包，需要显式给出足够大的长度
+            cmd += ['-read_intervals', f'{since:.3f}%+{_PROBE_READ_TO_END_SECONDS}']
+        cmd += [
+            '-show_entries', 'packet=pts_time',
+            '-of', 'csv=p=0',
+            video_path
+        ]
+        try:
+            result = subprocess.run(cmd, capture_output=True, check=True, timeout=60)
+        except subprocess.CalledProcessError:
+            return since
+        except (subprocess.TimeoutExpired, OSError) as e:
+            logger.warning(f"Could not probe available duration of {video_path}: {e}")
+            return since
+        available = since
+        for line in result.stdout.split():
+            try:
+                available = max(available, float(line))  # B 帧时包时间戳不是单调的
+            except ValueError:
+                continue  # N/A
+        return available
+
+    def plan(
+        self,
+        video_path: str,
+        planner: Optional[str] = None,
+        duration: Optional[float] = None,
+        timeline: Optional[List[ActivitySample]] = None
+    ) -> List[Tuple[int, float, float]]:
+        """
+        按 planner 规划窗口（不切片）
+
+        Args:
+            video_path: 视频文件路径
+            planner: fixed / adaptive，为空时使用 VIDEO_WINDOW_PLANNER
+            duration: 视频时长（为空时探测）
+            timeline: 已计算的整段活动度（adaptive 时复用，为空时计算）
+
+        Raises:
+            ValueError: 未知的规划方式
+        """
+        planner = planner or settings.video_window_planner
+        if planner not in WINDOW_PLANNERS:
+            raise ValueError(f"Unknown window planner: {planner} (available: {', '.join(WINDOW_PLANNERS)})")
+        if duration is None:
+            duration = self.get_video_duration(video_path)
+        if planner == "fixed":
+            return self.plan_windows(duration)
+        if timeline is None:
+            timeline = self.activity_timeline(video_path, settings.video_activity_fps)
+        return self.plan_adaptive_windows(duration, timeline, settings.video_activity_fps)
+
+    def plan_adaptive_windows(
+        self,
+        duration: float,
+        timeline: List[ActivitySample],
+        fps: float = 2.0
+    ) -> List[Tuple[int, float, float]]:
+        """
+        按画面内容规划窗口
+
+        - 在 [开始 + VIDEO_WINDOW_MIN_SECONDS, 开始 + VIDEO_WINDOW_MAX_SECONDS] 内寻找场景切换
+          （相邻采样帧平均像素差 >= VIDEO_SCENE_CUT_THRESHOLD），在变化最大的一处切分，
+          下一个窗口从切换处开始，不重叠
+        - 范围内没有场景切换时按最大时长切分；切分点前后画面仍在变化（内容连续）时
+          下一个窗口向前重叠 window_size - step_size 秒，切分点附近画面静止时不重叠
+        - 剩余不足最小时长的部分并入最后一个窗口
+
+        Args:
+            duration: 视频时长（秒）
+            timeline: activity_timeline() 的结果
+            fps: timeline 的采样帧率
+
+        Returns:
+            [(window_index, start_time, end_time), ...]
+        """
+        min_window = settings.video_window_min_seconds
+        max_window = max(settings.video_window_max_seconds, min_window)
+        max_overlap = min(max(0.0, self.window_size - self.step_size), max_window / 2)
+        # 变化发生在前后两个采样帧之间，切分点取中间
+        cuts = [(x.time - 0.5 / fps, x.mean) for x in timeline if x.mean >= settings.video_scene_cut_threshold]
+
+        def continuous_at(t: float) -> bool:
+            return any(x.peak >= settings.video_static_threshold for x in timeline if abs(x.time - t) <= 1.0)
+
+        windows_info = []
+        start = 0.0
+        while duration - start > 1e-3:
+            if duration - start <= max_window:
+                windows_info.append((len(windows_info), start, duration))
+                break
+
+            candidates = [c for c in cuts if start + min_window <= c[0] <= start + max_window]
+            if candidates:
+                end = max(candidates, key=lambda c: (c[1], c[0]))[0]
+                next_start = end
+            else:
+                end = start + max_window
+                next_start = end - (max_overlap if continuous_at(end) else 0.0)
+
+            if duration - end < min_window:
+                end = duration
+            windows_info.append((len(windows_info), start, end))
+            if end >= duration:
+                break
+            start = next_start
+
+        covered = sum(e - s for _, s, e in windows_info)
+        logger.info(
+            f"Adaptive plan: {len(windows_info)} windows over {duration:.1f}s "
+            f"({len(cuts)} scene cuts, {max(covered - duration, 0.0):.1f}s overlap)"
+        )
+        return windows_info
+
+    def activity_timeline(self, video_path: str, fps: float = 2.0, max_edge: int = 640) -> List[ActivitySample]:
+        """
+        单次 ffmpeg 解码整段视频，返回相邻采样帧的差分统计（用于 adaptive 规划和静止窗口判断）
+
+        Args:
+            video_path: 视频文件路径
+            fps: 采样帧率
+            max_edge: 比较前缩放到的长边上限（像素）
+
+        Returns:
+            按时间排序的采样
+        """
+        cmd = [
+            'ffmpeg',
+            '-i', video_path,
+            '-vf', _activity_filters(fps, max_edge),
+            '-an',
+            '-f', 'null',
+            '-'
+        ]
+        with self._ffmpeg_running(), FFMPEG_ACTIVITY_SECONDS.labels("video").time():
+            result = subprocess.run(cmd, capture_output=True, check=True, timeout=3600)
+        samples = _parse_activity(result.stderr)
+        logger.info(f"Activity timeline for {os.path.basename(video_path)}: {len(samples)} samples @ {fps:g}fps")
+        return samples
+
+    def _window_path(self, session_id: str, window_index: int, start_time: float, end_time: float) -> Path:
+        """生成窗口文件路径（使用 MP4 格式，Qwen API 推荐），并确保会话目录存在"""
+        session_dir = self.output_dir / session_id
+        session_dir.mkdir(parents=True, exist_ok=True)
+        return session_dir / self.window_filename(window_index, start_time, end_time)
+
+    @staticmethod
+    def window_filename(window_index: int, start_time: float, end_time: float) -> str:
+        return f"window_{window_index:03d}_{int(start_time)}_{int(end_time)}.mp4"
+
+    def _build_extract_cmd(
+        self,
+        video_path: str,
+        start_time: float,
+        duration: float,
+        output_path: str,
+        profile: Optional[TranscodeProfile] = None
+    ) -> List[str]:
+        """构造提取窗口的 FFmpeg 命令"""
+        profile = profile or TRANSCODE_PROFILES["source"]
+        cmd = [
+            'ffmpeg',
+            '-i', video_path,
+            '-ss', str(start_time),
+            '-t', str(duration),
+            '-c:v', 'libx264',          # 视频：使用 H.264 编码器
+            '-preset', profile.preset,  # 编码速度
+            '-crf', str(profile.crf),   # 质量：0=无损，51=最差
+        ]
+        if profile.tune:
+            cmd += ['-tune', profile.tune]
+        filters = profile.video_filters()
+        if filters:
+            cmd += ['-vf', filters, '-pix_fmt', 'yuv420p']
+        cmd += ['-an']                  # 跳过音频（前端录制时禁用了音频）
+        if output_path == "pipe:1":
+            # 管道无法回写 moov，输出分片 MP4
+            cmd += ['-movflags', 'frag_keyframe+empty_moov+default_base_moof', '-f', 'mp4']
+        else:
+            cmd += [
+                '-movflags', '+faststart',  # 优化 MP4 用于流式播放
+                '-y',                       # 覆盖已存在的文件
+            ]
+        cmd.append(output_path)
+        return cmd
 
     def _extract_window(
         self,
         video_path: str,
         start_time: float,
         duration: float,
-        output_path: str
+        output_path: str,
+        profile: Optional[TranscodeProfile] = None
     ):
         """
         使用 FFmpeg 提取视频窗口
@@ -174,28 +618,18 @@ class VideoProcessor:
             start_time: 开始时间（秒）
             duration: 持续时间（秒）
             output_path: 输出文件路径
+            profile: 转码配置（默认 source）
         """
-        cmd = [
-            'ffmpeg',
-            '-i', video_path,
-            '-ss', str(start_time),
-            '-t', str(duration),
-            '-c:v', 'libx264',      # 视频：使用 H.264 编码器
-            '-preset', 'fast',      # 编码速度：fast（平衡速度和质量）
-            '-crf', '23',           # 质量：23（默认值，0=无损，51=最差）
-            '-an',                  # 跳过音频（前端录制时禁用了音频）
-            '-movflags', '+faststart',  # 优化 MP4 用于流式播放
-            '-y',                   # 覆盖已存在的文件
-            output_path
-        ]
+        cmd = self._build_extract_cmd(video_path, start_time, duration, output_path, profile)
 
         try:
-            subprocess.run(
-                cmd,
-                capture_output=True,
-                check=True,
-                timeout=60  # 超时保护
-            )
+            with self._ffmpeg_running(), FFMPEG_WINDOW_SECONDS.time():
+                subprocess.run(
+                    cmd,
+                    capture_output=True,
+                    check=True,
+                    timeout=60  # 超时保护
+                )
             logger.debug(f"FFmpeg command: {' '.join(cmd)}")
         except subprocess.TimeoutExpired:
             logger.error(f"FFmpeg timeout for window extraction")
@@ -204,6 +638,313 @@ class VideoProcessor:
             logger.error(f"FFmpeg error: {e.stderr.decode('utf-8')}")
             raise
 
+    async def extract_window_async(
+        self,
+        video_path: str,
+        session_id: str,
+        window_index: int,
+        start_time: float,
+        end_time: float,
+        profile: Optional[TranscodeProfile] = None
+    ) -> VideoWindow:
+        """
+        异步提取单个窗口（不阻塞事件循环）
+
+        任务被取消时会立即终止 FFmpeg 进程并删除不完整的输出文件。
+
+        Args:
+            video_path: 原始视频路径
+            session_id: 会话 ID
+            window_index: 窗口索引
+            start_time: 开始时间（秒）
+            end_time: 结束时间（秒）
+            profile: 转码配置（默认 source）
+
+        Returns:
+            窗口信息
+        """
+        window_duration = end_time - start_time
+        window_path = self._window_path(session_id, window_index, start_time, end_time)
+        cmd = self._build_extract_cmd(video_path, start_time, window_duration, str(window_path), profile)
+
+        encode_start = time.perf_counter()
+        with self._ffmpeg_running():
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE
+            )
+            try:
+                _, stderr = await asyncio.wait_for(process.communicate(), timeout=60)
+                FFMPEG_WINDOW_SECONDS.observe(time.perf_counter() - encode_start)
+            except (asyncio.CancelledError, asyncio.TimeoutError):
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                window_path.unlink(missing_ok=True)
+                raise
+
+        if process.returncode != 0:
+            logger.error(f"FFmpeg error: {stderr.decode('utf-8', errors='replace')}")
+            raise subprocess.CalledProcessError(process.returncode, cmd, stderr=stderr)
+
+        logger.info(
+            f"Created window {window_index}: "
+            f"{start_time:.2f}s - {end_time:.2f}s "
+            f"({window_duration:.2f}s)"
+        )
+        return VideoWindow(
+            window_index=window_index,
+            start_time=start_time,
+            end_time=end_time,
+            file_path=str(window_path),
+            duration=window_duration
+        )
+
+    async def stream_window_async(
+        self,
+        video_path: str,
+        window_index: int,
+        start_time: float,
+        end_time: float,
+        profile: Optional[TranscodeProfile] = None,
+        chunk_size: int = 256 * 1024
+    ) -> AsyncIterator[bytes]:
+        """
+        提取单个窗口并以分片 MP4 字节流输出（不落盘）
+
+        配合 async with aclosing(...) 使用：提前关闭或任务被取消时终止 FFmpeg 进程。
+
+        Args:
+            video_path: 原始视频路径
+            window_index: 窗口索引
+            start_time: 开始时间（秒）
+            end_time: 结束时间（秒）
+            profile: 转码配置（默认 source）
+            chunk_size: 每次从管道读取的最大字节数
+
+        Yields:
+            MP4 数据块
+
+        Raises:
+            subprocess.CalledProcessError: FFmpeg 退出码非 0（在最后一块数据之后抛出）
+        """
+        cmd = self._build_extract_cmd(video_path, start_time, end_time - start_time, "pipe:1", profile)
+
+        encode_start = time.perf_counter()
+        with self._ffmpeg_running():
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            # 同时读取 stderr，避免 FFmpeg 写满 stderr 管道后阻塞
+            stderr_task = asyncio.ensure_future(process.stderr.read())
+            total = 0
+            completed = False
+            try:
+                while True:
+                    chunk = await asyncio.wait_for(process.stdout.read(chunk_size), timeout=60)
+                    if not chunk:
+                        break
+                    total += len(chunk)
+                    yield chunk
+                await asyncio.wait_for(process.wait(), timeout=60)
+                FFMPEG_WINDOW_SECONDS.observe(time.perf_counter() - encode_start)
+                completed = True
+            finally:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                if not completed:
+                    stderr_task.cancel()
+
+        stderr = await stderr_task
+        if process.returncode != 0:
+            logger.error(f"FFmpeg error: {stderr.decode('utf-8', errors='replace')}")
+            raise subprocess.CalledProcessError(process.returncode, cmd, stderr=stderr)
+
+        logger.info(
+            f"Streamed window {window_index}: {start_time:.2f}s - {end_time:.2f}s "
+            f"({total / 1024:.0f} KiB)"
+        )
+
+    async def extract_frames_async(
+        self,
+        video_path: str,
+        window_index: int,
+        start_time: float,
+        end_time: float,
+        count: int = 8,
+        sampling: str = "uniform",
+        max_edge: int = 1280,
+        quality: int = 5,
+        scene_threshold: float = 0.05
+    ) -> "WindowFrames":
+        """
+        从窗口中抽取 count 张代表帧（JPEG，经管道读取，不落盘）
+
+        - uniform: 在窗口内均匀抽帧
+        - scene: 取画面变化超过 scene_threshold 的帧（含窗口第一帧），多于 count 张时均匀挑选；
+          变化不足 2 帧时退回 uniform
+
+        Args:
+            video_path: 原始视频路径
+            window_index: 窗口索引
+            start_time: 开始时间（秒）
+            end_time: 结束时间（秒）
+            count: 每个窗口的帧数
+            sampling: uniform / scene
+            max_edge: 长边上限（像素）
+            quality: JPEG 质量（ffmpeg -q:v，2=最好，31=最差）
+            scene_threshold: scene 模式的画面变化阈值（0-1）
+
+        Returns:
+            窗口帧（base64 JPEG 和帧时间）
+        """
+        if sampling not in FRAME_SAMPLING_MODES:
+            raise ValueError(f"Unknown frame sampling mode: {sampling}")
+        duration = end_time - start_time
+        scale = (
+            f"scale='min(iw,{max_edge})':'min(ih,{max_edge})'"
+            f":force_original_aspect_ratio=decrease:force_divisible_by=2"
+        )
+        if sampling == "scene":
+            select = f"select='eq(n\\,0)+gt(scene\\,{scene_threshold})'"
+            filters = f"{select},{scale},showinfo"
+            frame_limit = []
+        else:
+            filters = f"fps={count / duration:.6f},{scale},showinfo"
+            frame_limit = ['-frames:v', str(count)]
+
+        cmd = [
+            'ffmpeg',
+            '-ss', str(start_time),   # 输入端 seek：只解码窗口附近的数据
+            '-t', str(duration),
+            '-i', video_path,
+            '-vf', filters,
+            '-fps_mode', 'vfr',
+            *frame_limit,
+            '-an',
+            '-c:v', 'mjpeg',
+            '-q:v', str(quality),
+            '-f', 'image2pipe',
+            'pipe:1'
+        ]
+
+        encode_start = time.perf_counter()
+        with self._ffmpeg_running():
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            try:
+                stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=60)
+                FFMPEG_FRAMES_SECONDS.observe(time.perf_counter() - encode_start)
+            except (asyncio.CancelledError, asyncio.TimeoutError):
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                raise
+
+        if process.returncode != 0:
+            logger.error(f"FFmpeg error: {stderr.decode('utf-8', errors='replace')}")
+            raise subprocess.CalledProcessError(process.returncode, cmd, stderr=stderr)
+
+        images = _split_jpegs(stdout)
+        timestamps = [start_time + float(t) for t in _SHOWINFO_PTS.findall(stderr)][:len(images)]
+        timestamps += [start_time] * (len(images) - len(timestamps))
+
+        if sampling == "scene":
+            if len(images) < 2:
+                logger.debug(f"Window {window_index}: only {len(images)} scene frames, falling back to uniform")
+                return await self.extract_frames_async(
+                    video_path, window_index, start_time, end_time, count, "uniform", max_edge, quality
+                )
+            if len(images) > count:
+                picks = [round(i * (len(images) - 1) / (count - 1)) for i in range(count)] if count > 1 else [0]
+                images = [images[i] for i in picks]
+                timestamps = [timestamps[i] for i in picks]
+
+        logger.info(
+            f"Sampled {len(images)} frames ({sampling}) for window {window_index}: "
+            f"{start_time:.2f}s - {end_time:.2f}s, {sum(len(i) for i in images) / 1024:.0f} KiB"
+        )
+        return WindowFrames(
+            window_index=window_index,
+            start_time=start_time,
+            end_time=end_time,
+            images=[base64.b64encode(i).decode("ascii") for i in images],
+            timestamps=timestamps
+        )
+
+    async def score_activity_async(
+        self,
+        video_path: str,
+        window_index: int,
+        start_time: float,
+        end_time: float,
+        fps: float = 2.0,
+        max_edge: int = 640
+    ) -> WindowActivity:
+        """
+        计算窗口的画面活动度（只解码窗口附近的数据，不编码，不落盘）
+
+        采样从窗口开始前一帧开始，窗口边界上发生的变化也会被计入。
+
+        Args:
+            video_path: 原始视频路径
+            window_index: 窗口索引
+            start_time: 开始时间（秒）
+            end_time: 结束时间（秒）
+            fps: 采样帧率
+            max_edge: 比较前缩放到的长边上限（像素）
+
+        Returns:
+            窗口活动度
+        """
+        seek = max(0.0, start_time - 1 / fps)
+        cmd = [
+            'ffmpeg',
+            '-ss', str(seek),
+            '-t', str(end_time - seek),
+            '-i', video_path,
+            '-vf', _activity_filters(fps, max_edge),
+            '-an',
+            '-f', 'null',
+            '-'
+        ]
+
+        score_start = time.perf_counter()
+        with self._ffmpeg_running():
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE
+            )
+            try:
+                _, stderr = await asyncio.wait_for(process.communicate(), timeout=60)
+                FFMPEG_ACTIVITY_SECONDS.labels("window").observe(time.perf_counter() - score_start)
+            except (asyncio.CancelledError, asyncio.TimeoutError):
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                raise
+
+        if process.returncode != 0:
+            logger.error(f"FFmpeg error: {stderr.decode('utf-8', errors='replace')}")
+            raise subprocess.CalledProcessError(process.returncode, cmd, stderr=stderr)
+
+        # 输入端 seek 后时间戳从 0 开始
+        samples = _parse_activity(stderr, offset=seek)
+        activity = WindowActivity.from_samples(window_index, start_time, end_time + 1 / fps, samples)
+        logger.debug(
+            f"Window {window_index} activity: peak {activity.peak:g}, mean {activity.mean:.3f} "
+            f"over {activity.samples} frame pairs"
+        )
+        return activity
+
     def cleanup_windows(self, session_id: str):
         """
         清理会话的所有窗口文件
@@ -220,27 +961,11 @@ class VideoProcessor:
             except Exception as e:
                 logger.error(f"Failed to cleanup windows for session {session_id}: {e}")
 
-    def get_window_info(self, video_path: str, session_id: str) -> List[Tuple[int, float, float]]:
+    def get_window_info(self, video_path: str, session_id: str,
+                        planner: Optional[str] = None) -> List[Tuple[int, float, float]]:
         """
         获取视频的窗口信息（不实际切片）
 
         返回格式：[(window_index, start_time, end_time), ...]
         """
-        duration = self.get_video_duration(video_path)
-
-        windows_info = []
-        window_index = 0
-        current_time = 0.0
-
-        while current_time < duration:
-            end_time = min(current_time + self.window_size, duration)
-            window_duration = end_time - current_time
-
-            if window_duration < 5.0 and window_index > 0:
-                break
-
-            windows_info.append((window_index, current_time, end_time))
-            window_index += 1
-            current_time += self.step_size
-
-        return windows_info
+        return self.plan(video_path, planner)
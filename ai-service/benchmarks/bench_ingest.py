@@ -0,0 +1,162 @@
+"""
+录制中视频的增量分析基准
+
+把一段 MediaRecorder 风格的 WebM（没有 Cues 和总时长）按录制速度分块上传到
+/recordings/{session_id}/chunks，同时记录 Mock Qwen 收到每个视频窗口请求的时间：
+- window_lag: 窗口最后一秒的数据上传完成到模型收到该窗口请求的延迟
+- complete: 调用 complete（录制结束）到返回结果的耗时（只剩末尾窗口）
+- batch_after_upload: 对比原有方式，上传完成后再调用 /analyze-video 的耗时
+
+--watch 时不经过 chunks 端点，而是按同样的节奏追加写入本地文件，服务端监视这个正在增长的文件。
+
+用法（在 ai-service 目录下，需要 ffmpeg、uvicorn、grpcio-tools）：
+    python -m benchmarks.bench_ingest --duration 60 --speed 4
+    python -m benchmarks.bench_ingest --duration 60 --speed 1 --chunk-seconds 2
+    python -m benchmarks.bench_ingest --watch
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+import uuid
+from typing import List
+
+import httpx
+
+from benchmarks.mock_services import (
+    MockQwenConfig, ServiceProcess, generate_test_video, percentile, start_offline_environment
+)
+
+WINDOW_SIZE = 15.0
+STEP_SIZE = 10.0
+
+
+async def watch_video_requests(env, started: List[float], stop: asyncio.Event):
+    """轮询 Mock Qwen 的视频请求计数，记录每个请求到达的时间"""
+    seen = env.qwen_stats.video_requests
+    while not stop.is_set():
+        while env.qwen_stats.video_requests > seen:
+            seen += 1
+            started.append(time.perf_counter())
+        await asyncio.sleep(0.01)
+
+
+async def run_live(client: httpx.AsyncClient, env, args, video_path: str) -> dict:
+    data = open(video_path, "rb").read()
+    session_id = f"ingest-{uuid.uuid4().hex[:8]}"
+    watched = None
+    if args.watch:
+        watched_path = os.path.join(os.path.dirname(video_path), f"{session_id}.webm")
+        watched = open(watched_path, "wb")
+        response = await client.post(f"/recordings/{session_id}", json={"video_path": watched_path})
+    else:
+        response = await client.post(f"/recordings/{session_id}", json={})
+    response.raise_for_status()
+
+    requests_at: List[float] = []
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(watch_video_requests(env, requests_at, stop))
+
+    # 按录制速度上传：假设码率恒定，第 n 块对应 [n, n + 1) * chunk_seconds 的画面
+    chunks = max(1, int(args.duration / args.chunk_seconds))
+    chunk_bytes = -(-len(data) // chunks)
+    uploaded_at: List[float] = []  # 每块上传完成的时间
+    start = time.perf_counter()
+    for i in range(chunks):
+        deadline = start + (i + 1) * args.chunk_seconds / args.speed
+        await asyncio.sleep(max(0.0, deadline - time.perf_counter()))
+        offset = i * chunk_bytes
+        if watched:
+            watched.write(data[offset:offset + chunk_bytes])
+            watched.flush()
+        else:
+            response = await client.post(
+                f"/recordings/{session_id}/chunks", params={"offset": offset},
+                content=data[offset:offset + chunk_bytes]
+            )
+            response.raise_for_status()
+        uploaded_at.append(time.perf_counter())
+    if watched:
+        watched.close()
+
+    complete_start = time.perf_counter()
+    response = await client.post(f"/recordings/{session_id}/complete")
+    response.raise_for_status()
+    complete_seconds = time.perf_counter() - complete_start
+    stop.set()
+    await watcher
+
+    # 录制中切出的窗口：第 i 个窗口结束于 i * STEP + WINDOW 秒
+    lags = []
+    for i, requested in enumerate(requests_at):
+        if requested >= complete_start:
+            break  # 录制结束后补齐的窗口
+        end = i * STEP_SIZE + WINDOW_SIZE
+        chunk_index = min(len(uploaded_at) - 1, int(-(-end // args.chunk_seconds)) - 1)
+        lags.append(requested - uploaded_at[chunk_index])
+
+    return {
+        "windows": response.json()["total_windows"],
+        "windows_live": len(lags),
+        "window_lag_p50_ms": round(percentile(lags, 50) * 1000, 1),
+        "window_lag_max_ms": round(max(lags, default=0.0) * 1000, 1),
+        "complete_ms": round(complete_seconds * 1000, 1),
+    }
+
+
+async def run_batch(client: httpx.AsyncClient, video_path: str) -> float:
+    start = time.perf_counter()
+    response = await client.post("/analyze-video", json={
+        "session_id": f"ingest-batch-{uuid.uuid4().hex[:8]}",
+        "video_path": video_path,
+    })
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Incremental analysis of a recording uploaded in chunks")
+    parser.add_argument("--duration", type=float, default=60.0, help="Recording length (s)")
+    parser.add_argument("--speed", type=float, default=4.0, help="Upload at this multiple of real time")
+    parser.add_argument("--chunk-seconds", type=float, default=1.0, help="Recording seconds per chunk")
+    parser.add_argument("--watch", action="store_true", help="Append to a file the service watches instead of POSTing chunks")
+    parser.add_argument("--ttft", type=float, default=0.3, help="Mock Qwen time to first token (s)")
+    parser.add_argument("--save", help="Write the result JSON to this path")
+    args = parser.parse_args()
+
+    video_path = os.path.join(tempfile.mkdtemp(prefix="streammind-ingest-"), "recording.webm")
+    generate_test_video(video_path, args.duration, live=True)
+
+    env = await start_offline_environment(MockQwenConfig(ttft=args.ttft, tokens_per_second=100, tokens_per_response=20))
+    service = ServiceProcess(env.stand_ins, extra_env={
+        "RESULT_CACHE_ENABLED": "false",
+        "VIDEO_SKIP_STATIC_WINDOWS": "false",
+        "INGEST_POLL_SECONDS": "0.5",
+    })
+    try:
+        await service.start()
+        async with httpx.AsyncClient(base_url=service.base_url, timeout=None) as client:
+            result = await run_live(client, env, args, video_path)
+            result["batch_after_upload_ms"] = round(await run_batch(client, video_path) * 1000, 1)
+    finally:
+        service.stop()
+        await env.close()
+
+    result = {
+        "source": "file" if args.watch else "chunks",
+        "duration_s": args.duration,
+        "speed": args.speed,
+        "chunk_seconds": args.chunk_seconds,
+        **result
+    }
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.save:
+        with open(args.save, "w") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,290 @@
+"""
+端到端离线基准
+
+在本机启动 Mock Qwen（SSE）、gRPC AnalysisService 替身和本地 S3 兼容存储，
+以子进程运行真实的 ai-service 并指向这些替身，然后：
+- video: 并发调用 /analyze-video 分析 ffmpeg 合成的测试视频
+- frames: 并发打开 WebSocket 会话按固定帧率推送帧
+
+输出 windows/sec、tokens/sec、请求与首 token 延迟的 p50/p99、服务进程 CPU 和 RSS；
+可以保存为基线 JSON，之后用 --baseline 对比回归。
+
+--replay 指向 QWEN_RECORD_DIR 录制的归档时，模型响应按真实录制回放（app.qwen_replay），
+Mock Qwen 不再收到请求。
+
+用法（在 ai-service 目录下，需要 ffmpeg、websockets、uvicorn、grpcio-tools）：
+    python -m benchmarks.bench_pipeline --scenario video --videos 4 --duration 40
+    python -m benchmarks.bench_pipeline --scenario frames --sessions 8 --frames 20 --fps 1
+    python -m benchmarks.bench_pipeline --save-baseline baseline.json
+    python -m benchmarks.bench_pipeline --baseline baseline.json
+    python -m benchmarks.bench_pipeline --replay recordings/ --replay-speed 2
+    python -m benchmarks.bench_pipeline --source smptebars   # 静止画面，观察 skipped_windows
+    python -m benchmarks.bench_pipeline --planner adaptive --duration 120
+    python -m benchmarks.bench_pipeline --upload-mode stream --size 1920x1080 --profile source
+    python -m benchmarks.bench_pipeline --differential   # 差量窗口，对比 analyzed_seconds
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import tempfile
+import time
+import uuid
+from typing import Dict, List
+
+import httpx
+
+from benchmarks.mock_services import (
+    MockQwenConfig, ResourceSampler, ServiceProcess, generate_test_video, percentile, start_offline_environment
+)
+
+# 对比基线时，这些指标越大越好；其余（延迟、CPU、RSS）越小越好
+HIGHER_IS_BETTER = {"windows_per_sec", "tokens_per_sec", "frames_per_sec"}
+
+
+async def run_video_scenario(service: ServiceProcess, env, args) -> dict:
+    """并发分析 args.videos 个合成视频"""
+    workdir = tempfile.mkdtemp(prefix="streammind-videos-")
+    videos = []
+    for i in range(args.videos):
+        path = os.path.join(workdir, f"bench_{i}.webm" if args.webm else f"bench_{i}.mp4")
+        generate_test_video(path, args.duration, size=args.size, fps=args.video_fps, source=args.source)
+        videos.append(path)
+
+    latencies: List[float] = []
+    windows = 0
+    skipped = 0
+    analyzed_seconds = 0.0
+    failures = 0
+
+    async with httpx.AsyncClient(base_url=service.base_url, timeout=None) as client:
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def analyze(path: str):
+            nonlocal windows, skipped, analyzed_seconds, failures
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post("/analyze-video", json={
+                    "session_id": f"bench-{uuid.uuid4().hex[:8]}",
+                    "video_path": path,
+                    "profile": args.profile,
+                    "window_mode": args.window_mode,
+                    "planner": args.planner,
+                    "differential": args.differential,
+                })
+                latencies.append(time.perf_counter() - start)
+                if response.status_code == 200:
+                    windows += response.json()["total_windows"]
+                    skipped += response.json().get("skipped_windows", 0)
+                    analyzed_seconds += response.json().get("analyzed_seconds", 0.0)
+                else:
+                    failures += 1
+
+        async with ResourceSampler(service.stats) as sampler:
+            start = time.perf_counter()
+            await asyncio.gather(*(analyze(v) for v in videos))
+            wall = time.perf_counter() - start
+
+    tokens = env.grpc_stats.calls
+    return {
+        "scenario": "video",
+        "videos": args.videos,
+        "failures": failures,
+        "windows": windows,
+        "skipped_windows": skipped,
+        "analyzed_seconds": round(analyzed_seconds, 1),
+        "wall_seconds": round(wall, 3),
+        "windows_per_sec": round(windows / wall, 3),
+        "tokens_per_sec": round(tokens / wall, 1),
+        "request_p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "request_p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "window_p50_ms": round(percentile(latencies, 50) * 1000 * len(videos) / max(windows, 1), 1),
+        **sampler.summary(),
+    }
+
+
+async def run_frames_scenario(service: ServiceProcess, env, args) -> dict:
+    """并发 WebSocket 会话，按 args.fps 推送 args.frames 帧"""
+    import websockets
+
+    payload = base64.b64encode(os.urandom(args.frame_kb * 1024)).decode("ascii")
+    ws_url = service.base_url.replace("http://", "ws://")
+    first_token_latencies: List[float] = []
+    frame_latencies: List[float] = []
+    received_frames = 0
+
+    async def session(index: int):
+        nonlocal received_frames
+        session_id = f"bench-ws-{index}-{uuid.uuid4().hex[:6]}"
+        sent_at: Dict[int, float] = {}
+
+        async with websockets.connect(f"{ws_url}/ws/analyze/{session_id}", max_size=None) as ws:
+            async def receiver():
+                nonlocal received_frames
+                current = 0
+                awaiting_first = False
+                async for message in ws:
+                    now = time.perf_counter()
+                    if message.startswith("\n\n📸 [分析帧 "):
+                        if current:
+                            frame_latencies.append(now - sent_at[current])
+                        current = int(message.split("分析帧 ")[1].split("]")[0])
+                        awaiting_first = True
+                        received_frames += 1
+                    elif awaiting_first and current in sent_at:
+                        first_token_latencies.append(now - sent_at[current])
+                        awaiting_first = False
+
+            receive_task = asyncio.create_task(receiver())
+            for frame in range(1, args.frames + 1):
+                sent_at[frame] = time.perf_counter()
+                await ws.send(payload)
+                await asyncio.sleep(1.0 / args.fps)
+            # 等待最后一帧的分析结束（token 停止到达）
+            last_calls = -1
+            while env.grpc_stats.sessions.get(session_id, 0) != last_calls:
+                last_calls = env.grpc_stats.sessions.get(session_id, 0)
+                await asyncio.sleep(max(1.0, env.qwen_config.ttft * 2))
+            receive_task.cancel()
+
+    async with ResourceSampler(service.stats) as sampler:
+        start = time.perf_counter()
+        await asyncio.gather(*(session(i) for i in range(args.sessions)))
+        wall = time.perf_counter() - start
+
+    sent = args.sessions * args.frames
+    return {
+        "scenario": "frames",
+        "sessions": args.sessions,
+        "frames_sent": sent,
+        "frames_analyzed": received_frames,
+        "wall_seconds": round(wall, 3),
+        "frames_per_sec": round(received_frames / wall, 3),
+        "tokens_per_sec": round(env.grpc_stats.calls / wall, 1),
+        "first_token_p50_ms": round(percentile(first_token_latencies, 50) * 1000, 1),
+        "first_token_p99_ms": round(percentile(first_token_latencies, 99) * 1000, 1),
+        "frame_p50_ms": round(percentile(frame_latencies, 50) * 1000, 1),
+        "frame_p99_ms": round(percentile(frame_latencies, 99) * 1000, 1),
+        **sampler.summary(),
+    }
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> List[str]:
+    """返回退化超过 tolerance（比例）的指标说明"""
+    regressions = []
+    print(f"\n{'metric':<22}{'baseline':>12}{'current':>12}{'change':>10}")
+    for key, value in result.items():
+        old = baseline.get(key)
+        if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or not old:
+            continue
+        change = (value - old) / old
+        print(f"{key:<22}{old:>12}{value:>12}{change * 100:>+9.1f}%")
+        worse = -change if key in HIGHER_IS_BETTER else change
+        if key.endswith(("_ms", "_per_sec", "cpu_seconds", "rss_peak_mb")) and worse > tolerance:
+            regressions.append(f"{key}: {old} -> {value} ({change * 100:+.1f}%)")
+    return regressions
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="End-to-end offline benchmark with mocked Qwen, gRPC and S3")
+    parser.add_argument("--scenario", choices=["video", "frames"], default="video")
+    # Mock Qwen
+    parser.add_argument("--ttft", type=float, default=0.5, help="Mock Qwen time to first token (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=40.0)
+    parser.add_argument("--tokens-per-response", type=int, default=40)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--replay", help="Serve Qwen responses from a recording archive (QWEN_REPLAY_DIR) "
+                                         "instead of the synthetic mock")
+    parser.add_argument("--replay-speed", type=float, default=1.0, help="Replay speed multiplier, 0 = no delays")
+    parser.add_argument("--grpc-latency", type=float, default=0.0, help="Fake SaveAnalysis latency (s)")
+    # video
+    parser.add_argument("--videos", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=40.0, help="Synthetic video length (s)")
+    parser.add_argument("--size", default="1280x720")
+    parser.add_argument("--video-fps", type=int, default=15)
+    parser.add_argument("--webm", action="store_true", help="Generate VP8/WebM like the browser recorder")
+    parser.add_argument("--source", default="testsrc2",
+                        help="lavfi source for generated videos, e.g. smptebars for a static screen")
+    parser.add_argument("--profile", help="Transcode profile sent with each request (default: server setting)")
+    parser.add_argument("--window-mode", choices=["video", "frames"], help="video (Minio URL) or frames (inline)")
+    parser.add_argument("--planner", choices=["fixed", "adaptive"], help="Window planner (default: service setting)")
+    parser.add_argument("--differential", action="store_true", default=None,
+                        help="Send only the footage after the previous window (default: service setting)")
+    parser.add_argument("--upload-mode", choices=["file", "stream"],
+                        help="file (temp_windows then upload) or stream (ffmpeg pipe to multipart upload)")
+    parser.add_argument("--result-cache", action="store_true",
+                        help="Keep the analysis result cache on (identical generated videos then hit it)")
+    # frames
+    parser.add_argument("--sessions", type=int, default=4)
+    parser.add_argument("--frames", type=int, default=10)
+    parser.add_argument("--fps", type=float, default=1.0)
+    parser.add_argument("--frame-kb", type=int, default=80)
+    # 基线
+    parser.add_argument("--save-baseline", help="Write the result JSON to this path")
+    parser.add_argument("--baseline", help="Compare against a saved result JSON")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed regression ratio")
+    args = parser.parse_args()
+
+    qwen_config = MockQwenConfig(
+        ttft=args.ttft,
+        tokens_per_second=args.tokens_per_second,
+        tokens_per_response=args.tokens_per_response,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+    )
+    env = await start_offline_environment(qwen_config, grpc_latency=args.grpc_latency)
+    extra_env = {}
+    if args.replay:
+        extra_env = {"QWEN_REPLAY_DIR": os.path.abspath(args.replay), "QWEN_REPLAY_SPEED": str(args.replay_speed)}
+    if args.upload_mode:
+        extra_env["VIDEO_UPLOAD_MODE"] = args.upload_mode
+    if not args.result_cache:
+        # 生成的测试视频内容相同，开启结果缓存时后面的视频不会再调用模型
+        extra_env["RESULT_CACHE_ENABLED"] = "false"
+    service = ServiceProcess(env.stand_ins, extra_env=extra_env)
+
+    try:
+        await service.start()
+        if args.scenario == "video":
+            result = await run_video_scenario(service, env, args)
+        else:
+            result = await run_frames_scenario(service, env, args)
+    finally:
+        service.stop()
+        await env.close()
+
+    result["mock_qwen"] = {
+        "requests": env.qwen_stats.requests,
+        "errors": env.qwen_stats.errors,
+        "throttled": env.qwen_stats.throttled,
+    }
+    result["s3"] = {"puts": env.s3.stats.puts, "deletes": env.s3.stats.deletes,
+                    "multipart_uploads": env.s3.stats.multipart_uploads,
+                    "mb_in": round(env.s3.stats.bytes_in / 1e6, 2)}
+
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"Baseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("scenario") != result["scenario"]:
+            raise SystemExit(f"Baseline scenario {baseline.get('scenario')} != {result['scenario']}")
+        regressions = compare(result, baseline, args.tolerance)
+        if regressions:
+            print("\nRegressions:")
+            for line in regressions:
+                print(f"  {line}")
+            raise SystemExit(1)
+        print("\nNo regressions beyond tolerance")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
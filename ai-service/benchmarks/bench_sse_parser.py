@@ -0,0 +1,137 @@
+"""
+SSE 解析微基准
+
+对比旧的按行解析（aiter_lines + startswith("data:") + json.loads + 手动遍历 choices）
+和 app.sse_parser 的增量字节解析器。
+
+用法（在 ai-service 目录下）：
+    python -m benchmarks.bench_sse_parser
+    python -m benchmarks.bench_sse_parser --file recorded_stream.sse --rounds 200
+
+--file 指向一个原始 SSE 响应体（例如 Qwen 录制归档中的响应）；
+未指定时生成一个与 DashScope 格式一致的合成流。
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import List
+
+import httpx
+
+from app.sse_parser import iter_dashscope_chunks
+
+
+def build_synthetic_stream(tokens: int = 400, seed: int = 7) -> bytes:
+    """生成 DashScope 风格的 SSE 响应体（id/event/注释行 + 增量 JSON）"""
+    rng = random.Random(seed)
+    words = ["用户", "正在", "编辑", "代码", "切换", "浏览器", "查看", "文档", "函数", "调试", "终端", "。", "，"]
+    parts = []
+    for i in range(1, tokens + 1):
+        text = "".join(rng.choice(words) for _ in range(rng.randint(1, 4)))
+        finish = "stop" if i == tokens else "null"
+        payload = {
+            "output": {
+                "choices": [{
+                    "message": {"content": [{"text": text}], "role": "assistant"},
+                    "finish_reason": finish
+                }]
+            },
+            "usage": {"input_tokens": 1200, "output_tokens": i},
+            "request_id": "5b9c0c1e-0000-0000-0000-000000000000"
+        }
+        parts.append(
+            f"id:{i}\nevent:result\n:HTTP_STATUS/200\ndata:{json.dumps(payload, ensure_ascii=False)}\n\n"
+        )
+    return "".join(parts).encode("utf-8")
+
+
+def split_like_network(body: bytes, seed: int = 11) -> List[bytes]:
+    """按随机大小切块，模拟网络读取的边界"""
+    rng = random.Random(seed)
+    chunks = []
+    pos = 0
+    while pos < len(body):
+        size = rng.randint(64, 4096)
+        chunks.append(body[pos:pos + size])
+        pos += size
+    return chunks
+
+
+async def _aiter(chunks: List[bytes]):
+    for chunk in chunks:
+        yield chunk
+
+
+def _response(chunks: List[bytes]) -> httpx.Response:
+    """用同样的块构造一个 httpx 流式响应，两种解析都走真实的 httpx 读取路径"""
+    return httpx.Response(200, content=_aiter(chunks))
+
+
+async def legacy_parse(chunks: List[bytes]) -> int:
+    """旧实现：逐行 + json.loads + 手动遍历 output.choices[0].message.content"""
+    count = 0
+    async for line in _response(chunks).aiter_lines():
+        if line.startswith("data:"):
+            data_str = line[5:].strip()
+            if not data_str:
+                continue
+            data = json.loads(data_str)
+            output = data.get("output", {})
+            choices = output.get("choices", [])
+            if choices and len(choices) > 0:
+                message = choices[0].get("message", {})
+                for item in message.get("content", []):
+                    if isinstance(item, dict) and "text" in item:
+                        count += 1
+                    elif isinstance(item, str):
+                        count += 1
+    return count
+
+
+async def incremental_parse(chunks: List[bytes]) -> int:
+    """新实现：字节级增量解析 + DashScopeChunk"""
+    count = 0
+    async for chunk in iter_dashscope_chunks(_response(chunks).aiter_bytes()):
+        count += len(chunk.texts)
+    return count
+
+
+async def _time(fn, chunks: List[bytes], rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        await fn(chunks)
+    return time.perf_counter() - start
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="SSE parser micro-benchmark")
+    parser.add_argument("--file", help="Raw SSE response body to replay")
+    parser.add_argument("--tokens", type=int, default=400, help="Events in the synthetic stream")
+    parser.add_argument("--rounds", type=int, default=300)
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, "rb") as f:
+            body = f.read()
+    else:
+        body = build_synthetic_stream(args.tokens)
+    chunks = split_like_network(body)
+
+    legacy_tokens = await legacy_parse(chunks)
+    new_tokens = await incremental_parse(chunks)
+    if legacy_tokens != new_tokens:
+        print(f"WARNING: token count differs (legacy={legacy_tokens}, incremental={new_tokens})")
+
+    mb = len(body) * args.rounds / 1e6
+    for name, fn in (("legacy (aiter_lines)", legacy_parse), ("incremental (aiter_bytes)", incremental_parse)):
+        elapsed = await _time(fn, chunks, args.rounds)
+        print(
+            f"{name:28s} {elapsed * 1000 / args.rounds:8.3f} ms/stream  "
+            f"{mb / elapsed:8.1f} MB/s  {new_tokens * args.rounds / elapsed:10.0f} tokens/s"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
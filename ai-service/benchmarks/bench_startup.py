@@ -0,0 +1,141 @@
+"""
+服务启动与首请求延迟基准
+
+每轮启动一个新的 ai-service 子进程（指向离线替身），测量：
+- startup: 启动进程到 /health 返回 200（解释器、导入、lifespan 预热）
+- import / warm_up: 服务自己上报的 streammind_startup_seconds
+- first_frame / second_frame: 同一 WebSocket 会话第 1、2 帧从发送到收到第一个 token；
+  两者之差是第一个请求额外承担的连接开销（DashScope、gRPC）
+- first_video / second_video: 两个单窗口视频请求的总耗时（额外包含 Minio 客户端和连接）
+
+多轮取中位数输出 JSON。
+
+用法（在 ai-service 目录下，需要 ffmpeg、websockets、uvicorn、grpcio-tools）：
+    python -m benchmarks.bench_startup --runs 5
+    python -m benchmarks.bench_startup --runs 5 --no-warm-up       # 对比关闭启动预热
+    python -m benchmarks.bench_startup --launcher uvicorn          # 对比直接运行 uvicorn app.main:app
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import statistics
+import tempfile
+import time
+import uuid
+from typing import Dict, List
+
+import httpx
+
+from benchmarks.mock_services import MockQwenConfig, ServiceProcess, generate_test_video, start_offline_environment
+from benchmarks.ws_load import load_frames
+
+FRAME_MARKER = re.compile(r"📸 \[分析帧 (\d+)\]")
+STARTUP_METRIC = re.compile(r'^streammind_startup_seconds\{phase="(\w+)"\} ([0-9.eE+-]+)$', re.MULTILINE)
+
+
+async def frame_first_tokens(base_url: str, frames: List[str]) -> List[float]:
+    """一个会话依次发送两帧，返回每帧从发送到第一个 token 的秒数"""
+    import websockets
+
+    ws_url = base_url.replace("http://", "ws://")
+    latencies = []
+    async with websockets.connect(f"{ws_url}/ws/analyze/startup-{uuid.uuid4().hex[:6]}", max_size=None) as ws:
+        for frame in frames[:2]:
+            sent = time.perf_counter()
+            await ws.send(frame)
+            marker_seen = False
+            while True:
+                message = await asyncio.wait_for(ws.recv(), timeout=30)
+                if FRAME_MARKER.search(message):
+                    marker_seen = True
+                    continue
+                if marker_seen:
+                    latencies.append(time.perf_counter() - sent)
+                    break
+            # 等这一帧的回答结束，第二帧不排队
+            while True:
+                try:
+                    await asyncio.wait_for(ws.recv(), timeout=0.5)
+                except asyncio.TimeoutError:
+                    break
+    return latencies
+
+
+async def video_latencies(client: httpx.AsyncClient, video_path: str) -> List[float]:
+    latencies = []
+    for _ in range(2):
+        start = time.perf_counter()
+        response = await client.post("/analyze-video", json={
+            "session_id": f"startup-{uuid.uuid4().hex[:8]}",
+            "video_path": video_path,
+        })
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def run_once(env, args, frames: List[str], video_path: str) -> Dict[str, float]:
+    extra_env = {
+        "RESULT_CACHE_ENABLED": "false",
+        "STARTUP_WARM_UP": "false" if args.no_warm_up else "true",
+        "VIDEO_SKIP_STATIC_WINDOWS": "false",
+    }
+    service = ServiceProcess(env.stand_ins, extra_env=extra_env, launcher=args.launcher)
+    try:
+        await service.start()
+        result = {"startup": service.startup_seconds}
+        async with httpx.AsyncClient(base_url=service.base_url, timeout=None) as client:
+            metrics = (await client.get("/metrics")).text
+            for phase, value in STARTUP_METRIC.findall(metrics):
+                result[phase] = float(value)
+            first, second = await frame_first_tokens(service.base_url, frames)
+            result.update(first_frame=first, second_frame=second)
+            first, second = await video_latencies(client, video_path)
+            result.update(first_video=first, second_video=second)
+        return result
+    finally:
+        service.stop()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Service startup time and first-request latency")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--launcher", choices=["app", "uvicorn"], default="app",
+                        help="app: python -m app (production launcher); uvicorn: uvicorn app.main:app")
+    parser.add_argument("--no-warm-up", action="store_true", help="Start with STARTUP_WARM_UP=false")
+    parser.add_argument("--ttft", type=float, default=0.05, help="Mock Qwen time to first token (s)")
+    parser.add_argument("--save", help="Write the result JSON to this path")
+    args = parser.parse_args()
+
+    frames = load_frames(None, "1280x720", 2, 80)
+    video_path = os.path.join(tempfile.mkdtemp(prefix="streammind-startup-"), "startup.mp4")
+    generate_test_video(video_path, 8.0)
+
+    env = await start_offline_environment(MockQwenConfig(ttft=args.ttft, tokens_per_second=200, tokens_per_response=10))
+    runs = []
+    try:
+        for _ in range(args.runs):
+            runs.append(await run_once(env, args, frames, video_path))
+    finally:
+        await env.close()
+
+    result = {
+        "launcher": args.launcher,
+        "warm_up": not args.no_warm_up,
+        "runs": len(runs),
+    }
+    for key in runs[0]:
+        values = [run[key] for run in runs if key in run]
+        result[f"{key}_ms"] = round(statistics.median(values) * 1000, 1)
+
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.save:
+        with open(args.save, "w") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
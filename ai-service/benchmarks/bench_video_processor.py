@@ -0,0 +1,233 @@
+"""
+VideoProcessor 微基准
+
+用 ffmpeg lavfi 生成类似屏幕录制的合成视频（不同分辨率、时长、编码、关键帧间隔），
+然后分别计时：
+- 媒体探测：首次 ffprobe（冷）和缓存命中（热）
+- slice_video_with_sliding_window（当前实现：-i 之后 -ss，libx264 重新编码），
+  每个转码配置（--profiles，见 TRANSCODE_PROFILES）单独一行，记为 current:<profile>
+- 其他切片策略：input_seek（-ss 放在 -i 之前再重新编码）、stream_copy（-ss 在前，-c copy，
+  起点对齐到关键帧，不精确）
+
+报告每个组合的墙钟时间、子进程 CPU 时间、每 CPU 秒处理的视频秒数和每个窗口的输出大小，
+最后汇总各转码配置相对 source 的体积和编码 CPU 节省。
+
+合成源：
+- static: 静止画面（smptebars），接近没有操作的屏幕
+- life: 生命游戏，局部小面积变化，接近打字/滚动
+- motion: testsrc2，全屏持续运动（最坏情况）
+
+用法（在 ai-service 目录下，需要 ffmpeg/ffprobe）：
+    python -m benchmarks.bench_video_processor
+    python -m benchmarks.bench_video_processor --sizes 1280x720,1920x1080 --durations 60,300 \\
+        --gops 30,250 --codecs mp4,webm --windows 15:10,30:20 --json result.json
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from app.media_probe import MediaProbe
+from app.video_processor import TRANSCODE_PROFILES, VideoProcessor
+
+SOURCES = {
+    "static": "smptebars=size={size}:rate={fps}:duration={duration}",
+    "life": "life=size={size}:rate={fps}:mold=10:ratio=0.1:death_color=#202020:life_color=#e0e0e0,"
+            "trim=duration={duration}",
+    "motion": "testsrc2=size={size}:rate={fps}:duration={duration}",
+}
+
+
+def generate_source(directory: str, source: str, size: str, duration: float, codec: str, gop: int, fps: int) -> str:
+    """生成（或复用已生成的）合成视频"""
+    ext = "webm" if codec == "webm" else "mp4"
+    path = os.path.join(directory, f"{source}_{size}_{int(duration)}s_g{gop}.{ext}")
+    if os.path.exists(path):
+        return path
+    encoder = ["-c:v", "libvpx", "-b:v", "1M", "-deadline", "realtime", "-cpu-used", "8"] if ext == "webm" \
+        else ["-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p"]
+    subprocess.run([
+        "ffmpeg", "-v", "error", "-y",
+        "-f", "lavfi", "-i", SOURCES[source].format(size=size, fps=fps, duration=duration),
+        *encoder, "-g", str(gop), "-keyint_min", str(gop),
+        path,
+    ], check=True)
+    return path
+
+
+def children_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def input_seek_cmd(video_path: str, start: float, duration: float, output_path: str) -> List[str]:
+    return [
+        "ffmpeg", "-ss", str(start), "-i", video_path, "-t", str(duration),
+        "-c:v", "libx264", "-preset", "fast", "-crf", "23", "-an",
+        "-movflags", "+faststart", "-y", output_path,
+    ]
+
+
+def stream_copy_cmd(video_path: str, start: float, duration: float, output_path: str) -> List[str]:
+    return [
+        "ffmpeg", "-ss", str(start), "-i", video_path, "-t", str(duration),
+        "-c", "copy", "-an", "-avoid_negative_ts", "make_zero", "-y", output_path,
+    ]
+
+
+ALTERNATIVES: Dict[str, Callable[[str, float, float, str], List[str]]] = {
+    "input_seek": input_seek_cmd,
+    "stream_copy": stream_copy_cmd,
+}
+
+
+def run_current(processor: VideoProcessor, video_path: str, session_id: str, profile: str) -> List[str]:
+    """当前实现（元数据已缓存，不会再次启动 ffprobe）"""
+    return [w.file_path for w in processor.slice_video_with_sliding_window(video_path, session_id, profile)]
+
+
+def run_alternative(processor: VideoProcessor, strategy: str, video_path: str, session_id: str,
+                    duration: float) -> List[str]:
+    ext = os.path.splitext(video_path)[1] if strategy == "stream_copy" else ".mp4"
+    outputs = []
+    for index, start, end in processor.plan_windows(duration):
+        output = str(processor._window_path(session_id, index, start, end).with_suffix(ext))
+        subprocess.run(ALTERNATIVES[strategy](video_path, start, end - start, output),
+                       capture_output=True, check=True, timeout=120)
+        outputs.append(output)
+    return outputs
+
+
+def measure(fn: Callable[[], List[str]]) -> dict:
+    cpu_before = children_cpu()
+    start = time.perf_counter()
+    outputs = fn()
+    wall = time.perf_counter() - start
+    cpu = children_cpu() - cpu_before
+    sizes = [os.path.getsize(p) for p in outputs]
+    return {"wall": wall, "cpu": cpu, "windows": len(outputs), "bytes": sizes}
+
+
+def print_profile_savings(results: List[dict]):
+    """各转码配置相对 current:source 的输出体积和编码 CPU 变化"""
+    baseline = {}
+    for row in results:
+        if row["strategy"] == "current:source":
+            key = (row["source"], row["size"], row["duration"], row["codec"], row["gop"], row["window"], row["step"])
+            baseline[key] = row
+    if not baseline:
+        return
+
+    print("\nTranscode profile savings vs current:source")
+    for row in results:
+        key = (row["source"], row["size"], row["duration"], row["codec"], row["gop"], row["window"], row["step"])
+        base = baseline.get(key)
+        if not base or row is base or not row["strategy"].startswith("current:"):
+            continue
+        size_saving = 1 - row["kb_per_window"] / base["kb_per_window"] if base["kb_per_window"] else 0.0
+        cpu_saving = 1 - row["cpu_s"] / base["cpu_s"] if base["cpu_s"] else 0.0
+        print(f"  {row['source']:<7}{row['size']:>10} {row['codec']:>5} g{row['gop']:<4} {row['strategy']:<22}"
+              f"size {size_saving * 100:+6.1f}%  encode cpu {cpu_saving * 100:+6.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="VideoProcessor micro-benchmark on synthetic recordings")
+    parser.add_argument("--sources", default="static,life,motion")
+    parser.add_argument("--sizes", default="1280x720")
+    parser.add_argument("--durations", default="60", help="Source lengths in seconds")
+    parser.add_argument("--gops", default="60,300", help="Keyframe intervals in frames")
+    parser.add_argument("--codecs", default="mp4,webm")
+    parser.add_argument("--fps", type=int, default=15)
+    parser.add_argument("--windows", default="15:10", help="window:step pairs, comma separated")
+    parser.add_argument("--strategies", default="current," + ",".join(ALTERNATIVES))
+    parser.add_argument("--profiles", default=",".join(TRANSCODE_PROFILES), help="Transcode profiles for 'current'")
+    parser.add_argument("--source-dir", help="Keep generated sources here and reuse them")
+    parser.add_argument("--probe-rounds", type=int, default=100, help="Cached lookups to time after the first probe")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    if not shutil.which("ffmpeg") or not shutil.which("ffprobe"):
+        raise SystemExit("ffmpeg and ffprobe are required")
+
+    source_dir = args.source_dir or tempfile.mkdtemp(prefix="streammind-sources-")
+    os.makedirs(source_dir, exist_ok=True)
+    output_dir = tempfile.mkdtemp(prefix="streammind-windows-")
+    strategies = []
+    for strategy in (s for s in args.strategies.split(",") if s):
+        if strategy == "current":
+            strategies += [f"current:{p}" for p in args.profiles.split(",") if p]
+        else:
+            strategies.append(strategy)
+    results = []
+
+    header = (f"{'source':<7}{'size':>10}{'dur':>5}{'codec':>6}{'gop':>5}{'win':>7}  {'strategy':<22}"
+              f"{'probe ms':>9}{'wall s':>8}{'cpu s':>8}{'vid s/cpu s':>12}{'KB/window':>11}")
+    print(header)
+    print("-" * len(header))
+
+    for source in args.sources.split(","):
+        for size in args.sizes.split(","):
+            for duration in (float(d) for d in args.durations.split(",")):
+                for codec in args.codecs.split(","):
+                    for gop in (int(g) for g in args.gops.split(",")):
+                        video = generate_source(source_dir, source, size, duration, codec, gop, args.fps)
+
+                        for spec in args.windows.split(","):
+                            window, step = (float(v) for v in spec.split(":"))
+                            processor = VideoProcessor(window_size=window, step_size=step, output_dir=output_dir,
+                                                       probe=MediaProbe())
+
+                            probe_start = time.perf_counter()
+                            video_duration = processor.get_video_duration(video)
+                            probe_ms = (time.perf_counter() - probe_start) * 1000
+                            warm_start = time.perf_counter()
+                            for _ in range(args.probe_rounds):
+                                processor.get_video_duration(video)
+                            warm_probe_us = (time.perf_counter() - warm_start) * 1e6 / args.probe_rounds
+
+                            for strategy in strategies:
+                                session_id = f"{source}-{codec}-{gop}-{strategy.replace(':', '-')}"
+                                if strategy.startswith("current:"):
+                                    profile = strategy.split(":", 1)[1]
+                                    m = measure(lambda: run_current(processor, video, session_id, profile))
+                                else:
+                                    m = measure(lambda: run_alternative(processor, strategy, video, session_id,
+                                                                        video_duration))
+                                processor.cleanup_windows(session_id)
+
+                                windowed_seconds = sum(e - s for _, s, e in processor.plan_windows(video_duration))
+                                throughput = windowed_seconds / m["cpu"] if m["cpu"] else 0.0
+                                kb_per_window = sum(m["bytes"]) / max(m["windows"], 1) / 1024
+                                row = {
+                                    "source": source, "size": size, "duration": duration, "codec": codec,
+                                    "gop": gop, "window": window, "step": step, "strategy": strategy,
+                                    "probe_ms": round(probe_ms, 2), "warm_probe_us": round(warm_probe_us, 1),
+                                    "wall_s": round(m["wall"], 3),
+                                    "cpu_s": round(m["cpu"], 3), "windows": m["windows"],
+                                    "video_s_per_cpu_s": round(throughput, 2),
+                                    "kb_per_window": round(kb_per_window, 1),
+                                }
+                                results.append(row)
+                                print(f"{source:<7}{size:>10}{int(duration):>5}{codec:>6}{gop:>5}"
+                                      f"{f'{window:g}/{step:g}':>7}  {strategy:<22}{probe_ms:>9.1f}"
+                                      f"{m['wall']:>8.2f}{m['cpu']:>8.2f}{throughput:>12.1f}{kb_per_window:>11.0f}")
+
+    print_profile_savings(results)
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    if not args.source_dir:
+        shutil.rmtree(source_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,511 @@
+"""
+本地替身服务，用于离线基准测试
+
+- MockQwen: DashScope 风格的 SSE 流式接口，可配置首 token 延迟、token 速率、错误率/限流率
+- FakeAnalysisService: 实现 AnalysisService.SaveAnalysis 的 gRPC 服务，只计数不落库
+- LocalS3: 最小 S3 兼容对象存储（PUT/GET/HEAD/DELETE + 分片上传），数据保存在内存
+- ServiceProcess: 以子进程方式启动真实的 ai-service，并指向上述替身
+
+所有替身都运行在调用方的事件循环里；被测服务在独立进程中运行，便于单独统计 CPU/RSS。
+"""
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+AI_SERVICE_DIR = Path(__file__).resolve().parent.parent
+PROTO_DIR = AI_SERVICE_DIR.parent / "proto"
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def start_uvicorn(app, port: int) -> uvicorn.Server:
+    """在当前事件循环中启动一个 uvicorn 服务，返回后即可接受连接"""
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off")
+    server = uvicorn.Server(config)
+    server.install_signal_handlers = lambda: None
+    asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    return server
+
+
+# ========== Mock Qwen (DashScope SSE) ==========
+
+@dataclass
+class MockQwenConfig:
+    ttft: float = 0.5                 # 首 token 延迟（秒）
+    tokens_per_second: float = 30.0   # 之后的 token 速率
+    tokens_per_response: int = 60
+    error_rate: float = 0.0           # 返回 HTTP 500 的概率
+    throttle_rate: float = 0.0        # 返回 HTTP 429 的概率
+    token_text: str = "屏幕内容"
+    seed: int = 1
+
+
+@dataclass
+class MockQwenStats:
+    requests: int = 0
+    errors: int = 0
+    throttled: int = 0
+    tokens: int = 0
+    video_requests: int = 0
+    image_requests: int = 0
+
+
+def build_mock_qwen_app(config: MockQwenConfig, stats: MockQwenStats) -> Starlette:
+    rng = random.Random(config.seed)
+
+    async def generate(request: Request):
+        body = await request.json()
+        stats.requests += 1
+        messages = body.get("input", {}).get("messages", [])
+        content = messages[-1].get("content", []) if messages else []
+        if any(isinstance(item, dict) and "video" in item for item in content):
+            stats.video_requests += 1
+        else:
+            stats.image_requests += 1
+
+        roll = rng.random()
+        if roll < config.throttle_rate:
+            stats.throttled += 1
+            return JSONResponse({"code": "Throttling.RateQuota", "message": "Requests rate limit exceeded"},
+                                status_code=429)
+        if roll < config.throttle_rate + config.error_rate:
+            stats.errors += 1
+            return JSONResponse({"code": "InternalError", "message": "mock failure"}, status_code=500)
+
+        request_id = str(uuid.uuid4())
+
+        async def stream():
+            await asyncio.sleep(config.ttft)
+            interval = 1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0
+            for i in range(1, config.tokens_per_response + 1):
+                if i > 1 and interval:
+                    await asyncio.sleep(interval)
+                finish = "stop" if i == config.tokens_per_response else "null"
+                payload = {
+                    "output": {"choices": [{
+                        "message": {"content": [{"text": config.token_text}], "role": "assistant"},
+                        "finish_reason": finish,
+                    }]},
+                    "usage": {"input_tokens": 1000, "output_tokens": i},
+                    "request_id": request_id,
+                }
+                stats.tokens += 1
+                yield (f"id:{i}\nevent:result\n:HTTP_STATUS/200\n"
+                       f"data:{json.dumps(payload, ensure_ascii=False)}\n\n").encode("utf-8")
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return Starlette(routes=[Route("/{path:path}", generate, methods=["POST"])])
+
+
+# ========== Local S3 ==========
+
+@dataclass
+class LocalS3Stats:
+    puts: int = 0
+    deletes: int = 0
+    bytes_in: int = 0
+    multipart_uploads: int = 0
+
+
+class LocalS3:
+    """最小 S3 兼容存储（path-style），不校验签名"""
+
+    def __init__(self):
+        self.objects: Dict[str, bytes] = {}
+        self.uploads: Dict[str, Dict[int, bytes]] = {}
+        self.stats = LocalS3Stats()
+
+    def app(self) -> Starlette:
+        return Starlette(routes=[
+            Route("/{bucket}/{key:path}", self._handle, methods=["GET", "HEAD", "PUT", "DELETE", "POST"]),
+            Route("/{bucket}", self._bucket, methods=["GET", "HEAD", "PUT"]),
+        ])
+
+    async def _bucket(self, request: Request):
+        return Response(status_code=200)
+
+    async def _handle(self, request: Request):
+        bucket = request.path_params["bucket"]
+        key = f"{bucket}/{request.path_params['key']}"
+        params = request.query_params
+
+        if request.method == "POST" and "uploads" in params:
+            upload_id = uuid.uuid4().hex
+            self.uploads[upload_id] = {}
+            self.stats.multipart_uploads += 1
+            xml = (f'<?xml version="1.0" encoding="UTF-8"?><InitiateMultipartUploadResult>'
+                   f'<Bucket>{bucket}</Bucket><Key>{request.path_params["key"]}</Key>'
+                   f'<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>')
+            return Response(xml, media_type="application/xml")
+
+        if request.method == "POST" and "uploadId" in params:
+            parts = self.uploads.pop(params["uploadId"], {})
+            data = b"".join(parts[n] for n in sorted(parts))
+            self.objects[key] = data
+            self.stats.puts += 1
+            xml = (f'<?xml version="1.0" encoding="UTF-8"?><CompleteMultipartUploadResult>'
+                   f'<Bucket>{bucket}</Bucket><Key>{request.path_params["key"]}</Key>'
+                   f'<ETag>"{uuid.uuid4().hex}"</ETag></CompleteMultipartUploadResult>')
+            return Response(xml, media_type="application/xml")
+
+        if request.method == "PUT":
+            body = await request.body()
+            self.stats.bytes_in += len(body)
+            etag = f'"{uuid.uuid4().hex}"'
+            if "uploadId" in params:
+                self.uploads.setdefault(params["uploadId"], {})[int(params["partNumber"])] = body
+            else:
+                self.objects[key] = body
+                self.stats.puts += 1
+            return Response(status_code=200, headers={"ETag": etag})
+
+        if request.method == "DELETE":
+            if "uploadId" in params:
+                self.uploads.pop(params["uploadId"], None)
+            else:
+                self.objects.pop(key, None)
+                self.stats.deletes += 1
+            return Response(status_code=204)
+
+        data = self.objects.get(key)
+        if data is None:
+            return Response(status_code=404)
+        headers = {"Content-Length": str(len(data)), "ETag": '"0"'}
+        if request.method == "HEAD":
+            return Response(status_code=200, headers=headers)
+        return Response(data, headers=headers, media_type="application/octet-stream")
+
+
+# ========== Fake gRPC AnalysisService ==========
+
+def ensure_protobuf(target_dir: Optional[str] = None) -> str:
+    """
+    确保 analysis_pb2 可导入：优先使用 app/generated，否则用 grpc_tools 生成到临时目录
+
+    Returns:
+        需要加入 sys.path / PYTHONPATH 的目录（使用 app/generated 时为空字符串）
+    """
+    try:
+        from app.generated import analysis_pb2, analysis_pb2_grpc  # noqa: F401
+        return ""
+    except ImportError:
+        pass
+
+    target = Path(target_dir or tempfile.mkdtemp(prefix="streammind-proto-"))
+    generated = target / "generated"
+    generated.mkdir(parents=True, exist_ok=True)
+    subprocess.run([
+        sys.executable, "-m", "grpc_tools.protoc",
+        f"-I{PROTO_DIR}",
+        f"--python_out={generated}",
+        f"--grpc_python_out={generated}",
+        str(PROTO_DIR / "analysis.proto"),
+    ], check=True)
+    grpc_module = generated / "analysis_pb2_grpc.py"
+    grpc_module.write_text(grpc_module.read_text().replace(
+        "import analysis_pb2 as", "from . import analysis_pb2 as"))
+    (generated / "__init__.py").touch()
+    if str(target) not in sys.path:
+        sys.path.insert(0, str(target))
+    return str(target)
+
+
+def import_generated():
+    """ensure_protobuf 之后导入 generated 包（app/generated 或临时目录）"""
+    try:
+        from app.generated import analysis_pb2, analysis_pb2_grpc
+    except ImportError:
+        from generated import analysis_pb2, analysis_pb2_grpc
+    return analysis_pb2, analysis_pb2_grpc
+
+
+@dataclass
+class FakeAnalysisStats:
+    calls: int = 0
+    bytes: int = 0
+    sessions: Dict[str, int] = field(default_factory=dict)
+    first_call_at: Dict[str, float] = field(default_factory=dict)
+    last_call_at: Dict[str, float] = field(default_factory=dict)
+
+
+async def start_fake_analysis_service(port: int, latency: float = 0.0):
+    """启动 gRPC 替身，返回 (server, stats)"""
+    import grpc
+    analysis_pb2, analysis_pb2_grpc = import_generated()
+
+    stats = FakeAnalysisStats()
+
+    class Servicer(analysis_pb2_grpc.AnalysisServiceServicer):
+        async def SaveAnalysis(self, request, context):
+            if latency:
+                await asyncio.sleep(latency)
+            now = time.perf_counter()
+            stats.calls += 1
+            stats.bytes += len(request.content.encode("utf-8"))
+            stats.sessions[request.session_id] = stats.sessions.get(request.session_id, 0) + 1
+            stats.first_call_at.setdefault(request.session_id, now)
+            stats.last_call_at[request.session_id] = now
+            return analysis_pb2.AnalysisResponse(success=True, message="ok", saved_id=stats.calls)
+
+    server = grpc.aio.server()
+    analysis_pb2_grpc.add_AnalysisServiceServicer_to_server(Servicer(), server)
+    server.add_insecure_port(f"127.0.0.1:{port}")
+    await server.start()
+    return server, stats
+
+
+# ========== 被测服务进程 ==========
+
+def read_proc_stats(pid: int) -> dict:
+    """从 /proc 读取进程 CPU 时间（秒）和 RSS（MB），仅 Linux"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        ticks = os.sysconf("SC_CLK_TCK")
+        cpu = (int(fields[11]) + int(fields[12])) / ticks  # utime + stime
+        rss_mb = 0.0
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss_mb = int(line.split()[1]) / 1024
+        return {"cpu_seconds": cpu, "rss_mb": rss_mb}
+    except (OSError, IndexError, ValueError):
+        return {"cpu_seconds": 0.0, "rss_mb": 0.0}
+
+
+@dataclass
+class StandIns:
+    qwen_url: str
+    grpc_port: int
+    s3_url: str
+    pythonpath: str = ""
+
+
+class ServiceProcess:
+    """
+    以子进程运行真实的 ai-service
+
+    launcher 为 uvicorn 时运行 uvicorn app.main:app，为 app 时使用生产启动入口 python -m app
+    """
+
+    def __init__(self, stand_ins: StandIns, port: Optional[int] = None,
+                 extra_env: Optional[Dict[str, str]] = None, workdir: Optional[str] = None,
+                 launcher: str = "uvicorn"):
+        self.port = port or free_port()
+        self.launcher = launcher
+        self.startup_seconds = 0.0  # 启动进程到 /health 返回 200
+        self.stand_ins = stand_ins
+        self.extra_env = extra_env or {}
+        self.workdir = workdir or tempfile.mkdtemp(prefix="streammind-bench-")
+        self.process: Optional[subprocess.Popen] = None
+        self.peak_rss_mb = 0.0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def env(self) -> Dict[str, str]:
+        env = dict(os.environ)
+        pythonpath = [str(AI_SERVICE_DIR)]
+        if self.stand_ins.pythonpath:
+            pythonpath.append(self.stand_ins.pythonpath)
+        if env.get("PYTHONPATH"):
+            pythonpath.append(env["PYTHONPATH"])
+        env.update({
+            "PYTHONPATH": os.pathsep.join(pythonpath),
+            "QWEN_API_KEY": "sk-offline-benchmark-key",
+            "QWEN_API_URL": self.stand_ins.qwen_url,
+            "QWEN_API_KEYS": "",
+            "SPRING_BOOT_GRPC_HOST": "127.0.0.1",
+            "SPRING_BOOT_GRPC_PORT": str(self.stand_ins.grpc_port),
+            "MINIO_ENDPOINT": self.stand_ins.s3_url,
+            "MINIO_BUCKET": "test",
+            "MINIO_ACCESS_KEY": "bench",
+            "MINIO_SECRET_KEY": "bench-secret",
+            "MINIO_PUBLIC_URL": f"{self.stand_ins.s3_url}/test/",
+            "LOG_LEVEL": "WARNING",
+            "TRACE_EXPORTERS": "memory",
+        })
+        env.update(self.extra_env)
+        return env
+
+    async def start(self, timeout: float = 30.0):
+        if self.launcher == "app":
+            command = [sys.executable, "-m", "app", "--host", "127.0.0.1", "--port", str(self.port),
+                       "--no-access-log"]
+        else:
+            command = [sys.executable, "-m", "uvicorn", "app.main:app",
+                       "--host", "127.0.0.1", "--port", str(self.port), "--log-level", "warning"]
+        started = time.monotonic()
+        self.process = subprocess.Popen(command, cwd=self.workdir, env=self.env())
+        deadline = started + timeout
+        async with httpx.AsyncClient() as client:
+            while time.monotonic() < deadline:
+                if self.process.poll() is not None:
+                    raise RuntimeError(f"ai-service exited with code {self.process.returncode}")
+                try:
+                    if (await client.get(f"{self.base_url}/health")).status_code == 200:
+                        self.startup_seconds = time.monotonic() - started
+                        return
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.02)
+        raise TimeoutError("ai-service did not become healthy in time")
+
+    def stats(self) -> dict:
+        if not self.process:
+            return {"cpu_seconds": 0.0, "rss_mb": 0.0}
+        stats = read_proc_stats(self.process.pid)
+        self.peak_rss_mb = max(self.peak_rss_mb, stats["rss_mb"])
+        return stats
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+class ResourceSampler:
+    """
+    后台定时采样进程的 CPU 时间和 RSS
+
+    Args:
+        stats_fn: 返回 {"cpu_seconds", "rss_mb"} 的函数，例如 ServiceProcess.stats
+    """
+
+    def __init__(self, stats_fn: Callable[[], dict], interval: float = 0.25):
+        self.stats_fn = stats_fn
+        self.interval = interval
+        self.rss_samples: List[float] = []
+        self._task = None
+
+    async def __aenter__(self):
+        self._start_cpu = self.stats_fn()["cpu_seconds"]
+        self._start = time.perf_counter()
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *exc):
+        self._task.cancel()
+        stats = self.stats_fn()
+        self.rss_samples.append(stats["rss_mb"])
+        self.cpu_seconds = stats["cpu_seconds"] - self._start_cpu
+        self.wall = time.perf_counter() - self._start
+
+    async def _run(self):
+        while True:
+            self.rss_samples.append(self.stats_fn()["rss_mb"])
+            await asyncio.sleep(self.interval)
+
+    def summary(self) -> dict:
+        return {
+            "cpu_seconds": round(self.cpu_seconds, 3),
+            "cpu_percent": round(self.cpu_seconds * 100 / max(self.wall, 1e-9), 1),
+            "rss_peak_mb": round(max(self.rss_samples, default=0.0), 1),
+        }
+
+
+@dataclass
+class OfflineEnvironment:
+    """一组启动好的替身服务"""
+    qwen_config: MockQwenConfig
+    qwen_stats: MockQwenStats
+    s3: LocalS3
+    grpc_stats: FakeAnalysisStats
+    stand_ins: StandIns
+    _servers: List = field(default_factory=list)
+
+    async def close(self):
+        for server in self._servers:
+            if isinstance(server, uvicorn.Server):
+                server.should_exit = True
+            else:
+                await server.stop(grace=None)
+        await asyncio.sleep(0.1)
+
+
+async def start_offline_environment(qwen_config: MockQwenConfig, grpc_latency: float = 0.0) -> OfflineEnvironment:
+    """启动 Mock Qwen、Local S3 和 gRPC 替身"""
+    pythonpath = ensure_protobuf()
+
+    qwen_stats = MockQwenStats()
+    qwen_port = free_port()
+    qwen_server = await start_uvicorn(build_mock_qwen_app(qwen_config, qwen_stats), qwen_port)
+
+    s3 = LocalS3()
+    s3_port = free_port()
+    s3_server = await start_uvicorn(s3.app(), s3_port)
+
+    grpc_port = free_port()
+    grpc_server, grpc_stats = await start_fake_analysis_service(grpc_port, grpc_latency)
+
+    return OfflineEnvironment(
+        qwen_config=qwen_config,
+        qwen_stats=qwen_stats,
+        s3=s3,
+        grpc_stats=grpc_stats,
+        stand_ins=StandIns(
+            qwen_url=f"http://127.0.0.1:{qwen_port}/api/v1/services/aigc/multimodal-generation/generation",
+            grpc_port=grpc_port,
+            s3_url=f"http://127.0.0.1:{s3_port}",
+            pythonpath=pythonpath,
+        ),
+        _servers=[qwen_server, s3_server, grpc_server],
+    )
+
+
+def generate_test_video(path: str, duration: float, size: str = "1280x720", fps: int = 15,
+                        gop: int = 150, source: str = "testsrc2", live: bool = False) -> str:
+    """
+    用 ffmpeg lavfi 生成合成测试视频（需要本机安装 ffmpeg）
+
+    live=True 时经管道写出 WebM，与浏览器 MediaRecorder 的输出一样没有 Cues 和总时长，
+    按字节截断后仍可解码（模拟录制中的文件）。
+    """
+    codec = ["-c:v", "libvpx", "-b:v", "1M"] if path.endswith(".webm") else ["-c:v", "libx264", "-preset", "ultrafast"]
+    cmd = [
+        "ffmpeg", "-v", "error", "-y",
+        "-f", "lavfi", "-i", f"{source}=size={size}:rate={fps}:duration={duration}",
+        *codec, "-g", str(gop), "-pix_fmt", "yuv420p",
+    ]
+    if live:
+        with open(path, "wb") as f:
+            subprocess.run([*cmd, "-f", "webm", "pipe:1"], stdout=f, check=True)
+    else:
+        subprocess.run([*cmd, path], check=True)
+    return path
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
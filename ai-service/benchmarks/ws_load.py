@@ -0,0 +1,345 @@
+"""
+WebSocket 实时会话压测
+
+同时打开 N 个 /ws/analyze/{session_id} 连接，每个会话按固定帧率推送帧，统计：
+- lag: 发送帧到服务端开始分析该帧（收到帧标记）的排队延迟
+- first token: 发送帧到收到该帧第一个 token
+- e2e: 发送帧到该帧最后一个 token
+- dropped: 始终没有被分析的帧（默认每帧都分析；WS_FRAME_QUEUE_SIZE > 0 时分析跟不上会丢弃最旧的帧）
+- 服务端资源：本地进程的 CPU/RSS（--offline 或 --server-pid），以及 /metrics 中的帧队列深度
+- cache hits: 帧请求命中分析结果缓存的次数（--static 时每个会话反复发送同一帧，模拟静止屏幕）。
+  上下文参与缓存键，默认完整上下文下同一会话内不会命中；RESULT_CACHE_FRAME_CONTEXT_DEPTH=2
+  时，最近两条摘要相同后才命中
+
+--sessions 可以是逗号分隔的多个并发级别（例如 1,2,4,8,16），依次运行并给出
+lag p95 不超过 --max-lag 的最大会话数，用于容量规划。
+
+用法（在 ai-service 目录下）：
+    # 离线：启动 Mock Qwen / gRPC / S3 替身和 ai-service 子进程
+    python -m benchmarks.ws_load --offline --sessions 1,4,16 --fps 1 --seconds 20
+    # 压测已运行的服务
+    python -m benchmarks.ws_load --url ws://localhost:8000 --sessions 8 --frames-dir ./debug_frames/abc
+    # 静止屏幕：上下文条数调小后，同一会话内重复的帧在上下文也重复时命中结果缓存
+    RESULT_CACHE_FRAME_CONTEXT_DEPTH=2 python -m benchmarks.ws_load --offline --sessions 1 --fps 0.5 --seconds 10 --static
+"""
+import argparse
+import asyncio
+import base64
+import glob
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import httpx
+
+from benchmarks.mock_services import (
+    MockQwenConfig, ResourceSampler, ServiceProcess, percentile, read_proc_stats, start_offline_environment
+)
+
+FRAME_MARKER = re.compile(r"📸 \[分析帧 (\d+)\]")
+SKIP_MARKER = re.compile(r"⏭ \[跳过帧 [\d-]+\]")
+
+
+@dataclass
+class FrameTiming:
+    sent: float
+    started: Optional[float] = None      # 收到帧标记
+    first_token: Optional[float] = None
+    done: Optional[float] = None         # 该帧最后一条消息
+
+
+@dataclass
+class SessionResult:
+    session_id: str
+    frames: Dict[int, FrameTiming] = field(default_factory=dict)
+    errors: int = 0
+    connect_error: Optional[str] = None
+
+    @property
+    def sent(self) -> int:
+        return len(self.frames)
+
+    @property
+    def analyzed(self) -> int:
+        return sum(1 for f in self.frames.values() if f.started is not None)
+
+    def lags(self) -> List[float]:
+        return [f.started - f.sent for f in self.frames.values() if f.started is not None]
+
+    def first_tokens(self) -> List[float]:
+        return [f.first_token - f.sent for f in self.frames.values() if f.first_token is not None]
+
+    def e2e(self) -> List[float]:
+        return [f.done - f.sent for f in self.frames.values() if f.done is not None]
+
+
+def load_frames(frames_dir: Optional[str], size: str, count: int, frame_kb: int) -> List[str]:
+    """
+    准备 base64 帧：优先读取目录中的图片，否则用 ffmpeg 生成测试图，没有 ffmpeg 时使用随机字节
+
+    Returns:
+        base64 字符串列表（会话按顺序循环使用）
+    """
+    if frames_dir:
+        paths = sorted(p for ext in ("*.jpg", "*.jpeg", "*.png") for p in glob.glob(os.path.join(frames_dir, ext)))
+        if not paths:
+            raise SystemExit(f"No images found in {frames_dir}")
+    elif shutil.which("ffmpeg"):
+        workdir = tempfile.mkdtemp(prefix="streammind-frames-")
+        subprocess.run([
+            "ffmpeg", "-v", "error", "-y",
+            "-f", "lavfi", "-i", f"testsrc2=size={size}:rate=1:duration={count}",
+            "-q:v", "5", os.path.join(workdir, "frame_%04d.jpg"),
+        ], check=True)
+        paths = sorted(glob.glob(os.path.join(workdir, "*.jpg")))
+    else:
+        return [base64.b64encode(os.urandom(frame_kb * 1024)).decode("ascii")]
+
+    frames = []
+    for path in paths:
+        with open(path, "rb") as f:
+            frames.append(base64.b64encode(f.read()).decode("ascii"))
+    return frames
+
+
+async def run_session(ws_url: str, index: int, frames: List[str], args) -> SessionResult:
+    """一个会话：按 args.fps 推送帧，之后等待排空"""
+    import websockets
+
+    result = SessionResult(session_id=f"load-{index}-{uuid.uuid4().hex[:6]}")
+    last_message_at = time.perf_counter()
+
+    try:
+        ws = await websockets.connect(f"{ws_url}/ws/analyze/{result.session_id}", max_size=None)
+    except Exception as e:
+        result.connect_error = str(e)
+        return result
+
+    async def receiver():
+        nonlocal last_message_at
+        current: Optional[FrameTiming] = None
+        async for message in ws:
+            now = time.perf_counter()
+            last_message_at = now
+            match = FRAME_MARKER.search(message)
+            if match:
+                current = result.frames.get(int(match.group(1)))
+                if current:
+                    current.started = now
+                continue
+            if SKIP_MARKER.search(message):
+                continue
+            if message.startswith("ERROR") or "[ERROR]" in message:
+                result.errors += 1
+            if current:
+                if current.first_token is None:
+                    current.first_token = now
+                current.done = now
+
+    receive_task = asyncio.create_task(receiver())
+    try:
+        total = args.frames or int(args.seconds * args.fps)
+        start = time.perf_counter()
+        for n in range(1, total + 1):
+            # 按绝对时间表发送，避免 send 变慢时帧率漂移
+            delay = start + (n - 1) / args.fps - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            result.frames[n] = FrameTiming(sent=time.perf_counter())
+            await ws.send(frames[(index + n) % len(frames)])
+
+        # 排空：所有帧都开始分析且一段时间没有新消息，或超时
+        deadline = time.perf_counter() + args.drain_timeout
+        while time.perf_counter() < deadline and not receive_task.done():
+            idle = time.perf_counter() - last_message_at
+            # 最后一帧不会被丢弃，它开始分析后其余未分析的帧都已被服务端丢弃
+            last = result.frames.get(result.sent)
+            if last and last.started is not None and idle >= args.drain_idle:
+                break
+            await asyncio.sleep(0.1)
+    except Exception as e:
+        result.connect_error = str(e)
+    finally:
+        receive_task.cancel()
+        await ws.close()
+    return result
+
+
+async def sample_queue_depth(base_url: str, samples: List[float], interval: float = 1.0):
+    """定时抓取 /metrics 中的帧队列深度"""
+    async with httpx.AsyncClient(base_url=base_url, timeout=5.0) as client:
+        while True:
+            try:
+                text = (await client.get("/metrics")).text
+                match = re.search(r"^streammind_frame_queue_depth (\S+)$", text, re.MULTILINE)
+                if match:
+                    samples.append(float(match.group(1)))
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(interval)
+
+
+async def read_frame_cache_hits(base_url: str) -> float:
+    """/metrics 中帧请求的结果缓存命中次数（内存 + 磁盘）"""
+    async with httpx.AsyncClient(base_url=base_url, timeout=5.0) as client:
+        text = (await client.get("/metrics")).text
+    pattern = r'^streammind_result_cache_lookups_total\{mode="frame",result="(?:memory|disk)"\} (\S+)$'
+    return sum(float(v) for v in re.findall(pattern, text, re.MULTILINE))
+
+
+async def run_step(ws_url: str, http_url: str, sessions: int, frames: List[str], args, stats_fn) -> dict:
+    """以 sessions 个并发会话运行一轮"""
+    queue_depths: List[float] = []
+    depth_task = asyncio.create_task(sample_queue_depth(http_url, queue_depths))
+
+    async def delayed(i: int):
+        await asyncio.sleep(args.ramp * i / max(sessions, 1))
+        return await run_session(ws_url, i, frames, args)
+
+    sampler = ResourceSampler(stats_fn) if stats_fn else None
+    cache_hits_before = await read_frame_cache_hits(http_url)
+    start = time.perf_counter()
+    if sampler:
+        async with sampler:
+            results = await asyncio.gather(*(delayed(i) for i in range(sessions)))
+    else:
+        results = await asyncio.gather(*(delayed(i) for i in range(sessions)))
+    wall = time.perf_counter() - start
+    depth_task.cancel()
+    cache_hits = await read_frame_cache_hits(http_url) - cache_hits_before
+
+    lags = [v for r in results for v in r.lags()]
+    first_tokens = [v for r in results for v in r.first_tokens()]
+    e2e = [v for r in results for v in r.e2e()]
+    sent = sum(r.sent for r in results)
+    analyzed = sum(r.analyzed for r in results)
+
+    summary = {
+        "sessions": sessions,
+        "connect_errors": sum(1 for r in results if r.connect_error),
+        "frames_sent": sent,
+        "frames_analyzed": analyzed,
+        "frames_dropped": sent - analyzed,
+        "model_errors": sum(r.errors for r in results),
+        "cache_hits": int(cache_hits),
+        "wall_seconds": round(wall, 2),
+        "lag_p50_ms": round(percentile(lags, 50) * 1000, 1),
+        "lag_p95_ms": round(percentile(lags, 95) * 1000, 1),
+        "lag_max_ms": round(max(lags, default=0.0) * 1000, 1),
+        "first_token_p50_ms": round(percentile(first_tokens, 50) * 1000, 1),
+        "first_token_p95_ms": round(percentile(first_tokens, 95) * 1000, 1),
+        "e2e_p50_ms": round(percentile(e2e, 50) * 1000, 1),
+        "e2e_p95_ms": round(percentile(e2e, 95) * 1000, 1),
+        "queue_depth_max": max(queue_depths, default=0.0),
+        "per_session": [
+            {
+                "session_id": r.session_id,
+                "sent": r.sent,
+                "analyzed": r.analyzed,
+                "lag_p95_ms": round(percentile(r.lags(), 95) * 1000, 1),
+                "first_token_p50_ms": round(percentile(r.first_tokens(), 50) * 1000, 1),
+                "error": r.connect_error,
+            }
+            for r in results
+        ],
+    }
+    if sampler:
+        summary.update(sampler.summary())
+    return summary
+
+
+def print_step(summary: dict):
+    resources = ""
+    if "cpu_percent" in summary:
+        resources = f"  cpu {summary['cpu_percent']:5.1f}%  rss {summary['rss_peak_mb']:6.1f}MB"
+    print(
+        f"sessions {summary['sessions']:3d}  sent {summary['frames_sent']:5d}  dropped {summary['frames_dropped']:4d}  "
+        f"lag p50/p95 {summary['lag_p50_ms']:8.1f}/{summary['lag_p95_ms']:8.1f}ms  "
+        f"first token p50/p95 {summary['first_token_p50_ms']:8.1f}/{summary['first_token_p95_ms']:8.1f}ms  "
+        f"queue max {summary['queue_depth_max']:4.0f}  cache hits {summary['cache_hits']:4d}{resources}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Concurrent WebSocket load generator for /ws/analyze")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="Base URL of a running service, e.g. ws://localhost:8000")
+    target.add_argument("--offline", action="store_true", help="Start mocks and an ai-service subprocess")
+    parser.add_argument("--server-pid", type=int, help="Sample CPU/RSS of this local process (with --url)")
+    parser.add_argument("--sessions", default="4", help="Concurrent sessions; comma separated to step up")
+    parser.add_argument("--fps", type=float, default=1.0)
+    parser.add_argument("--seconds", type=float, default=20.0, help="Sending duration per session")
+    parser.add_argument("--frames", type=int, default=0, help="Frames per session (overrides --seconds)")
+    parser.add_argument("--ramp", type=float, default=1.0, help="Spread session starts over this many seconds")
+    parser.add_argument("--frames-dir", help="Directory of JPEG/PNG frames to send")
+    parser.add_argument("--size", default="1280x720", help="Size of generated frames")
+    parser.add_argument("--frame-kb", type=int, default=80, help="Random payload size when ffmpeg is unavailable")
+    parser.add_argument("--drain-timeout", type=float, default=60.0)
+    parser.add_argument("--drain-idle", type=float, default=2.0, help="Quiet period that ends the drain")
+    parser.add_argument("--max-lag", type=float, default=2.0, help="Capacity threshold for lag p95 (s)")
+    # 离线替身参数
+    parser.add_argument("--ttft", type=float, default=0.8)
+    parser.add_argument("--tokens-per-second", type=float, default=40.0)
+    parser.add_argument("--tokens-per-response", type=int, default=40)
+    parser.add_argument("--replay", help="Recording archive for QWEN_REPLAY_DIR (with --offline)")
+    parser.add_argument("--json", help="Write all step results to this file")
+    parser.add_argument("--static", action="store_true", help="Send the same frame every time (static screen)")
+    args = parser.parse_args()
+
+    levels = [int(n) for n in args.sessions.split(",") if n.strip()]
+    frames = load_frames(args.frames_dir, args.size, count=30, frame_kb=args.frame_kb)
+    if args.static:
+        frames = frames[:1]
+    print(f"Prepared {len(frames)} frames, avg {sum(map(len, frames)) / len(frames) / 1024:.0f} KiB base64")
+
+    env = service = None
+    stats_fn = None
+    if args.offline:
+        env = await start_offline_environment(MockQwenConfig(
+            ttft=args.ttft,
+            tokens_per_second=args.tokens_per_second,
+            tokens_per_response=args.tokens_per_response,
+        ))
+        extra_env = {"QWEN_REPLAY_DIR": os.path.abspath(args.replay)} if args.replay else {}
+        service = ServiceProcess(env.stand_ins, extra_env=extra_env)
+        await service.start()
+        http_url = service.base_url
+        stats_fn = service.stats
+    else:
+        http_url = args.url.replace("ws://", "http://").replace("wss://", "https://").rstrip("/")
+        if args.server_pid:
+            stats_fn = lambda: read_proc_stats(args.server_pid)
+    ws_url = http_url.replace("http://", "ws://").replace("https://", "wss://")
+
+    results = []
+    try:
+        for sessions in levels:
+            summary = await run_step(ws_url, http_url, sessions, frames, args, stats_fn)
+            results.append(summary)
+            print_step(summary)
+    finally:
+        if service:
+            service.stop()
+        if env:
+            await env.close()
+
+    passing = [r["sessions"] for r in results
+               if r["lag_p95_ms"] <= args.max_lag * 1000 and r["frames_dropped"] == 0 and not r["connect_errors"]]
+    print(f"\nCapacity (lag p95 <= {args.max_lag:.1f}s, no drops): "
+          f"{max(passing) if passing else 'below ' + str(levels[0])} sessions at {args.fps:g} fps")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"fps": args.fps, "max_lag": args.max_lag, "steps": results}, f, indent=2, ensure_ascii=False)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,11 @@
+"""
+单元测试：只覆盖不依赖外部服务的纯逻辑（缓存键、路由、窗口边界、队列、SSE 解析等）
+
+在 ai-service 目录下运行：
+    python -m pytest -q
+"""
+import os
+import sys
+
+# 允许直接运行 pytest（不经过 python -m）时导入 app 包
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
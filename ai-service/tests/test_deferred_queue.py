@@ -0,0 +1,133 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from dataclasses import asdict
+from datetime import datetime
+
+import pytest
+
+from app.deferred_queue import DeferredJob, DeferredQueue, DeferredScheduler, in_off_peak, parse_off_peak_hours
+
+
+def at(hour: int, minute: int = 0) -> datetime:
+    return datetime(2024, 1, 1, hour, minute)
+
+
+def dead_pid() -> int:
+    """一个已经退出的进程的 PID"""
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def job(session_id: str = "s1", deadline: float = None, **kwargs) -> DeferredJob:
+    return DeferredJob(session_id, f"/videos/{session_id}.mp4", deadline or time.time() + 86400, **kwargs)
+
+
+def test_parse_off_peak_hours():
+    assert parse_off_peak_hours("0-7, 22-24") == [(0, 7), (22, 24)]
+    assert parse_off_peak_hours("23-6.5") == [(23, 6.5)]
+    assert parse_off_peak_hours("") == []
+    with pytest.raises(ValueError):
+        parse_off_peak_hours("22-25")
+    with pytest.raises(ValueError):
+        parse_off_peak_hours("night")
+
+
+def test_off_peak_across_midnight():
+    ranges = parse_off_peak_hours("23-6.5")
+    assert in_off_peak(ranges, at(23))
+    assert in_off_peak(ranges, at(0, 30))
+    assert in_off_peak(ranges, at(6, 29))
+    assert not in_off_peak(ranges, at(6, 30))
+    assert not in_off_peak(ranges, at(12))
+    assert not in_off_peak(ranges, at(22, 59))
+
+
+def test_off_peak_plain_ranges():
+    ranges = parse_off_peak_hours("0-7,22-24")
+    assert in_off_peak(ranges, at(0))
+    assert not in_off_peak(ranges, at(7))
+    assert in_off_peak(ranges, at(23, 59))
+    assert not in_off_peak([], at(3))
+
+
+def test_only_one_worker_claims_a_job(tmp_path):
+    first = DeferredQueue(str(tmp_path))
+    second = DeferredQueue(str(tmp_path))
+    first.save(job())
+    queued = second.jobs()
+    assert first.claim(first.jobs()[0])
+    assert not second.claim(queued[0])
+    assert first.jobs() == []
+    assert [j.session_id for j in first.running_jobs()] == ["s1"]
+    assert "s1" in second
+
+
+def test_jobs_of_a_dead_process_are_requeued(tmp_path):
+    orphan_dir = tmp_path / "running" / str(dead_pid())
+    orphan_dir.mkdir(parents=True)
+    (orphan_dir / "s1.json").write_text(json.dumps(asdict(job(attempts=1, started_at=time.time()))))
+    (orphan_dir / "leftover.tmp").write_text("")
+
+    queue = DeferredQueue(str(tmp_path))
+    assert [(j.session_id, j.attempts) for j in queue.jobs()] == [("s1", 1)]
+    assert not orphan_dir.exists()
+
+
+def test_jobs_of_a_live_process_are_left_alone(tmp_path):
+    # 父进程（pytest 的启动进程）仍在运行
+    other_dir = tmp_path / "running" / str(os.getppid())
+    other_dir.mkdir(parents=True)
+    (other_dir / "s1.json").write_text(json.dumps(asdict(job())))
+
+    queue = DeferredQueue(str(tmp_path))
+    assert queue.jobs() == []
+    assert [j.session_id for j in queue.running_jobs()] == ["s1"]
+    # 另一个进程运行中的任务被取消：删除任务文件，由该进程下一次轮询时停止
+    assert queue.remove("s1")
+    assert "s1" not in queue
+
+
+def test_invalid_session_ids_are_rejected(tmp_path):
+    queue = DeferredQueue(str(tmp_path))
+    with pytest.raises(ValueError):
+        queue.save(job("../escape"))
+    assert "../escape" not in queue
+    assert not queue.remove("../escape")
+
+
+def test_failed_job_backs_off_before_it_is_claimed_again(tmp_path):
+    async def failing(_job):
+        raise RuntimeError("boom")
+
+    async def run():
+        queue = DeferredQueue(str(tmp_path))
+        scheduler = DeferredScheduler(
+            queue, failing, load_score=lambda: 0.0, deadline_margin=0, max_attempts=3, retry_backoff=60
+        )
+        # 截止时间已到：通常会立即执行
+        scheduler.submit(job(deadline=time.time() - 1))
+        assert scheduler.dispatch() == 1
+        await asyncio.gather(*scheduler.running.values(), return_exceptions=True)
+
+        requeued = queue.jobs()[0]
+        assert requeued.attempts == 1
+        assert requeued.not_before == pytest.approx(time.time() + 60, abs=5)
+        assert scheduler.dispatch() == 0
+        assert scheduler.dispatch(now=requeued.not_before + 1) == 1
+        await asyncio.gather(*scheduler.running.values(), return_exceptions=True)
+        # 第二次失败后等待时间翻倍
+        assert queue.jobs()[0].not_before == pytest.approx(time.time() + 120, abs=5)
+
+    asyncio.run(run())
+
+
+def test_job_files_without_backoff_field_still_load(tmp_path):
+    legacy = asdict(job())
+    del legacy["not_before"]
+    (tmp_path / "s1.json").write_text(json.dumps(legacy))
+    assert DeferredQueue(str(tmp_path)).jobs()[0].not_before == 0.0
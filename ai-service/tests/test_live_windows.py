@@ -0,0 +1,113 @@
+import asyncio
+import shutil
+import subprocess
+
+import pytest
+
+from app.config import settings
+from app.live_recording import LiveRecording
+from app.video_pipeline import VideoAnalysisPipeline, _RunState
+from app.video_processor import VideoProcessor
+
+
+class ScriptedProcessor(VideoProcessor):
+    """available_duration 按文件长度返回预设时长，并记录每次探测的 since"""
+
+    def __init__(self, durations, tmp_path):
+        super().__init__(window_size=15.0, step_size=10.0, output_dir=str(tmp_path / "windows"))
+        self.durations = durations
+        self.probes = []
+
+    def available_duration(self, video_path, since=0.0):
+        self.probes.append(since)
+        with open(video_path, "rb") as f:
+            size = len(f.read())
+        return max(since, self.durations.get(size, 0.0))
+
+
+def run_live(tmp_path, monkeypatch, steps, final_size):
+    """按 steps [(文件长度, 可解码时长)] 逐步写入录制文件，结束后返回分析过的窗口、处理器和结果"""
+    monkeypatch.setattr(settings, "ingest_poll_seconds", 0.01)
+    path = tmp_path / "live.webm"
+    path.write_bytes(b"")
+    recording = LiveRecording("s1", str(path))
+    processor = ScriptedProcessor(dict(steps), tmp_path)
+    pipeline = VideoAnalysisPipeline(None, None, None, processor, None)
+    windows = []
+
+    async def fake_window(state, video_path, index, start, end, total):
+        windows.append((index, start, end, recording.complete))
+
+    pipeline._run_window = fake_window
+
+    async def writer():
+        for size, _ in steps:
+            path.write_bytes(b"x" * size)
+            await asyncio.sleep(0.05)
+        path.write_bytes(b"x" * final_size)
+        await asyncio.sleep(0.05)
+        recording.finish()
+
+    async def main():
+        task = asyncio.create_task(writer())
+        result = await pipeline._run_live_windows(_RunState(session_id="s1"), recording, None)
+        await task
+        return result
+
+    return windows, processor, asyncio.run(main())
+
+
+def test_live_windows_match_the_fixed_plan(tmp_path, monkeypatch):
+    steps = [(100, 12.0), (200, 26.5), (300, 41.0), (400, 58.0)]
+    windows, processor, result = run_live(tmp_path, monkeypatch, steps + [(500, 63.0)], 500)
+
+    expected = processor.plan_windows(63.0)
+    assert [(i, s, e) for i, s, e, _ in windows] == expected
+    assert result.total_windows == len(expected)
+    # 完整的窗口在录制结束前就已分析（留 1 秒余量）
+    live = [(i, s, e) for i, s, e, complete in windows if not complete]
+    assert live and all(e <= 58.0 - 1.0 for _, _, e in live)
+
+
+def test_probe_is_incremental_and_skipped_when_the_file_is_unchanged(tmp_path, monkeypatch):
+    steps = [(100, 12.0), (200, 26.5), (300, 41.0)]
+    _, processor, _ = run_live(tmp_path, monkeypatch, steps, 300)
+
+    # 每次探测都从上次的结果开始
+    assert processor.probes[0] == 0.0
+    assert processor.probes == sorted(processor.probes)
+    assert set(processor.probes) <= {0.0, 12.0, 26.5, 41.0}
+    # 文件长度只变化了 3 次（再加上空文件），等待期间不重复探测
+    assert len(processor.probes) <= 4
+
+
+def test_available_duration_keeps_the_last_value_on_probe_failure(tmp_path, monkeypatch):
+    processor = VideoProcessor(output_dir=str(tmp_path))
+
+    def timeout(cmd, **kwargs):
+        raise subprocess.TimeoutExpired(cmd, kwargs.get("timeout"))
+
+    monkeypatch.setattr(subprocess, "run", timeout)
+    assert processor.available_duration("missing.webm", 42.0) == 42.0
+
+    def missing(cmd, **kwargs):
+        raise FileNotFoundError("ffprobe")
+
+    monkeypatch.setattr(subprocess, "run", missing)
+    assert processor.available_duration("missing.webm", 7.5) == 7.5
+
+
+@pytest.mark.skipif(not (shutil.which("ffmpeg") and shutil.which("ffprobe")), reason="ffmpeg not installed")
+def test_incremental_probe_matches_full_probe(tmp_path):
+    path = str(tmp_path / "live.webm")
+    with open(path, "wb") as f:
+        # 经管道写出的 WebM 与 MediaRecorder 一样没有 Cues
+        subprocess.run([
+            "ffmpeg", "-v", "error", "-f", "lavfi", "-i", "testsrc=size=160x90:rate=10", "-t", "30",
+            "-c:v", "libvpx", "-deadline", "realtime", "-g", "50", "-f", "webm", "pipe:1"
+        ], stdout=f, check=True)
+    processor = VideoProcessor(output_dir=str(tmp_path))
+
+    full = processor.available_duration(path)
+    assert full == pytest.approx(29.9, abs=0.2)
+    assert processor.available_duration(path, 20.0) == full
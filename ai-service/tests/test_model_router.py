@@ -0,0 +1,129 @@
+import asyncio
+
+from app.key_pool import ApiKeyPool, ApiKeyState
+from app.model_router import RETRACTION_MARKER, ModelRouter, RoutingSignals, strip_retracted
+from app.qwen_client import QwenVisionClient
+from app.result_cache import ResultCache
+
+GOOD = "用户在编辑器中新建了一个文件并开始输入代码"
+LOW_CONFIDENCE = "画面中似乎打开了一个窗口，但内容看不清，无法确定具体操作"
+
+STATIC = RoutingSignals(change=0.1)
+ACTIVE = RoutingSignals(change=30.0)
+
+
+def make_client(cache=None):
+    router = ModelRouter(max_model="max", fast_model="fast", fast_max_change=0.5, min_chars=10)
+    pool = ApiKeyPool([ApiKeyState(key="test", endpoint="http://localhost")])
+    return QwenVisionClient(key_pool=pool, cache=cache or ResultCache(), router=router)
+
+
+def fake_stream(answers, calls):
+    """按模型返回预设回答，每个字一个 token；记录调用顺序和已输出的 token 数"""
+    async def stream(payload):
+        calls.append(payload["model"])
+        for char in answers[payload["model"]]:
+            yield char
+    return stream
+
+
+def collect(client, routing, stream, payload=None):
+    async def run():
+        return [t async for t in client._routed(payload or {"model": "max", "input": {}}, "frame", routing, stream)]
+    return asyncio.run(run())
+
+
+def test_route_decisions():
+    router = ModelRouter("max", "fast", fast_max_change=0.5)
+    assert router.route(None).tier == "max"
+    assert router.route(RoutingSignals()).reason == "no_signal"
+    assert router.route(RoutingSignals(change=0.1, priority="high")).reason == "high_priority"
+    assert router.route(ACTIVE).reason == "active"
+    assert router.route(STATIC).tier == "fast"
+
+
+def test_prefix_reasons():
+    router = ModelRouter("max", "fast", min_chars=10)
+    assert router.prefix_escalation_reason("用户") == "pending"
+    assert router.prefix_escalation_reason("[ERROR] timeout") == "error"
+    assert router.prefix_escalation_reason("看不清") == "low_confidence"
+    assert router.prefix_escalation_reason(GOOD) is None
+    assert router.escalation_reason("没有变化") == "too_short"
+
+
+def test_good_fast_answer_streams_without_max_call():
+    calls = []
+    tokens = collect(make_client(), STATIC, fake_stream({"fast": GOOD, "max": "unused"}, calls))
+    assert "".join(tokens) == GOOD
+    assert calls == ["fast"]
+
+
+def test_fast_tokens_pass_through_after_prefix():
+    seen = []
+
+    async def stream(payload):
+        for char in GOOD:
+            seen.append(char)
+            yield char
+
+    # 逐个消费：前缀放行后，每取一个 token 上游只多产生一个
+    async def consume():
+        client = make_client()
+        gen = client._routed({"model": "max", "input": {}}, "frame", STATIC, stream)
+        first = await gen.__anext__()
+        produced_at_first = len(seen)
+        second = await gen.__anext__()
+        await gen.aclose()
+        return first, second, produced_at_first, len(seen)
+
+    first, second, at_first, at_second = asyncio.run(consume())
+    assert first + second == GOOD[:2]
+    assert at_first == 10  # min_chars 个字的前缀
+    assert at_second == at_first
+
+
+def test_short_or_failed_prefix_escalates_silently():
+    for fast_answer in ("没有变化", "[ERROR] Request timed out"):
+        calls = []
+        tokens = collect(make_client(), STATIC, fake_stream({"fast": fast_answer, "max": GOOD}, calls))
+        assert "".join(tokens) == GOOD
+        assert calls == ["fast", "max"]
+
+
+def test_low_confidence_after_prefix_is_retracted():
+    calls = []
+    answer = "用户切换到了另一个窗口，" + "但是窗口里的内容看不清"
+    tokens = collect(make_client(), STATIC, fake_stream({"fast": answer, "max": GOOD}, calls))
+    text = "".join(tokens)
+    assert text == answer + RETRACTION_MARKER + GOOD
+    assert strip_retracted(text) == GOOD
+    assert calls == ["fast", "max"]
+
+
+def test_only_max_answers_are_cached():
+    cache = ResultCache()
+    client = make_client(cache)
+    payload = {"model": "max", "input": {"messages": [{"role": "user", "content": [{"image": "a"}]}]}}
+
+    calls = []
+    collect(client, STATIC, fake_stream({"fast": GOOD, "max": "max answer is long enough"}, calls), payload)
+    # 快速档回答没有写入缓存，最强模型仍会被调用
+    tokens = collect(client, ACTIVE, fake_stream({"fast": GOOD, "max": "max answer is long enough"}, calls), payload)
+    assert "".join(tokens) == "max answer is long enough"
+    assert calls == ["fast", "max"]
+
+    # 最强模型的回答已缓存，快速档请求直接命中
+    tokens = collect(client, STATIC, fake_stream({"fast": GOOD, "max": "unused"}, calls), payload)
+    assert "".join(tokens) == "max answer is long enough"
+    assert calls == ["fast", "max"]
+
+
+def test_escalated_max_answer_is_cached():
+    cache = ResultCache()
+    client = make_client(cache)
+    payload = {"model": "max", "input": {"messages": [{"role": "user", "content": [{"image": "b"}]}]}}
+    calls = []
+    collect(client, STATIC, fake_stream({"fast": "没有变化", "max": GOOD}, calls), payload)
+    tokens = collect(client, ACTIVE, fake_stream({"fast": "", "max": "unused"}, calls), payload)
+    assert "".join(tokens) == GOOD
+    assert calls == ["fast", "max"]
@@ -0,0 +1,88 @@
+import asyncio
+import os
+
+from app.result_cache import ResultCache, content_digest
+
+PROMPT = "请描述相对于历史的变化"
+
+
+def frame_payload(image: str, context=(), model: str = "qwen-vl-max") -> dict:
+    messages = [
+        {"role": "assistant", "content": [{"text": text}]} for text in context
+    ]
+    messages.append({"role": "user", "content": [{"image": image}, {"text": PROMPT}]})
+    return {"model": model, "input": {"messages": messages}}
+
+
+def test_identical_requests_share_a_key():
+    cache = ResultCache()
+    assert cache.key(frame_payload("img-a", ["[帧1分析] 桌面"]), "v1", mode="frame") == \
+        cache.key(frame_payload("img-a", ["[帧1分析] 桌面"]), "v1", mode="frame")
+
+
+def test_context_is_part_of_frame_keys_by_default():
+    cache = ResultCache()
+    first = cache.key(frame_payload("img-a"), "v1", mode="frame")
+    later = cache.key(frame_payload("img-a", ["[帧1分析] 桌面上打开了编辑器"]), "v1", mode="frame")
+    assert first != later
+
+
+def test_frame_numbers_and_whitespace_are_normalized():
+    cache = ResultCache()
+    a = cache.key(frame_payload("img-a", ["[帧3分析]  没有变化"]), "v1", mode="frame")
+    b = cache.key(frame_payload("img-a", ["[帧7分析] 没有变化\n"]), "v1", mode="frame")
+    assert a == b
+
+
+def test_different_summaries_give_different_keys():
+    cache = ResultCache()
+    a = cache.key(frame_payload("img-a", ["[帧1分析] 没有变化"]), "v1", mode="frame")
+    b = cache.key(frame_payload("img-a", ["[帧1分析] 打开了浏览器"]), "v1", mode="frame")
+    assert a != b
+
+
+def test_context_depth_limits_the_fingerprint():
+    cache = ResultCache(frame_context_depth=1)
+    a = cache.key(frame_payload("img-a", ["[帧1分析] 初始画面", "[帧2分析] 没有变化"]), "v1", mode="frame")
+    b = cache.key(frame_payload("img-a", ["[帧5分析] 另一段历史", "[帧6分析] 没有变化"]), "v1", mode="frame")
+    assert a == b
+    # 视频请求仍使用完整上下文
+    assert cache.key(frame_payload("img-a", ["x", "y"]), "v1") != cache.key(frame_payload("img-a", ["z", "y"]), "v1")
+
+
+def test_frame_depth_defaults_to_context_depth():
+    assert ResultCache(context_depth=3).frame_context_depth == 3
+
+
+def test_prompt_version_model_and_image_change_the_key():
+    cache = ResultCache()
+    base = cache.key(frame_payload("img-a"), "v1", mode="frame")
+    assert base != cache.key(frame_payload("img-a"), "v2", mode="frame")
+    assert base != cache.key(frame_payload("img-a", model="qwen-vl-plus"), "v1", mode="frame")
+    assert base != cache.key(frame_payload("img-b"), "v1", mode="frame")
+
+
+def test_video_urls_need_a_content_digest():
+    cache = ResultCache()
+    payload = {"model": "m", "input": {"messages": [
+        {"role": "user", "content": [{"video": "https://minio/window-1.mp4"}, {"text": PROMPT}]}
+    ]}}
+    assert cache.key(payload, "v1") is None
+    digest = content_digest(b"window bytes")
+    other = {"model": "m", "input": {"messages": [
+        {"role": "user", "content": [{"video": "https://minio/window-2.mp4"}, {"text": PROMPT}]}
+    ]}}
+    # 上传地址每次不同，按内容摘要命中
+    assert cache.key(payload, "v1", digest) == cache.key(other, "v1", digest)
+
+
+def test_disk_tier_round_trip(tmp_path):
+    async def run():
+        writer = ResultCache(disk_dir=str(tmp_path))
+        await writer.store("ab" * 32, ["你", "好"], "frame")
+        reader = ResultCache(disk_dir=str(tmp_path))
+        return await reader.lookup("ab" * 32, "frame")
+
+    assert asyncio.run(run()) == ["你", "好"]
+    leftovers = [name for _, _, files in os.walk(tmp_path) for name in files if name.endswith(".tmp")]
+    assert leftovers == []
@@ -0,0 +1,87 @@
+import asyncio
+import json
+
+import pytest
+
+from app.sse_parser import SSEParser, iter_dashscope_chunks
+
+STREAM = (
+    ":HTTP_STATUS/200\n"
+    "id:1\n"
+    "event:result\n"
+    'data:{"output":{"choices":[{"message":{"content":[{"text":"你好"}]},"finish_reason":"null"}]}}\n'
+    "\n"
+    "id:2\n"
+    "data: first line\n"
+    "data: second line\n"
+    "retry: 3000\n"
+    "\n"
+)
+
+NEWLINES = {"lf": "\n", "crlf": "\r\n", "cr": "\r"}
+
+
+def parse(chunks):
+    parser = SSEParser()
+    events = []
+    for chunk in chunks:
+        events.extend(parser.feed(chunk))
+    events.extend(parser.flush())
+    return [(e.event, e.id, e.retry, e.data) for e in events]
+
+
+def encode(newline: str) -> bytes:
+    return STREAM.replace("\n", newline).encode("utf-8")
+
+
+EXPECTED = parse([encode("\n")])
+
+
+def test_lf_stream():
+    assert [e[:2] for e in EXPECTED] == [("result", "1"), ("message", "2")]
+    assert json.loads(EXPECTED[0][3])["output"]["choices"][0]["message"]["content"][0]["text"] == "你好"
+    assert EXPECTED[1][2:] == (3000, "first line\nsecond line")
+
+
+@pytest.mark.parametrize("newline", NEWLINES.values(), ids=NEWLINES.keys())
+def test_every_split_point_gives_the_same_events(newline):
+    raw = encode(newline)
+    assert parse([raw]) == EXPECTED
+    for split in range(1, len(raw)):
+        assert parse([raw[:split], raw[split:]]) == EXPECTED, f"split at {split}"
+
+
+@pytest.mark.parametrize("newline", NEWLINES.values(), ids=NEWLINES.keys())
+def test_byte_by_byte(newline):
+    raw = encode(newline)
+    assert parse([raw[i:i + 1] for i in range(len(raw))]) == EXPECTED
+
+
+def test_crlf_split_between_cr_and_lf_is_one_line_break():
+    # "\r" 在块尾时要等下一块，否则 "\r" + "\n" 会被当成两个换行（提前结束事件）
+    events = parse([b"data: a\r", b"\ndata: b\r\n\r\n"])
+    assert events == [("message", None, None, "a\nb")]
+
+
+def test_mixed_newlines_and_unterminated_event():
+    events = parse([b"data: a\n\r\ndata: b\r\rdata: c"])
+    assert [e[3] for e in events] == ["a", "b", "c"]
+
+
+def test_iter_dashscope_chunks_with_cr_newlines():
+    body = "".join(
+        f'data:{{"output":{{"choices":[{{"message":{{"content":[{{"text":"{text}"}}]}},'
+        f'"finish_reason":"{reason}"}}]}}}}\r\r'
+        for text, reason in (("屏幕", "null"), ("变化", "stop"))
+    ).encode("utf-8")
+
+    async def byte_stream():
+        for i in range(0, len(body), 7):
+            yield body[i:i + 7]
+
+    async def collect():
+        return [chunk async for chunk in iter_dashscope_chunks(byte_stream())]
+
+    chunks = asyncio.run(collect())
+    assert [c.text for c in chunks] == ["屏幕", "变化"]
+    assert chunks[-1].is_finished